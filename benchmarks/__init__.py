@@ -0,0 +1 @@
+"""End-to-end benchmarks that run the CLI against a local fake Hetzner API."""
@@ -0,0 +1,324 @@
+"""In-process HTTP stand-in for the Hetzner firewalls and actions endpoints.
+
+Only what the sync touches is implemented: listing firewalls (by name and
+paginated), ``set_rules``, and reading an action. Latency, action duration and
+rate limiting are configurable, so a benchmark can approximate a slow region,
+a busy API, or a project that runs out of request budget mid-run.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import random
+import re
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, NamedTuple, cast
+from urllib.parse import parse_qs, urlsplit
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+    from typing_extensions import Self
+
+_SET_RULES = re.compile(r"^/v1/firewalls/(\d+)/actions/set_rules$")
+_ACTION = re.compile(r"^/v1/actions/(\d+)$")
+
+
+class FakeSettings(NamedTuple):
+    """Behaviour of the fake API.
+
+    Attributes:
+        latency: Seconds added to every response.
+        action_duration: Seconds a ``set_rules`` action stays running.
+        error_rate: Share of requests answered with a spurious 429.
+        budget: Requests per token before 429s; 0 disables the limit and the
+            ``RateLimit-*`` headers.
+        refill_per_second: Budget regained per second when ``budget`` is set.
+        seed: Seed for the 429 injection, so runs are repeatable.
+    """
+
+    latency: float = 0.0
+    action_duration: float = 0.0
+    error_rate: float = 0.0
+    budget: int = 0
+    refill_per_second: float = 1.0
+    seed: int = 0
+
+
+def seed_firewalls(count: int, rules: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Build ``count`` firewalls named ``fw-1`` … ``fw-<count>`` with ``rules``.
+
+    Args:
+        count: Number of firewalls.
+        rules: Rules every firewall starts with.
+
+    Returns:
+        list[dict[str, Any]]: Firewall payloads as the API returns them.
+    """
+    return [
+        {
+            "id": fw_id,
+            "name": f"fw-{fw_id}",
+            "labels": {},
+            "created": "2024-01-01T00:00:00+00:00",
+            "rules": json.loads(json.dumps(rules)),
+            "applied_to": [],
+        }
+        for fw_id in range(1, count + 1)
+    ]
+
+
+class _Budget:
+    """Server-side token bucket of one API token."""
+
+    def __init__(self, size: int, refill: float) -> None:
+        self.size = size
+        self.refill = refill
+        self.tokens = float(size)
+        self.updated = time.monotonic()
+
+    def take(self) -> tuple[bool, dict[str, str]]:
+        now = time.monotonic()
+        self.tokens = min(self.size, self.tokens + (now - self.updated) * self.refill)
+        self.updated = now
+        allowed = self.tokens >= 1
+        if allowed:
+            self.tokens -= 1
+        # Like Hetzner: the Unix time the bucket is full again, in whole seconds.
+        reset = math.ceil(time.time() + (self.size - self.tokens) / self.refill)
+        headers = {
+            "RateLimit-Limit": str(self.size),
+            "RateLimit-Remaining": str(int(self.tokens)),
+            "RateLimit-Reset": str(reset),
+        }
+        return allowed, headers
+
+
+class FakeHetzner:
+    """The fake API's state, shared by every request handler thread."""
+
+    def __init__(self, firewalls: list[dict[str, Any]], settings: FakeSettings) -> None:
+        """Seed the fake.
+
+        Args:
+            firewalls: Firewall payloads, see ``seed_firewalls``.
+            settings: Latency, action duration and rate limiting.
+        """
+        self.settings = settings
+        self.firewalls = {fw["id"]: fw for fw in firewalls}
+        self.by_name = {fw["name"]: fw for fw in firewalls}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.set_rules = 0
+        self._actions: dict[int, float] = {}
+        self._budgets: dict[str, _Budget] = {}
+        self._random = random.Random(settings.seed)  # ruff:ignore[suspicious-non-cryptographic-random-usage]
+
+    def admit(self, token: str) -> tuple[bool, dict[str, str]]:
+        """Count a request and decide whether it is rate limited.
+
+        Args:
+            token: Bearer token of the request.
+
+        Returns:
+            tuple[bool, dict[str, str]]: Whether to serve it, and the
+            ``RateLimit-*`` headers to send.
+        """
+        with self.lock:
+            self.requests += 1
+            headers: dict[str, str] = {}
+            allowed = True
+            if self.settings.budget:
+                budget = self._budgets.setdefault(
+                    token,
+                    _Budget(self.settings.budget, self.settings.refill_per_second),
+                )
+                allowed, headers = budget.take()
+            if allowed and self._random.random() < self.settings.error_rate:
+                allowed = False
+            if not allowed:
+                self.rate_limited += 1
+            return allowed, headers
+
+    def list_firewalls(self, query: dict[str, list[str]]) -> dict[str, Any]:
+        """Answer ``GET /firewalls``, by name or one page at a time.
+
+        Args:
+            query: Parsed query string.
+
+        Returns:
+            dict[str, Any]: Response payload.
+        """
+        if "name" in query:
+            fw = self.by_name.get(query["name"][0])
+            return {"firewalls": [fw] if fw else []}
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["25"])[0])
+        items = list(self.firewalls.values())
+        last_page = max(1, -(-len(items) // per_page))
+        return {
+            "firewalls": items[(page - 1) * per_page : page * per_page],
+            "meta": {
+                "pagination": {
+                    "page": page,
+                    "per_page": per_page,
+                    "previous_page": page - 1 or None,
+                    "next_page": page + 1 if page < last_page else None,
+                    "last_page": last_page,
+                    "total_entries": len(items),
+                }
+            },
+        }
+
+    def apply_rules(self, fw_id: int, body: dict[str, Any]) -> dict[str, Any] | None:
+        """Answer ``POST /firewalls/{id}/actions/set_rules``.
+
+        Args:
+            fw_id: Firewall ID from the path.
+            body: Request payload.
+
+        Returns:
+            dict[str, Any] | None: Response payload, or None for an unknown
+            firewall.
+        """
+        with self.lock:
+            fw = self.firewalls.get(fw_id)
+            if fw is None:
+                return None
+            fw["rules"] = body["rules"]
+            self.set_rules += 1
+            action_id = len(self._actions) + 1
+            self._actions[action_id] = time.monotonic()
+        return {"actions": [self.action(action_id)]}
+
+    def action(self, action_id: int) -> dict[str, Any] | None:
+        """Describe an action, running until ``action_duration`` has passed.
+
+        Args:
+            action_id: Action ID.
+
+        Returns:
+            dict[str, Any] | None: The action payload, or None if unknown.
+        """
+        started = self._actions.get(action_id)
+        if started is None:
+            return None
+        done = time.monotonic() - started >= self.settings.action_duration
+        return {
+            "id": action_id,
+            "command": "set_firewall_rules",
+            "status": "success" if done else "running",
+            "progress": 100 if done else 0,
+            "started": "2024-01-01T00:00:00+00:00",
+            "finished": None,
+            "resources": [],
+            "error": None,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes requests to the ``FakeHetzner`` attached to the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: object) -> None:  # ruff:ignore[builtin-argument-shadowing]
+        """Keep the benchmark output free of access logs."""
+
+    def _reply(
+        self, status: int, payload: dict[str, Any], headers: dict[str, str]
+    ) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method: str) -> None:
+        fake = cast("_Server", self.server).fake
+        if fake.settings.latency:
+            time.sleep(fake.settings.latency)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else {}
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        allowed, headers = fake.admit(token)
+        if not allowed:
+            error = {"code": "rate_limit_exceeded", "message": "limit reached"}
+            self._reply(HTTPStatus.TOO_MANY_REQUESTS, {"error": error}, headers)
+            return
+
+        url = urlsplit(self.path)
+        payload: dict[str, Any] | None = None
+        if method == "GET" and url.path == "/v1/firewalls":
+            payload = fake.list_firewalls(parse_qs(url.query))
+        elif method == "POST" and (match := _SET_RULES.match(url.path)):
+            payload = fake.apply_rules(int(match[1]), body)
+        elif method == "GET" and (match := _ACTION.match(url.path)):
+            action = fake.action(int(match[1]))
+            payload = {"action": action} if action else None
+        if payload is None:
+            error = {"code": "not_found", "message": "not found"}
+            self._reply(HTTPStatus.NOT_FOUND, {"error": error}, headers)
+            return
+        self._reply(HTTPStatus.OK, payload, headers)
+
+    def do_GET(self) -> None:
+        """Serve a GET request."""
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        """Serve a POST request."""
+        self._handle("POST")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    fake: FakeHetzner
+
+
+class FakeHetznerServer:
+    """Serve a ``FakeHetzner`` on a free localhost port for a ``with`` block."""
+
+    def __init__(self, fake: FakeHetzner) -> None:
+        """Bind a server to a free port; it starts serving on ``__enter__``.
+
+        Args:
+            fake: The fake API state to serve.
+        """
+        self.fake = fake
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.fake = fake
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self) -> str:
+        """Base URL to use in place of the Hetzner API endpoint."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host!s}:{port}/v1"
+
+    def __enter__(self) -> Self:
+        """Start serving in a background thread.
+
+        Returns:
+            Self: This server.
+        """
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        """Stop serving and release the port."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,163 @@
+"""Measure how long the CLI takes to import, so startup cost can't creep back.
+
+Every sample runs ``python -X importtime`` in a fresh interpreter and reads the
+cumulative import time of the entry point. The median over all samples is
+reported along with the heaviest modules of the last sample and the wall time
+of ``--version``. With ``--max-ms`` the run fails when the median exceeds it,
+which makes it usable as a regression check in CI.
+
+Usage::
+
+    python -m benchmarks.importtime
+    python -m benchmarks.importtime --samples 20 --max-ms 80
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess  # ruff:ignore[suspicious-subprocess-import]
+import sys
+import time
+from typing import NamedTuple
+
+ENTRY_POINT = "cf_ips_to_hcloud_fw.__main__"
+DEFAULT_SAMPLES = 10
+DEFAULT_TOP = 10
+
+
+class ImportTime(NamedTuple):
+    """One module's line of ``-X importtime`` output, in microseconds.
+
+    Attributes:
+        module: Dotted module name, without the nesting indentation.
+        self_us: Time spent in the module body itself.
+        cumulative_us: Time including everything the module imported.
+    """
+
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(stderr: str) -> list[ImportTime]:
+    """Parse the ``import time:`` lines Python writes to stderr.
+
+    Args:
+        stderr: Standard error of a ``python -X importtime`` run.
+
+    Returns:
+        list[ImportTime]: One entry per imported module, in output order.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, module = line.removeprefix("import time:").split("|")
+        if not self_us.strip().isdigit():  # The column header.
+            continue
+        entries.append(ImportTime(module.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def sample_import() -> list[ImportTime]:
+    """Import the entry point in a fresh interpreter.
+
+    Returns:
+        list[ImportTime]: The interpreter's import times.
+    """
+    child = subprocess.run(  # ruff:ignore[subprocess-without-shell-equals-true]
+        [sys.executable, "-X", "importtime", "-c", f"import {ENTRY_POINT}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(child.stderr)
+
+
+def sample_version() -> float:
+    """Run ``--version`` in a fresh interpreter.
+
+    Returns:
+        float: Wall time in seconds, interpreter startup included.
+    """
+    started = time.perf_counter()
+    subprocess.run(  # ruff:ignore[subprocess-without-shell-equals-true]
+        [sys.executable, "-m", ENTRY_POINT.removesuffix(".__main__"), "--version"],
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Build the benchmark's own parser.
+
+    Returns:
+        argparse.ArgumentParser: Parser for the benchmark options.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=DEFAULT_SAMPLES,
+        help=f"fresh interpreters to time (default: {DEFAULT_SAMPLES})",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=DEFAULT_TOP,
+        help=f"heaviest modules to list (default: {DEFAULT_TOP})",
+    )
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        help="exit with 1 when the median import time is above this",
+    )
+    parser.add_argument("--json", action="store_true", help="print one JSON line")
+    return parser
+
+
+def main() -> None:
+    """Time the imports and ``--version``, then print or check the result."""
+    args = create_parser().parse_args()
+    totals = []
+    entries: list[ImportTime] = []
+    for _ in range(args.samples):
+        entries = sample_import()
+        total = next(e for e in entries if e.module == ENTRY_POINT)
+        totals.append(total.cumulative_us / 1000)
+    version_s = statistics.median(sample_version() for _ in range(args.samples))
+    import_ms = statistics.median(totals)
+    own = sorted(
+        (e for e in entries if e.module.split(".")[0] == "cf_ips_to_hcloud_fw"),
+        key=lambda e: e.cumulative_us,
+        reverse=True,
+    )
+    heaviest = sorted(entries, key=lambda e: e.self_us, reverse=True)[: args.top]
+
+    if args.json:
+        result = {
+            "import_ms": round(import_ms, 1),
+            "version_ms": round(version_s * 1000, 1),
+            "modules": {e.module: e.cumulative_us for e in own},
+        }
+        print(json.dumps(result))
+    else:
+        print(f"import {ENTRY_POINT}: {import_ms:.1f} ms (median of {args.samples})")
+        print(f"--version wall time: {version_s * 1000:.1f} ms")
+        print("Package modules (cumulative):")
+        for e in own:
+            print(f"  {e.cumulative_us / 1000:8.1f} ms  {e.module}")
+        print("Heaviest modules (self):")
+        for e in heaviest:
+            print(f"  {e.self_us / 1000:8.1f} ms  {e.module}")
+
+    if args.max_ms is not None and import_ms > args.max_ms:
+        print(f"Import time {import_ms:.1f} ms is above --max-ms {args.max_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
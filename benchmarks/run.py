@@ -0,0 +1,238 @@
+"""Run the CLI end to end against the fake Hetzner API and report the cost.
+
+Each configured size runs in a fresh interpreter so its peak RSS is its own.
+The child starts the fake API, writes a config with that many firewalls,
+points both engines at the fake, replaces the Cloudflare fetch with a fixed
+range set, and runs ``__main__.main`` unchanged - so every code path between
+the CLI and the HTTP layer is the real one.
+
+Usage::
+
+    python -m benchmarks.run
+    python -m benchmarks.run --sizes 1 100 --latency-ms 40 -- --engine async
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import resource
+import subprocess  # ruff:ignore[suspicious-subprocess-import]
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+import yaml
+
+from benchmarks.fake_hetzner import (
+    FakeHetzner,
+    FakeHetznerServer,
+    FakeSettings,
+    seed_firewalls,
+)
+from cf_ips_to_hcloud_fw.__main__ import main as cli_main
+from cf_ips_to_hcloud_fw.firewall import CF_ALL
+from cf_ips_to_hcloud_fw.models import CloudflareCIDRs
+
+DEFAULT_SIZES = (1, 100, 1000)
+
+CF_CIDRS = CloudflareCIDRs(
+    ipv4_cidrs=["103.21.244.0/22", "104.16.0.0/13", "173.245.48.0/20"],
+    ipv6_cidrs=["2400:cb00::/32", "2606:4700::/32"],
+)
+
+_COLUMNS = ("firewalls", "exit", "wall_s", "requests", "429s", "set_rules", "rss_mib")
+
+
+def _rules(*, up_to_date: bool) -> list[dict[str, Any]]:
+    """One Cloudflare-marked inbound rule, stale unless ``up_to_date``.
+
+    Args:
+        up_to_date: Seed the rule with the ranges the run will apply.
+
+    Returns:
+        list[dict[str, Any]]: Rules as the API returns them.
+    """
+    sources = (
+        CF_CIDRS.ipv4_cidrs + CF_CIDRS.ipv6_cidrs if up_to_date else ["192.0.2.0/24"]
+    )
+    return [
+        {
+            "direction": "in",
+            "protocol": "tcp",
+            "port": "443",
+            "source_ips": sources,
+            "destination_ips": [],
+            "description": CF_ALL,
+        }
+    ]
+
+
+def _peak_rss_mib() -> float:
+    """Peak resident set size of this process so far.
+
+    Returns:
+        float: Peak RSS in MiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_one(args: argparse.Namespace) -> dict[str, Any]:
+    """Run one scenario in this process.
+
+    Args:
+        args: Parsed benchmark arguments, with ``one`` as the size.
+
+    Returns:
+        dict[str, Any]: The measurements.
+    """
+    size = args.one
+    settings = FakeSettings(
+        latency=args.latency_ms / 1000,
+        action_duration=args.action_ms / 1000,
+        error_rate=args.error_rate,
+        budget=args.budget,
+        refill_per_second=args.refill,
+    )
+    fake = FakeHetzner(
+        seed_firewalls(size, _rules(up_to_date=args.up_to_date)), settings
+    )
+    names = [f"fw-{i}" for i in range(1, size + 1)]
+    projects = [
+        {"token": f"bench-token-{p}", "firewalls": names[p :: args.projects]}
+        for p in range(min(args.projects, size))
+    ]
+    with tempfile.TemporaryDirectory() as tmp, FakeHetznerServer(fake) as server:
+        config = Path(tmp) / "config.yaml"
+        config.write_text(yaml.safe_dump(projects))
+        config.chmod(0o600)
+        argv = ["cf-ips-to-hcloud-fw", "-c", str(config), *args.cli_args]
+        exit_code = 0
+        started = time.perf_counter()
+        with (
+            patch("sys.argv", argv),
+            patch("cf_ips_to_hcloud_fw.firewall.HCLOUD_API_ENDPOINT", server.endpoint),
+            patch(
+                "cf_ips_to_hcloud_fw.firewall_async.HCLOUD_API_ENDPOINT",
+                server.endpoint,
+            ),
+            patch(
+                "cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs",
+                return_value=CF_CIDRS,
+            ),
+        ):
+            try:
+                cli_main()
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else 1
+        wall = time.perf_counter() - started
+    return {
+        "firewalls": size,
+        "exit": exit_code,
+        "wall_s": round(wall, 3),
+        "requests": fake.requests,
+        "429s": fake.rate_limited,
+        "set_rules": fake.set_rules,
+        "rss_mib": round(_peak_rss_mib(), 1),
+    }
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Construct the benchmark's argument parser.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        epilog="Arguments after '--' are passed to cf-ips-to-hcloud-fw.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_SIZES),
+        help="firewall counts to run (default: 1 100 1000)",
+    )
+    parser.add_argument(
+        "--projects", type=int, default=1, help="spread firewalls over N tokens"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=20.0, help="added per response"
+    )
+    parser.add_argument(
+        "--action-ms", type=float, default=500.0, help="set_rules action runtime"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of spurious 429s"
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        default=0,
+        help="requests per token before 429s, with RateLimit-* headers (0: off)",
+    )
+    parser.add_argument(
+        "--refill", type=float, default=1.0, help="budget refill per second"
+    )
+    parser.add_argument(
+        "--up-to-date",
+        action="store_true",
+        help="seed firewalls that already match, to time a no-op run",
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("cli_args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    return parser
+
+
+def main() -> None:
+    """Run every size in its own interpreter and print the results."""
+    parser = create_parser()
+    args = parser.parse_args()
+    if args.cli_args[:1] == ["--"]:
+        args.cli_args = args.cli_args[1:]
+    if args.one is not None:
+        print(json.dumps(run_one(args)))
+        return
+
+    child_args = [
+        f"--projects={args.projects}",
+        f"--latency-ms={args.latency_ms}",
+        f"--action-ms={args.action_ms}",
+        f"--error-rate={args.error_rate}",
+        f"--budget={args.budget}",
+        f"--refill={args.refill}",
+        *(["--up-to-date"] if args.up_to_date else []),
+    ]
+    if not args.json:
+        print("  ".join(f"{c:>10}" for c in _COLUMNS))
+    for size in args.sizes:
+        child = subprocess.run(  # ruff:ignore[subprocess-without-shell-equals-true]
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.run",
+                f"--one={size}",
+                *child_args,
+                "--",
+                *args.cli_args,
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        result = json.loads(child.stdout.splitlines()[-1])
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print("  ".join(f"{result[c]!s:>10}" for c in _COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
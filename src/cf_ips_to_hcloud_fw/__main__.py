@@ -3,12 +3,105 @@
 from __future__ import annotations
 
 import argparse
+import functools
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import starmap
+from typing import TYPE_CHECKING
 
 from cf_ips_to_hcloud_fw import __version__
-from cf_ips_to_hcloud_fw.cloudflare import get_cloudflare_cidrs
-from cf_ips_to_hcloud_fw.config import load_projects
-from cf_ips_to_hcloud_fw.custom_logging import log_error_and_exit, setup_logging
-from cf_ips_to_hcloud_fw.firewall import update_project
+from cf_ips_to_hcloud_fw.custom_logging import (
+    log_error_and_exit,
+    ordered_project_logs,
+    setup_logging,
+)
+from cf_ips_to_hcloud_fw.deadline import RUN_DEADLINE
+from cf_ips_to_hcloud_fw.metrics import (
+    DEFAULT_METRICS_HOST,
+    LAST_SYNC,
+    serve_metrics,
+    write_textfile,
+)
+from cf_ips_to_hcloud_fw.retry import DEFAULT_RETRY_BUDGET, RETRY_BUDGET
+from cf_ips_to_hcloud_fw.state import (
+    DEFAULT_REVERIFY_AFTER,
+    AppliedState,
+    cidrs_fingerprint,
+)
+from cf_ips_to_hcloud_fw.timing import enable_timings, timed, timing_summary
+
+if TYPE_CHECKING:  # pragma: no cover
+    from collections.abc import Callable  # pragma: no cover
+    from types import FrameType  # pragma: no cover
+
+    from hcloud import Client  # pragma: no cover
+
+    from cf_ips_to_hcloud_fw.firewall import ProjectOutcome  # pragma: no cover
+    from cf_ips_to_hcloud_fw.firewall_async import KeptAliveEngine  # pragma: no cover
+    from cf_ips_to_hcloud_fw.models import (  # pragma: no cover
+        CloudflareCIDRs,
+        Project,
+    )
+
+
+# Requests allowed in flight per API token. Projects that share a token share
+# the budget, because Hetzner rate-limits per token rather than per request.
+DEFAULT_MAX_IN_FLIGHT = 16
+
+# Default cadence of the full reconcile that runs even when Cloudflare's list
+# is unchanged, so a rule edited by hand in the console is put back.
+DEFAULT_RECONCILE_INTERVAL = 3600
+
+# Source IPs per rule before a marked rule is split; firewall.MAX_RULE_SOURCES,
+# repeated here so building the parser doesn't import the hcloud SDK.
+DEFAULT_MAX_RULE_SOURCES = 100
+
+
+def _positive_int(value: str) -> int:
+    """Parse a CLI value that must be an integer of at least 1.
+
+    Args:
+        value: Raw command-line string.
+
+    Returns:
+        int: The parsed value.
+
+    Raises:
+        ArgumentTypeError: If the value is not a positive integer.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        msg = f"must be a positive integer, got {value!r}"
+        raise argparse.ArgumentTypeError(msg)
+    return number
+
+
+def _non_negative_int(value: str) -> int:
+    """Parse a CLI value that must be an integer of at least 0.
+
+    Args:
+        value: Raw command-line string.
+
+    Returns:
+        int: The parsed value.
+
+    Raises:
+        ArgumentTypeError: If the value is not a non-negative integer.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        msg = f"must be a non-negative integer, got {value!r}"
+        raise argparse.ArgumentTypeError(msg)
+    return number
 
 
 def create_parser() -> argparse.ArgumentParser:
@@ -30,33 +123,584 @@ def create_parser() -> argparse.ArgumentParser:
         ),
         metavar="CONFIGFILE",
     )
+    parser.add_argument(
+        "--cache",
+        help=(
+            "cache file for Cloudflare's validated ranges; when Cloudflare "
+            "reports the same etag again, validation is skipped"
+        ),
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--cidrs-from",
+        help=(
+            "read Cloudflare's ranges from a saved ips.list JSON document "
+            "instead of fetching them; '-' reads standard input"
+        ),
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--cloudflare-backend",
+        choices=("http", "sdk"),
+        default="http",
+        help=(
+            "how to fetch Cloudflare's ranges: 'http' sends one plain GET, "
+            "'sdk' goes through the Cloudflare SDK (default: http)"
+        ),
+    )
+    parser.add_argument(
+        "--collapse-cidrs",
+        action="store_true",
+        help=(
+            "merge adjacent and nested ranges into the fewest prefixes before "
+            "writing them to rules"
+        ),
+    )
+    parser.add_argument(
+        "--state",
+        help=(
+            "state file recording which firewalls already match which "
+            "Cloudflare ranges; those are skipped without any Hetzner request "
+            "until the ranges change or --reverify-after passes"
+        ),
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--reverify-after",
+        type=_positive_int,
+        default=DEFAULT_REVERIFY_AFTER,
+        help=(
+            "with --state: minutes after which a firewall recorded as up to "
+            f"date is checked again, to undo manual drift "
+            f"(default: {DEFAULT_REVERIFY_AFTER})"
+        ),
+        metavar="MINUTES",
+    )
+    parser.add_argument(
+        "--project-concurrency",
+        type=_positive_int,
+        default=1,
+        help=(
+            "number of projects to sync in parallel; each project uses its own "
+            "token and rate limit (default: 1)"
+        ),
+        metavar="N",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("threads", "async"),
+        default="threads",
+        help=(
+            "sync engine: 'threads' uses the hcloud SDK, 'async' keeps many "
+            "requests in flight over one asyncio HTTP client and syncs every "
+            "project at once (default: threads)"
+        ),
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=_positive_int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help=(
+            "async engine only: requests in flight per API token "
+            f"(default: {DEFAULT_MAX_IN_FLIGHT})"
+        ),
+        metavar="N",
+    )
+    parser.add_argument(
+        "--max-rule-sources",
+        type=_positive_int,
+        default=DEFAULT_MAX_RULE_SOURCES,
+        help=(
+            "most source IPs per firewall rule; a marked rule with more is "
+            "split across numbered rules with the same protocol and port "
+            f"(default: {DEFAULT_MAX_RULE_SOURCES})"
+        ),
+        metavar="N",
+    )
+    parser.add_argument(
+        "--retry-budget",
+        type=_non_negative_int,
+        default=DEFAULT_RETRY_BUDGET,
+        help=(
+            "most Hetzner API requests sent again after a transient failure "
+            "(429, 502-504, locked, conflict ...) per sync, across all "
+            f"projects; 0 turns retries off (default: {DEFAULT_RETRY_BUDGET})"
+        ),
+        metavar="N",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=_positive_int,
+        help=(
+            "finish within SECONDS of starting: request timeouts shrink as the "
+            "deadline nears, no firewall is started with too little time left, "
+            "and those are reported as not started"
+        ),
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--watch",
+        type=_positive_int,
+        help=(
+            "keep running and poll Cloudflare every SECONDS; firewalls are "
+            "synced only when the ranges change or a reconcile is due"
+        ),
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--reconcile-interval",
+        type=_positive_int,
+        default=DEFAULT_RECONCILE_INTERVAL,
+        help=(
+            "with --watch: seconds between full syncs that run even when "
+            "Cloudflare's ranges are unchanged, to undo manual drift "
+            f"(default: {DEFAULT_RECONCILE_INTERVAL})"
+        ),
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--plan",
+        help=(
+            "don't change anything: compare every firewall with Cloudflare's "
+            "ranges and write the changes a sync would make to FILE as JSON; "
+            "uses the hcloud SDK whatever --engine says"
+        ),
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--apply-plan",
+        help=(
+            "push the changes recorded in a --plan FILE without fetching "
+            "Cloudflare's ranges or listing firewalls again; a firewall whose "
+            "marked rules changed since the plan was made is left alone and "
+            "fails the run"
+        ),
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help=(
+            "log how long each phase took after the sync: totals and p50/p95 "
+            "per call type, and the slowest firewalls"
+        ),
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        help=(
+            "write Prometheus metrics to FILE for node_exporter's textfile "
+            "collector when the run ends (with --watch: after every sync, too)"
+        ),
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=_positive_int,
+        help="with --watch: serve Prometheus metrics on PORT at /metrics",
+        metavar="PORT",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        default=DEFAULT_METRICS_HOST,
+        help=(
+            "with --metrics-port: address to listen on "
+            f"(default: {DEFAULT_METRICS_HOST})"
+        ),
+        metavar="HOST",
+    )
     parser.add_argument("-v", "--version", action="version", version=__version__)
     parser.add_argument("-d", "--debug", action="store_true")
     return parser
 
 
+def sync_projects(
+    projects: list[Project],
+    cf_cidrs: CloudflareCIDRs,
+    *,
+    concurrency: int,
+    clients: list[Client] | None = None,
+    max_sources: int = DEFAULT_MAX_RULE_SOURCES,
+) -> list[ProjectOutcome]:
+    """Run ``update_project`` for every project, up to ``concurrency`` at once.
+
+    Projects are independent - each has its own token and its own rate limit -
+    so they can be synced in parallel. Outcomes are returned in config order
+    regardless of which project finishes first, and so are log lines: those of
+    a project are held back until every earlier one has finished, so the log
+    reads the same as a serial run.
+
+    Args:
+        projects: Ordered project definitions from the config.
+        cf_cidrs: Cloudflare CIDR model downloaded at runtime.
+        concurrency: Maximum number of projects synced at the same time.
+        clients: Per-project clients to reuse, in config order; each project
+            builds a fresh one when omitted.
+        max_sources: Most source IPs a single rule may hold.
+
+    Returns:
+        list[ProjectOutcome]: One outcome per project, in config order.
+    """
+    from cf_ips_to_hcloud_fw.firewall import update_project
+    from cf_ips_to_hcloud_fw.ratelimit import shared_session
+
+    shared_session().grow_pool(concurrency)
+
+    def run(idx: int, project: Project) -> ProjectOutcome:
+        return update_project(
+            project=project,
+            cf_cidrs=cf_cidrs,
+            project_index=idx,
+            client=clients[idx - 1] if clients else None,
+            max_sources=max_sources,
+        )
+
+    if concurrency == 1:
+        return list(starmap(run, enumerate(projects, start=1)))
+    with (
+        ordered_project_logs() as log_order,
+        ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="project"
+        ) as pool,
+    ):
+        futures = [
+            pool.submit(log_order.run, idx, run, idx, project)
+            for idx, project in enumerate(projects, start=1)
+        ]
+        # Collected in submission order, not completion order.
+        return [future.result() for future in futures]
+
+
+def _fetch_cidrs(args: argparse.Namespace) -> CloudflareCIDRs:
+    """Fetch and validate Cloudflare's ranges, collapsing them if asked to.
+
+    With ``--cidrs-from``, the ranges are read from that document instead.
+
+    Args:
+        args: Parsed CLI arguments.
+
+    Returns:
+        CloudflareCIDRs: The ranges to write to the marked rules.
+    """
+    from cf_ips_to_hcloud_fw.cloudflare import (
+        collapse_cidrs,
+        get_cloudflare_cidrs,
+        read_cloudflare_cidrs,
+    )
+
+    if args.cidrs_from:
+        cf_cidrs = read_cloudflare_cidrs(args.cidrs_from)
+    else:
+        cf_cidrs = get_cloudflare_cidrs(args.cache, args.cloudflare_backend)
+    return collapse_cidrs(cf_cidrs) if args.collapse_cidrs else cf_cidrs
+
+
+def _make_sync(
+    args: argparse.Namespace,
+    projects: list[Project],
+    *,
+    reuse_clients: bool,
+    engine: KeptAliveEngine | None = None,
+) -> Callable[[CloudflareCIDRs], list[ProjectOutcome]]:
+    """Bind the selected engine and its options to the project list.
+
+    With ``--state``, each sync first drops the firewalls recorded as matching
+    the ranges and records the outcome afterwards.
+
+    Args:
+        args: Parsed CLI arguments.
+        projects: Ordered project definitions from the config.
+        reuse_clients: Build the SDK clients once and keep them across calls,
+            for watch mode.
+        engine: Kept-alive asyncio engine to sync through instead, for watch
+            mode with ``--engine async``; closing it is left to the caller.
+
+    Returns:
+        Callable[[CloudflareCIDRs], list[ProjectOutcome]]: Runs one sync.
+    """
+    if engine is not None:
+        run = engine.sync
+
+    elif args.engine == "async":
+        from cf_ips_to_hcloud_fw.firewall_async import sync_projects_async
+
+        def run(todo: list[Project], cf_cidrs: CloudflareCIDRs) -> list[ProjectOutcome]:
+            return sync_projects_async(
+                todo,
+                cf_cidrs,
+                max_in_flight=args.max_in_flight,
+                max_sources=args.max_rule_sources,
+            )
+
+    else:
+        from cf_ips_to_hcloud_fw.firewall import make_client
+
+        clients = (
+            [make_client(project) for project in projects] if reuse_clients else None
+        )
+
+        def run(todo: list[Project], cf_cidrs: CloudflareCIDRs) -> list[ProjectOutcome]:
+            return sync_projects(
+                todo,
+                cf_cidrs,
+                concurrency=args.project_concurrency,
+                clients=clients,
+                max_sources=args.max_rule_sources,
+            )
+
+    if not args.state:
+        return functools.partial(run, projects)
+    state = AppliedState.load(args.state, reverify_after=args.reverify_after * 60)
+
+    def sync_with_state(cf_cidrs: CloudflareCIDRs) -> list[ProjectOutcome]:
+        fingerprint = cidrs_fingerprint(cf_cidrs, args.max_rule_sources)
+        todo = state.pending(projects, fingerprint)
+        outcomes = run(todo, cf_cidrs)
+        state.record(todo, outcomes, fingerprint)
+        state.save()
+        return outcomes
+
+    return sync_with_state
+
+
+def _finish_sync(args: argparse.Namespace) -> None:
+    """Record that a sync finished and log its timings if asked to.
+
+    The retry budget is refilled for the next sync.
+
+    Args:
+        args: Parsed CLI arguments.
+    """
+    LAST_SYNC.set(time.time())
+    RETRY_BUDGET.reset(args.retry_budget)
+    if args.timings:
+        for line in timing_summary():
+            logging.info(line)
+
+
+def _with_reporting(
+    args: argparse.Namespace,
+    sync: Callable[[CloudflareCIDRs], list[ProjectOutcome]],
+) -> Callable[[CloudflareCIDRs], list[ProjectOutcome]]:
+    """Report on every sync of watch mode as it finishes.
+
+    Each timing summary covers one cycle, including the Cloudflare polls since
+    the previous sync, so the records of a long-running daemon do not pile up.
+    The metrics textfile is rewritten too, so it stays current between
+    restarts.
+
+    Args:
+        args: Parsed CLI arguments.
+        sync: Runs one sync.
+
+    Returns:
+        Callable[[CloudflareCIDRs], list[ProjectOutcome]]: ``sync``, followed
+        by the reporting.
+    """
+
+    def sync_and_report(cf_cidrs: CloudflareCIDRs) -> list[ProjectOutcome]:
+        outcomes = sync(cf_cidrs)
+        _finish_sync(args)
+        if args.metrics_textfile:
+            write_textfile(args.metrics_textfile)
+        return outcomes
+
+    return sync_and_report
+
+
+def _run_watch(args: argparse.Namespace, projects: list[Project]) -> None:
+    """Run watch mode until SIGTERM or SIGINT.
+
+    Args:
+        args: Parsed CLI arguments.
+        projects: Ordered project definitions from the config.
+    """
+    from cf_ips_to_hcloud_fw.watch import watch
+
+    stop = threading.Event()
+
+    def request_stop(signum: int, frame: FrameType | None) -> None:
+        del frame
+        logging.info(f"Received {signal.Signals(signum).name}, stopping")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    server = None
+    if args.metrics_port:
+        try:
+            server = serve_metrics(args.metrics_host, args.metrics_port)
+        except OSError as e:
+            log_error_and_exit(
+                f"Couldn't serve metrics on {args.metrics_host}:"
+                f"{args.metrics_port}: {e}"
+            )
+    logging.info(
+        f"Watching Cloudflare ranges every {args.watch}s, full reconcile every "
+        f"{args.reconcile_interval}s"
+    )
+    engine = None
+    if args.engine == "async":
+        from cf_ips_to_hcloud_fw.firewall_async import KeptAliveEngine
+
+        engine = KeptAliveEngine(
+            max_in_flight=args.max_in_flight, max_sources=args.max_rule_sources
+        )
+    try:
+        sync = _make_sync(args, projects, reuse_clients=True, engine=engine)
+        watch(
+            fetch=functools.partial(_fetch_cidrs, args),
+            sync=_with_reporting(args, sync),
+            interval=args.watch,
+            reconcile_interval=args.reconcile_interval,
+            stop=stop,
+        )
+    finally:
+        if engine is not None:
+            engine.close()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+def _run_plan(args: argparse.Namespace, projects: list[Project]) -> None:
+    """Write the plan for every project instead of syncing.
+
+    Args:
+        args: Parsed CLI arguments.
+        projects: Ordered project definitions from the config.
+    """
+    from cf_ips_to_hcloud_fw.firewall import plan_project, summarize_outcomes
+    from cf_ips_to_hcloud_fw.plan import write_plan
+
+    cf_cidrs = _fetch_cidrs(args)
+    plans = [
+        plan_project(
+            project=project,
+            cf_cidrs=cf_cidrs,
+            project_index=idx,
+            max_sources=args.max_rule_sources,
+        )
+        for idx, project in enumerate(projects, start=1)
+    ]
+    write_plan(args.plan, cf_cidrs, plans, max_sources=args.max_rule_sources)
+    if args.timings:
+        for line in timing_summary():
+            logging.info(line)
+    report = summarize_outcomes([plan.outcome for plan in plans])
+    if report:
+        log_error_and_exit(report)
+
+
+def _run_apply_plan(args: argparse.Namespace, projects: list[Project]) -> None:
+    """Push a plan written earlier by ``--plan``.
+
+    Plan projects are matched to the config by index, so the config must list
+    the same projects in the same order as when the plan was made.
+
+    Args:
+        args: Parsed CLI arguments.
+        projects: Ordered project definitions from the config.
+    """
+    from cf_ips_to_hcloud_fw.firewall import apply_project_plan, summarize_outcomes
+    from cf_ips_to_hcloud_fw.plan import PlannedProject, read_plan
+    from cf_ips_to_hcloud_fw.ratelimit import shared_session
+
+    try:
+        plan = read_plan(args.apply_plan)
+    except (OSError, ValueError, TypeError) as e:
+        log_error_and_exit(f"Couldn't read plan {args.apply_plan!r}: {e}")
+    for planned in plan.projects:
+        if planned.index > len(projects):
+            log_error_and_exit(
+                f"Plan {args.apply_plan!r} is for project {planned.index}, "
+                f"but the config lists {len(projects)}"
+            )
+        listed = set(projects[planned.index - 1].firewalls)
+        unknown = [fw.name for fw in planned.firewalls if fw.name not in listed]
+        if unknown:
+            log_error_and_exit(
+                f"Plan {args.apply_plan!r} has firewalls {unknown} that project "
+                f"{planned.index} doesn't list"
+            )
+    cf_cidrs = plan.cidrs.to_cidrs()
+    shared_session().grow_pool(args.project_concurrency)
+
+    def run(planned: PlannedProject) -> ProjectOutcome:
+        return apply_project_plan(
+            project=projects[planned.index - 1],
+            firewalls=planned.firewalls,
+            cf_cidrs=cf_cidrs,
+            project_index=planned.index,
+            max_sources=plan.max_rule_sources,
+        )
+
+    with ThreadPoolExecutor(
+        max_workers=args.project_concurrency, thread_name_prefix="project"
+    ) as pool:
+        outcomes = list(pool.map(run, plan.projects))
+    _finish_sync(args)
+    report = summarize_outcomes(outcomes)
+    if report:
+        log_error_and_exit(report)
+
+
+def _run(args: argparse.Namespace) -> None:
+    """Load the config and sync once, or keep syncing in watch mode.
+
+    Args:
+        args: Parsed CLI arguments.
+    """
+    from cf_ips_to_hcloud_fw.config import load_projects
+
+    RUN_DEADLINE.start(args.deadline)
+    RETRY_BUDGET.reset(args.retry_budget)
+    with timed("load_projects"):
+        projects = load_projects(args.config)
+    if args.watch:
+        _run_watch(args, projects)
+        return
+    if args.plan:
+        _run_plan(args, projects)
+        return
+    if args.apply_plan:
+        _run_apply_plan(args, projects)
+        return
+
+    from cf_ips_to_hcloud_fw.firewall import summarize_outcomes
+
+    cf_cidrs = _fetch_cidrs(args)
+    outcomes = _make_sync(args, projects, reuse_clients=False)(cf_cidrs)
+    _finish_sync(args)
+    report = summarize_outcomes(outcomes)
+    if report:
+        log_error_and_exit(report)
+
+
 def main() -> None:
     """Parse arguments, configure logging, and run the sync workflow."""
     parser = create_parser()
     args = parser.parse_args()
+    if args.metrics_port and not args.watch:
+        parser.error("--metrics-port requires --watch")
+    if args.plan and args.watch:
+        parser.error("--plan can't be combined with --watch")
+    if args.apply_plan and (args.plan or args.watch):
+        parser.error("--apply-plan can't be combined with --plan or --watch")
+    if args.deadline and args.watch:
+        parser.error("--deadline can't be combined with --watch")
+    if args.cidrs_from == "-" and args.watch:
+        parser.error("--cidrs-from - can't be combined with --watch")
     setup_logging(args)
+    if args.timings:
+        enable_timings()
 
-    projects = load_projects(args.config)
-    cf_cidrs = get_cloudflare_cidrs()
-    all_skipped: list[str] = []
-    all_failed: list[str] = []
-    for idx, project in enumerate(projects, start=1):
-        outcome = update_project(project=project, cf_cidrs=cf_cidrs, project_index=idx)
-        all_skipped.extend(outcome.skipped)
-        all_failed.extend(outcome.failed)
-
-    if all_failed or all_skipped:
-        parts: list[str] = []
-        if all_failed:
-            parts.append(f"failed: {', '.join(all_failed)}")
-        if all_skipped:
-            parts.append(f"not found: {', '.join(all_skipped)}")
-        log_error_and_exit(f"Some firewalls were not updated ({'; '.join(parts)})")
+    try:
+        _run(args)
+    finally:
+        # Also on the way out of a failed run, which is when the counters of
+        # failed firewalls and Cloudflare fetches matter most.
+        if args.metrics_textfile:
+            write_textfile(args.metrics_textfile)
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -2,25 +2,32 @@
 
 from __future__ import annotations
 
+import functools
+import json
 import logging
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
-import cloudflare
-import cloudflare.types.ips
-from cloudflare import Omit
+import httpx
 from pydantic import TypeAdapter, ValidationError
 
+from cf_ips_to_hcloud_fw import __version__
 from cf_ips_to_hcloud_fw.custom_logging import log_error_and_exit
+from cf_ips_to_hcloud_fw.deadline import RUN_DEADLINE
+from cf_ips_to_hcloud_fw.metrics import CLOUDFLARE_FETCHES
 from cf_ips_to_hcloud_fw.models import CloudflareCIDRs, CloudflareIPNetworks
+from cf_ips_to_hcloud_fw.state import read_private_json, write_private_json
+from cf_ips_to_hcloud_fw.timing import timed
 
-# `ips.list` is a public endpoint that needs no credentials. The SDK otherwise
-# refuses to send a request without an auth method, so explicitly omit the auth
-# headers — this sends no credential at all, instead of a placeholder key.
-_NO_AUTH_HEADERS = {
-    "Authorization": Omit(),
-    "X-Auth-Email": Omit(),
-    "X-Auth-Key": Omit(),
-    "X-Auth-User-Service-Key": Omit(),
-}
+if TYPE_CHECKING:  # pragma: no cover
+    import cloudflare.types.ips  # pragma: no cover
+
+# How the ranges are fetched: with a plain GET ("http"), or through the
+# Cloudflare SDK ("sdk"), which costs a large import for one public document.
+CLOUDFLARE_BACKENDS = ("http", "sdk")
+DEFAULT_CLOUDFLARE_BACKEND = "http"
 
 # Passed explicitly because the SDK otherwise falls back to the
 # CLOUDFLARE_BASE_URL environment variable, an undocumented knob that decides
@@ -41,44 +48,282 @@ _NO_AUTH_HEADERS = {
 # happens to control.
 CLOUDFLARE_API_BASE_URL = "https://api.cloudflare.com/client/v4"
 
+# (connect, read) seconds; the SDK's own default, so both backends give up
+# after the same time.
+CLOUDFLARE_TIMEOUT = (5.0, 60.0)
+
+# Built once: an adapter compiles its validator on construction, which would
+# otherwise repeat on every poll in watch mode.
+_NETWORKS_ADAPTER = TypeAdapter(CloudflareIPNetworks)
+
+
+def _cloudflare_timeout() -> httpx.Timeout:
+    """Return ``CLOUDFLARE_TIMEOUT`` shrunk to end by the ``--deadline``.
+
+    Returns:
+        httpx.Timeout: Timeouts for one Cloudflare request.
+    """
+    connect, read = RUN_DEADLINE.clamp(CLOUDFLARE_TIMEOUT)
+    return httpx.Timeout(read, connect=connect)
+
+
+@functools.cache
+def shared_client() -> httpx.Client:
+    """Return the HTTP client every Cloudflare fetch of this process goes through.
+
+    Both backends use it, so a watch-mode poll reuses the connection the
+    previous poll left open instead of paying for a new TLS handshake.
+
+    Returns:
+        httpx.Client: The process-wide client, built on first use.
+    """
+    return httpx.Client()
+
 
 def cf_ips_list() -> cloudflare.types.ips.IPListResponse | None:
-    """Call Cloudflare's `ips.list` endpoint and return the raw response.
+    """Call Cloudflare's `ips.list` endpoint through the SDK.
 
     Returns:
         cloudflare.types.ips.IPListResponse | None: Raw API response, or None
         when the SDK returns no payload.
     """
-    cf = cloudflare.Cloudflare(base_url=CLOUDFLARE_API_BASE_URL)
+    import cloudflare
+
+    cf = cloudflare.Cloudflare(
+        base_url=CLOUDFLARE_API_BASE_URL, http_client=shared_client()
+    )
+    # `ips.list` is a public endpoint that needs no credentials. The SDK
+    # otherwise refuses to send a request without an auth method, so explicitly
+    # omit the auth headers — this sends no credential at all, instead of a
+    # placeholder key.
+    no_auth_headers = {
+        "Authorization": cloudflare.Omit(),
+        "X-Auth-Email": cloudflare.Omit(),
+        "X-Auth-Key": cloudflare.Omit(),
+        "X-Auth-User-Service-Key": cloudflare.Omit(),
+    }
     try:
-        return cf.ips.list(extra_headers=_NO_AUTH_HEADERS)
+        return cf.ips.list(extra_headers=no_auth_headers, timeout=_cloudflare_timeout())
     except (cloudflare.APIConnectionError, cloudflare.APIStatusError) as e:
+        CLOUDFLARE_FETCHES.inc("error")
         log_error_and_exit(f"Error getting CloudFlare IPs: {e}")
 
 
-def get_cloudflare_cidrs() -> CloudflareCIDRs:
-    """Fetch, validate, and sort the Cloudflare IPv4/IPv6 CIDR lists.
+def cf_ips_get() -> dict[str, Any] | None:
+    """GET Cloudflare's ``/ips`` document without the SDK.
+
+    The request goes to the same pinned base URL as the SDK backend and sends
+    no credentials. httpx keeps ``trust_env``, so proxy and CA settings from
+    the environment apply exactly as they do to the SDK.
 
     Returns:
-        CloudflareCIDRs: Sanitized CIDR model ready for downstream consumers.
+        dict[str, Any] | None: The ``result`` object of the response envelope,
+        or None when the response carries none.
     """
-    ips_model = cf_ips_list()
-    if ips_model is None:
-        log_error_and_exit("Cloudflare/ips.list: no response")
     try:
-        ips_dict = ips_model.model_dump()
-        TypeAdapter(CloudflareIPNetworks).validate_python(ips_dict)  # sanity check
-        cf_ips = TypeAdapter(CloudflareCIDRs).validate_python(ips_dict)
+        response = shared_client().get(
+            f"{CLOUDFLARE_API_BASE_URL}/ips",
+            headers={
+                "Accept": "application/json",
+                "User-Agent": f"cf-ips-to-hcloud-fw/{__version__}",
+            },
+            timeout=_cloudflare_timeout(),
+        )
+        response.raise_for_status()
+        envelope = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        CLOUDFLARE_FETCHES.inc("error")
+        log_error_and_exit(f"Error getting CloudFlare IPs: {e}")
+    result = envelope.get("result") if isinstance(envelope, dict) else None
+    return result if isinstance(result, dict) else None
+
+
+def _fetch_ips(backend: str) -> dict[str, Any] | None:
+    """Fetch the ranges with the selected backend.
+
+    Args:
+        backend: One of ``CLOUDFLARE_BACKENDS``.
+
+    Returns:
+        dict[str, Any] | None: The ``ips.list`` result as plain data, or None
+        when Cloudflare sent no payload.
+    """
+    if backend == "sdk":
+        ips_model = cf_ips_list()
+        return None if ips_model is None else ips_model.model_dump()
+    return cf_ips_get()
+
+
+def _load_cache(cache_file: str, etag: str) -> CloudflareCIDRs | None:
+    """Return the cached ranges when they were stored for ``etag``.
+
+    The cache is an optimization, never a source of truth, so anything short of
+    a clean hit - missing file, unreadable or malformed JSON, a different etag -
+    returns None and the caller validates the fresh response instead. Only a
+    problem worth an operator's attention is logged.
+
+    A hit skips the routability check, so the file is trusted the way the
+    config file is: it is refused when group or others can write to it, since
+    whoever can edit it decides what lands on the allow list.
+
+    Args:
+        cache_file: Path of the cache file.
+        etag: Etag of the response just received from Cloudflare.
+
+    Returns:
+        CloudflareCIDRs | None: The cached ranges, or None on any miss.
+    """
+    try:
+        entry = read_private_json(Path(cache_file))
+        if entry["etag"] != etag:
+            logging.debug(f"Cloudflare cache is stale (etag {entry['etag']!r})")
+            return None
+        return CloudflareCIDRs.model_validate(entry["cidrs"])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Ignoring Cloudflare cache {cache_file!r}: {e}")
+        return None
+
+
+def _store_cache(cache_file: str, etag: str, cf_ips: CloudflareCIDRs) -> None:
+    """Write validated ranges and their etag to the cache file.
+
+    The file is replaced atomically and owner-only. A failed write only costs
+    the next run its fast path, so it is logged as a warning and the sync goes
+    on.
+
+    Args:
+        cache_file: Path of the cache file.
+        etag: Etag of the response the ranges were validated from.
+        cf_ips: Validated and sorted Cloudflare ranges.
+    """
+    entry = {
+        "etag": etag,
+        "fetched_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "cidrs": cf_ips.model_dump(),
+    }
+    try:
+        write_private_json(Path(cache_file), entry)
+    except OSError as e:
+        logging.warning(f"Couldn't write Cloudflare cache {cache_file!r}: {e}")
+
+
+def _validate_ips(ips_dict: dict[str, Any], origin: str) -> CloudflareCIDRs:
+    """Validate an ``ips.list`` result and refuse an empty list.
+
+    Args:
+        ips_dict: The ``ips.list`` result as plain data.
+        origin: Where the data came from, for error messages.
+
+    Returns:
+        CloudflareCIDRs: Validated and sorted ranges.
+    """
+    try:
+        with timed("validate"):
+            cf_ips = _NETWORKS_ADAPTER.validate_python(ips_dict).to_cidrs()
     except ValidationError as e:
-        log_error_and_exit(f"Cloudflare/ips.list didn't validate: {e}")
+        CLOUDFLARE_FETCHES.inc("invalid")
+        log_error_and_exit(f"{origin} didn't validate: {e}")
 
-    if not cf_ips.ipv4_cidrs:
-        log_error_and_exit("Cloudflare/ips.list: empty IPv4 CIDR list")
-    if not cf_ips.ipv6_cidrs:
-        log_error_and_exit("Cloudflare/ips.list: empty IPv6 CIDR list")
+    for cidrs, kind in ((cf_ips.ipv4_cidrs, "IPv4"), (cf_ips.ipv6_cidrs, "IPv6")):
+        if not cidrs:
+            CLOUDFLARE_FETCHES.inc("invalid")
+            log_error_and_exit(f"{origin}: empty {kind} CIDR list")
+    return cf_ips
+
+
+def get_cloudflare_cidrs(
+    cache_file: str | None = None, backend: str = DEFAULT_CLOUDFLARE_BACKEND
+) -> CloudflareCIDRs:
+    """Fetch, validate, and sort the Cloudflare IPv4/IPv6 CIDR lists.
+
+    With ``cache_file``, the validated result is stored together with the
+    response's ``etag``. A later response carrying the same etag is answered
+    from the cache, skipping validation entirely; Cloudflare is still asked
+    every time, as the etag is what tells whether anything changed.
 
-    cf_ips.ipv4_cidrs.sort()
-    cf_ips.ipv6_cidrs.sort()
+    Args:
+        cache_file: Optional path of the on-disk response cache.
+        backend: How to fetch the ranges, one of ``CLOUDFLARE_BACKENDS``.
+
+    Returns:
+        CloudflareCIDRs: Sanitized CIDR model ready for downstream consumers.
+    """
+    with timed("cf_ips_list"):
+        ips_dict = _fetch_ips(backend)
+    if ips_dict is None:
+        CLOUDFLARE_FETCHES.inc("error")
+        log_error_and_exit("Cloudflare/ips.list: no response")
+    etag = ips_dict.get("etag")
+    if cache_file and etag:
+        cached = _load_cache(cache_file, etag)
+        if cached is not None:
+            CLOUDFLARE_FETCHES.inc("cached")
+            logging.info("Got Cloudflare IPs (unchanged, served from cache)")
+            logging.debug(f"Cloudflare CIDRs: {cached}")
+            return cached
+    cf_ips = _validate_ips(ips_dict, "Cloudflare/ips.list")
+    CLOUDFLARE_FETCHES.inc("fetched")
     logging.info("Got Cloudflare IPs")
     logging.debug(f"Cloudflare CIDRs: {cf_ips}")
+    if cache_file and etag:
+        _store_cache(cache_file, etag, cf_ips)
+    return cf_ips
+
+
+def read_cloudflare_cidrs(source: str) -> CloudflareCIDRs:
+    """Read Cloudflare's ranges from a JSON document instead of the API.
+
+    The document is either the ``ips.list`` result (``ipv4_cidrs``,
+    ``ipv6_cidrs``) or the whole response envelope, as saved from
+    ``/client/v4/ips``. It is validated exactly like a fetched response,
+    routability check included, so a snapshot can't put anything on an allow
+    list that a fetch couldn't.
+
+    Args:
+        source: Path of the document, or ``-`` for standard input.
+
+    Returns:
+        CloudflareCIDRs: Sanitized CIDR model ready for downstream consumers.
+    """
+    origin = "Cloudflare IPs from " + ("stdin" if source == "-" else repr(source))
+    try:
+        with timed("read_cidrs"):
+            path = Path(source)
+            text = sys.stdin.read() if source == "-" else path.read_text("utf-8")
+            document = json.loads(text)
+    except (OSError, ValueError) as e:
+        CLOUDFLARE_FETCHES.inc("error")
+        log_error_and_exit(f"Couldn't read {origin}: {e}")
+    if isinstance(document, dict) and isinstance(document.get("result"), dict):
+        document = document["result"]
+    if not isinstance(document, dict):
+        CLOUDFLARE_FETCHES.inc("invalid")
+        log_error_and_exit(f"{origin}: expected a JSON object")
+    cf_ips = _validate_ips(document, origin)
+    CLOUDFLARE_FETCHES.inc("file")
+    logging.info(f"Read {origin}")
+    logging.debug(f"Cloudflare CIDRs: {cf_ips}")
     return cf_ips
+
+
+def collapse_cidrs(cf_ips: CloudflareCIDRs) -> CloudflareCIDRs:
+    """Merge adjacent and nested ranges and log how many entries that saved.
+
+    Args:
+        cf_ips: Validated Cloudflare ranges.
+
+    Returns:
+        CloudflareCIDRs: The same address space in the fewest prefixes.
+    """
+    with timed("collapse"):
+        collapsed = cf_ips.collapsed()
+    before = len(cf_ips.ipv4_cidrs) + len(cf_ips.ipv6_cidrs)
+    after = len(collapsed.ipv4_cidrs) + len(collapsed.ipv6_cidrs)
+    logging.info(
+        f"Collapsed {before} Cloudflare ranges into {after} "
+        f"({before - after} entries saved)"
+    )
+    logging.debug(f"Collapsed Cloudflare CIDRs: {collapsed}")
+    return collapsed
@@ -4,10 +4,19 @@ from __future__ import annotations
 
 import logging
 import sys
-from typing import TYPE_CHECKING, NoReturn
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, NoReturn, TypeVar
 
 if TYPE_CHECKING:  # pragma: no cover
     import argparse  # pragma: no cover
+    from collections.abc import Callable, Generator  # pragma: no cover
+
+T = TypeVar("T")
+
+# A record held back together with the handler that is to emit it.
+_Held = tuple[logging.Handler, logging.LogRecord]
 
 
 def setup_logging(args: argparse.Namespace) -> None:
@@ -46,3 +55,154 @@ def log_error_and_exit(msg: str) -> NoReturn:
     """
     log_error(msg)
     sys.exit(1)
+
+
+class _HoldBack(logging.Filter):
+    """Handler filter that hands records of held-back projects to the buffer."""
+
+    def __init__(self, order: ProjectLogOrder, handler: logging.Handler) -> None:
+        """Bind the filter to its buffer and the handler it guards.
+
+        Args:
+            order: The buffer deciding which records are held back.
+            handler: The handler the filter is attached to.
+        """
+        super().__init__()
+        self._order = order
+        self._handler = handler
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Let a record through, or hold it back for later.
+
+        Args:
+            record: The record about to be emitted.
+
+        Returns:
+            bool: True when the record may be emitted now.
+        """
+        return self._order.admit(self._handler, record)
+
+
+class ProjectLogOrder:
+    """Emit the log records of concurrently synced projects in config order.
+
+    While ``ordered_project_logs`` is active, every handler of the root logger
+    holds back the records logged from a project's thread until all earlier
+    projects have finished. The first unfinished project logs live; the
+    records of later ones are emitted as soon as it is their turn, so the log
+    reads as it would from a serial run. Records from other threads pass
+    through unchanged.
+    """
+
+    def __init__(self) -> None:
+        """Start with no project running."""
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next = 1
+        self._finished: set[int] = set()
+        self._held: defaultdict[int, list[_Held]] = defaultdict(list)
+
+    def run(
+        self,
+        index: int,
+        fn: Callable[..., T],
+        *args: Any,  # ruff:ignore[any-type] # passed through to fn
+    ) -> T:
+        """Run one project's sync on this thread with its log records ordered.
+
+        Args:
+            index: 1-based position of the project in the config.
+            fn: The project's sync.
+            *args: Arguments for ``fn``.
+
+        Returns:
+            T: Whatever ``fn`` returns.
+        """
+        self._local.index = index
+        try:
+            return fn(*args)
+        finally:
+            self._local.index = None
+            self._finish(index)
+
+    def admit(self, handler: logging.Handler, record: logging.LogRecord) -> bool:
+        """Decide whether a record is emitted now or held back.
+
+        Args:
+            handler: The handler about to emit the record.
+            record: The record.
+
+        Returns:
+            bool: True when the record may be emitted now.
+        """
+        index = getattr(self._local, "index", None)
+        if index is None:
+            return True
+        with self._lock:
+            if index <= self._next:
+                return True
+            self._held[index].append((handler, record))
+        return False
+
+    def _finish(self, index: int) -> None:
+        """Mark a project finished and emit every project whose turn came.
+
+        Args:
+            index: 1-based position of the finished project.
+        """
+        with self._lock:
+            self._finished.add(index)
+            due: list[list[_Held]] = []
+            while self._next in self._finished:
+                self._next += 1
+                # The new head may still be running: release what it logged so
+                # far, and admit() lets the rest through live.
+                due.append(self._held.pop(self._next, []))
+            # Emitted under the lock, so a head that starts logging live can't
+            # overtake the records it held back.
+            for records in due:
+                self._emit(records)
+
+    def flush(self) -> None:
+        """Emit whatever is still held back, in config order."""
+        with self._lock:
+            held = [self._held.pop(index) for index in sorted(self._held)]
+        for records in held:
+            self._emit(records)
+
+    @staticmethod
+    def _emit(records: list[_Held]) -> None:
+        """Hand held-back records to their handlers, in the order logged.
+
+        Called with no project index set on the thread, so the hold-back
+        filter lets them through this time.
+
+        Args:
+            records: Handler and record pairs.
+        """
+        for handler, record in records:
+            handler.handle(record)
+
+
+@contextmanager
+def ordered_project_logs() -> Generator[ProjectLogOrder, None, None]:
+    """Hold back project log records on every root handler while active.
+
+    On leaving, even through an exception, the filters are removed and
+    anything still held back is emitted.
+
+    Yields:
+        ProjectLogOrder: The buffer whose ``run`` each project goes through.
+    """
+    order = ProjectLogOrder()
+    filters = [
+        (handler, _HoldBack(order, handler)) for handler in logging.getLogger().handlers
+    ]
+    for handler, hold_back in filters:
+        handler.addFilter(hold_back)
+    try:
+        yield order
+    finally:
+        for handler, hold_back in filters:
+            handler.removeFilter(hold_back)
+        order.flush()
@@ -0,0 +1,74 @@
+"""Bound a whole run by wall-clock time, for ``--deadline``."""
+
+from __future__ import annotations
+
+import time
+
+# No firewall is started with less time left than this: a lookup, a set_rules
+# and the wait for its action rarely fit into less.
+MIN_FIREWALL_TIME = 10.0
+
+# Request timeouts are never shrunk below this, so a request started just
+# before the deadline still has a chance to get an answer.
+MIN_REQUEST_TIMEOUT = 1.0
+
+
+class Deadline:
+    """The moment by which the run has to be done, if there is one.
+
+    Set once before any work starts and only read afterwards, so it is safe to
+    share between threads and the event loop.
+    """
+
+    def __init__(self) -> None:
+        """Start without a deadline."""
+        self._at: float | None = None
+
+    def start(self, seconds: float | None) -> None:
+        """Set the deadline ``seconds`` from now, or clear it.
+
+        Args:
+            seconds: Time the run may take, or None for no limit.
+        """
+        self._at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float | None:
+        """Return the time left.
+
+        Returns:
+            float | None: Seconds until the deadline, negative once it has
+            passed, or None without a deadline.
+        """
+        return None if self._at is None else self._at - time.monotonic()
+
+    def allows(self, seconds: float) -> bool:
+        """Tell whether something taking ``seconds`` still fits.
+
+        Args:
+            seconds: Time the work is expected to take.
+
+        Returns:
+            bool: True without a deadline or when more time than that is left.
+        """
+        remaining = self.remaining()
+        return remaining is None or remaining > seconds
+
+    def clamp(self, timeout: tuple[float, float]) -> tuple[float, float]:
+        """Shrink a ``(connect, read)`` timeout so it ends by the deadline.
+
+        Args:
+            timeout: The usual timeouts.
+
+        Returns:
+            tuple[float, float]: The timeouts, each at most the time left but
+            never below ``MIN_REQUEST_TIMEOUT``.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        limit = max(MIN_REQUEST_TIMEOUT, remaining)
+        connect, read = timeout
+        return min(connect, limit), min(read, limit)
+
+
+RUN_DEADLINE = Deadline()
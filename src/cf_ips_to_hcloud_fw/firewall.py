@@ -3,27 +3,67 @@
 from __future__ import annotations
 
 import logging
+import re
+import time
+from collections import Counter
+from operator import itemgetter
 from typing import TYPE_CHECKING, NamedTuple
 
 from hcloud import APIException, Client
-from hcloud.actions import ActionException
+from hcloud.actions import (
+    Action,
+    ActionException,
+    ActionFailedException,
+    ActionTimeoutException,
+)
 from hcloud.firewalls.domain import Firewall, FirewallRule
 from requests.exceptions import InvalidHeader, RequestException
 
 from cf_ips_to_hcloud_fw.custom_logging import log_error
+from cf_ips_to_hcloud_fw.deadline import MIN_FIREWALL_TIME, RUN_DEADLINE
+from cf_ips_to_hcloud_fw.metrics import ACTION_WAIT, RULES_CHANGED, count_project
+from cf_ips_to_hcloud_fw.models import cidr_key
+from cf_ips_to_hcloud_fw.ratelimit import shared_session
+from cf_ips_to_hcloud_fw.timing import record_timing, timed
 
 if TYPE_CHECKING:  # pragma: no cover
-    from cf_ips_to_hcloud_fw.models import CloudflareCIDRs, Project  # pragma: no cover
+    from hcloud.actions import BoundAction  # pragma: no cover
+    from hcloud.firewalls import BoundFirewall  # pragma: no cover
+
+    from cf_ips_to_hcloud_fw.models import (  # pragma: no cover
+        CloudflareCIDRs,
+        Project,
+        SourceList,
+    )
 
 CF_IPV4 = "__CLOUDFLARE_IPS_V4__"
 CF_IPV6 = "__CLOUDFLARE_IPS_V6__"
 CF_ALL = "__CLOUDFLARE_IPS__"
 
+# Any of the three markers, and the numbered form a rule carries when it holds
+# the overflow of an oversized marked rule: "__CLOUDFLARE_IPS_2__" continues
+# "__CLOUDFLARE_IPS__", "__CLOUDFLARE_IPS_V4_3__" continues "__CLOUDFLARE_IPS_V4__".
+_MARKER = re.compile(r"__CLOUDFLARE_IPS(_V4|_V6)?__")
+_CONTINUATION_MARKER = re.compile(r"__CLOUDFLARE_IPS(_V4|_V6)?_(\d+)__")
+
+# Hetzner refuses a set_rules call, for the whole firewall, when one rule lists
+# more source IPs than it allows. Longer lists are spread across numbered rules
+# of at most this many entries; --max-rule-sources overrides it.
+MAX_RULE_SOURCES = 100
+
+HCLOUD_API_ENDPOINT = "https://api.hetzner.cloud/v1"
+
 # Bounded (connect, read) timeout in seconds. The SDK passes this straight to
 # requests; without it a hung Hetzner API call would stall the whole run
 # indefinitely.
 HCLOUD_TIMEOUT = (5.0, 30.0)
 
+# Shared action polling: one pass over every still-running set_rules action per
+# interval, giving up after the same 120 x 1s budget the SDK's own
+# wait_until_finished uses per action.
+ACTION_POLL_INTERVAL = 1.0
+ACTION_POLL_MAX_ROUNDS = 120
+
 
 class IPVersionTargets(NamedTuple):
     """Flags for which IP versions (IPv4/IPv6) a firewall rule should target."""
@@ -32,16 +72,191 @@ class IPVersionTargets(NamedTuple):
     ipv6: bool
 
 
+class PendingRules(NamedTuple):
+    """A submitted set_rules request whose actions have not been awaited yet.
+
+    Attributes:
+        label: Project-prefixed firewall label, as recorded in ``ProjectOutcome``.
+        fw: Firewall the rules were pushed to (used for logging).
+        actions: Actions returned by ``set_rules``.
+    """
+
+    label: str
+    fw: Firewall
+    actions: list[BoundAction]
+
+
 class ProjectOutcome(NamedTuple):
     """Per-project result split into benign skips and hard failures.
 
     Attributes:
         skipped: Labels of firewalls that were not found (benign).
         failed: Labels of firewalls whose sync errored against the API.
+        untouched: Labels of firewalls not started because the ``--deadline``
+            was too close.
     """
 
     skipped: list[str]
     failed: list[str]
+    untouched: tuple[str, ...] = ()
+
+
+class ResolvedFirewalls(NamedTuple):
+    """A project's configured firewall names resolved against the API.
+
+    Attributes:
+        found: Project-prefixed label and firewall of every name found, in
+            config order.
+        skipped: Labels of firewalls that were not found (benign).
+        failed: Labels of firewalls whose lookup errored against the API.
+    """
+
+    found: list[tuple[str, BoundFirewall]]
+    skipped: list[str]
+    failed: list[str]
+
+
+class RuleChange(NamedTuple):
+    """What a sync does, or would do, to one marked rule.
+
+    Overflow rules are folded into their marked rule first, so ``current`` is
+    the rule's whole list however it is split on the firewall.
+
+    Attributes:
+        description: The rule's description, marker included.
+        protocol: The rule's protocol.
+        port: The rule's port or port range, if any.
+        current: Source CIDRs on the firewall.
+        desired: Source CIDRs the rule should hold.
+        added: CIDRs in ``desired`` but not in ``current``.
+        removed: CIDRs in ``current`` but not in ``desired``.
+    """
+
+    description: str
+    protocol: str
+    port: str | None
+    current: list[str]
+    desired: list[str]
+    added: list[str]
+    removed: list[str]
+
+
+class FirewallPlan(NamedTuple):
+    """What a sync would do to one firewall.
+
+    Attributes:
+        name: Firewall name.
+        id: Firewall ID.
+        needs_update: Whether a sync would call set_rules, which is also the
+            case when only the split across overflow rules changes.
+        rules: One entry per marked rule, in rule order.
+    """
+
+    name: str
+    id: int | None
+    needs_update: bool
+    rules: list[RuleChange]
+
+
+class ProjectPlan(NamedTuple):
+    """What a sync would do to one project's firewalls.
+
+    Attributes:
+        index: 1-based index of the project in the config.
+        outcome: Labels of firewalls not found or whose lookup failed.
+        firewalls: One plan per firewall found, in config order.
+    """
+
+    index: int
+    outcome: ProjectOutcome
+    firewalls: list[FirewallPlan]
+
+
+def summarize_outcomes(outcomes: list[ProjectOutcome]) -> str | None:
+    """Describe every firewall that was not updated, failures first.
+
+    Args:
+        outcomes: Per-project outcomes, in config order.
+
+    Returns:
+        str | None: One-line report, or None when every firewall was updated.
+    """
+    failed = [label for outcome in outcomes for label in outcome.failed]
+    skipped = [label for outcome in outcomes for label in outcome.skipped]
+    untouched = [label for outcome in outcomes for label in outcome.untouched]
+    if not failed and not skipped and not untouched:
+        return None
+    parts: list[str] = []
+    if failed:
+        parts.append(f"failed: {', '.join(failed)}")
+    if skipped:
+        parts.append(f"not found: {', '.join(skipped)}")
+    if untouched:
+        parts.append(f"not started before the deadline: {', '.join(untouched)}")
+    return f"Some firewalls were not updated ({'; '.join(parts)})"
+
+
+def out_of_time(project: Project, *, project_index: int) -> ProjectOutcome:
+    """Report a project the deadline left no time to start.
+
+    Args:
+        project: Project definition that holds the firewall names.
+        project_index: 1-based index of the project being processed, used for logging.
+
+    Returns:
+        ProjectOutcome: Every firewall of the project as untouched.
+    """
+    logging.warning(f"Deadline near - not starting project {project_index}")
+    outcome = ProjectOutcome(
+        skipped=[],
+        failed=[],
+        untouched=tuple(
+            f"project {project_index}:{name!r}" for name in project.firewalls
+        ),
+    )
+    count_project(len(project.firewalls), outcome)
+    return outcome
+
+
+def log_untouched(untouched: list[str], *, project_index: int) -> None:
+    """Log the firewalls of a project that the deadline cut off.
+
+    Args:
+        untouched: Labels of the firewalls not started.
+        project_index: 1-based index of the project being processed, used for logging.
+    """
+    if untouched:
+        logging.warning(
+            f"Deadline near - not starting {len(untouched)} more firewall(s) in "
+            f"project {project_index}"
+        )
+
+
+def make_client(project: Project) -> Client:
+    """Build an authenticated Hetzner Cloud client for a project.
+
+    The SDK exposes no hook for its HTTP session, so the private one is
+    swapped for the process-wide ``PacedSession``, which spaces requests by the
+    token's rate limit budget and keeps connections alive across projects. The
+    session also retries transient failures within the run's retry budget, so
+    the SDK's own retries are turned off rather than multiplied with them.
+
+    Args:
+        project: Project definition that holds the API token.
+
+    Returns:
+        Client: Client with a bounded request timeout and paced requests.
+    """
+    client = Client(
+        token=project.token.get_secret_value(),
+        api_endpoint=HCLOUD_API_ENDPOINT,
+        timeout=HCLOUD_TIMEOUT,
+    )
+    # Closed rather than orphaned with its pool, as grow_pool does.
+    client._client._session.close()  # ruff:ignore[private-member-access]
+    client._client._session = shared_session()  # ruff:ignore[private-member-access]
+    client._client._retry_max_retries = 0  # ruff:ignore[private-member-access]
+    return client
 
 
 def _describe_sdk_error(e: Exception) -> str:
@@ -73,8 +288,95 @@ def _describe_sdk_error(e: Exception) -> str:
     return str(e)
 
 
+def _index_firewalls(
+    client: Client, *, project_index: int
+) -> dict[str, BoundFirewall] | None:
+    """List every firewall in a project once and index it by name.
+
+    One paginated listing (50 firewalls per page) replaces a ``get_by_name``
+    round trip per configured firewall. Firewall names are unique within a
+    project, so the index is unambiguous.
+
+    Args:
+        client: Authenticated Hetzner Cloud client.
+        project_index: 1-based index of the project being processed, used for logging.
+
+    Returns:
+        dict[str, BoundFirewall] | None: Firewalls keyed by name, or None when
+        the listing failed and the caller should fall back to per-name lookups.
+    """
+    try:
+        with timed("get_all"):
+            firewalls = client.firewalls.get_all()
+    except (APIException, RequestException) as e:
+        logging.warning(
+            f"hcloud/firewalls.get_all failed in project {project_index}, "
+            f"falling back to per-name lookups: {_describe_sdk_error(e)}"
+        )
+        return None
+    return {fw.name: fw for fw in firewalls if fw.name is not None}
+
+
+def _resolve_firewalls(
+    client: Client, project: Project, *, project_index: int
+) -> ResolvedFirewalls:
+    """Look up every firewall a project lists by name.
+
+    With more than one firewall configured, the project's firewalls are listed
+    once and resolved by name from that listing; if the listing fails, each
+    name is looked up individually instead, so a firewall is only ever
+    recorded as failed by its own lookup.
+
+    Args:
+        client: Authenticated Hetzner Cloud client.
+        project: Project definition that holds the firewall names.
+        project_index: 1-based index of the project being processed, used for logging.
+
+    Returns:
+        ResolvedFirewalls: Firewalls found, and labels of the others.
+    """
+    found: list[tuple[str, BoundFirewall]] = []
+    skipped: list[str] = []
+    failed: list[str] = []
+    # A single name costs one get_by_name either way; listing only pays off
+    # once there is more than one name to resolve.
+    by_name = (
+        _index_firewalls(client, project_index=project_index)
+        if len(project.firewalls) > 1
+        else None
+    )
+    for name in project.firewalls:
+        label = f"project {project_index}:{name!r}"
+        if by_name is not None:
+            fw = by_name.get(name)
+        else:
+            try:
+                with timed("get_by_name", label):
+                    fw = client.firewalls.get_by_name(name)
+            except (APIException, RequestException) as e:
+                log_error(
+                    "hcloud/firewalls.get_by_name failed for "
+                    f"{name!r} in project {project_index}: {_describe_sdk_error(e)}"
+                )
+                failed.append(label)
+                continue
+        if fw:
+            found.append((label, fw))
+        else:
+            logging.debug(
+                f"hcloud firewall {name!r} not found in project {project_index}"
+            )
+            skipped.append(label)
+    return ResolvedFirewalls(found=found, skipped=skipped, failed=failed)
+
+
 def update_project(
-    *, project: Project, cf_cidrs: CloudflareCIDRs, project_index: int
+    *,
+    project: Project,
+    cf_cidrs: CloudflareCIDRs,
+    project_index: int,
+    client: Client | None = None,
+    max_sources: int = MAX_RULE_SOURCES,
 ) -> ProjectOutcome:
     """Synchronize every firewall listed in a project with the latest CIDRs.
 
@@ -83,66 +385,266 @@ def update_project(
     does not abort the whole run. The caller exits non-zero once every
     firewall has been attempted.
 
+    Rule changes are submitted for every firewall first and their actions are
+    awaited together afterwards, so the project takes roughly as long as its
+    slowest action rather than the sum of all of them.
+
+    Firewalls are looked up as described in ``_resolve_firewalls``. With a
+    ``--deadline``, no firewall is started once less than
+    ``MIN_FIREWALL_TIME`` is left; those are reported as untouched.
+
+    Args:
+        project: Project definition that holds the API token and firewall names.
+        cf_cidrs: Cloudflare CIDR model downloaded at runtime.
+        project_index: 1-based index of the project being processed, used for logging.
+        client: Client to reuse, e.g. across watch-mode cycles; a new one is
+            built from the project's token when omitted.
+        max_sources: Most source IPs a single rule may hold.
+
+    Returns:
+        ProjectOutcome: Labels of skipped, failed and untouched firewalls,
+        project-prefixed.
+    """
+    if not RUN_DEADLINE.allows(MIN_FIREWALL_TIME):
+        return out_of_time(project, project_index=project_index)
+    if client is None:
+        client = make_client(project)
+    resolved = _resolve_firewalls(client, project, project_index=project_index)
+    failed = list(resolved.failed)
+    pending: list[PendingRules] = []
+    untouched: list[str] = []
+    for label, fw in resolved.found:
+        if not RUN_DEADLINE.allows(MIN_FIREWALL_TIME):
+            untouched.append(label)
+            continue
+        logging.info(
+            f"Inspecting hcloud firewall {fw.name!r} in project {project_index}"
+        )
+        actions = update_firewall(
+            client,
+            fw,
+            cf_cidrs,
+            project_index=project_index,
+            max_sources=max_sources,
+        )
+        if actions is None:
+            failed.append(label)
+        elif actions:
+            pending.append(PendingRules(label=label, fw=fw, actions=actions))
+    log_untouched(untouched, project_index=project_index)
+    failed_actions = set(wait_for_actions(pending, project_index=project_index))
+    # Keep config order: a firewall whose actions failed is reported where it
+    # was listed, not after every firewall that failed earlier on submit.
+    failed = [
+        label
+        for label in (f"project {project_index}:{name!r}" for name in project.firewalls)
+        if label in failed or label in failed_actions
+    ]
+    outcome = ProjectOutcome(
+        skipped=resolved.skipped, failed=failed, untouched=tuple(untouched)
+    )
+    count_project(len(project.firewalls), outcome)
+    return outcome
+
+
+def plan_project(
+    *,
+    project: Project,
+    cf_cidrs: CloudflareCIDRs,
+    project_index: int,
+    max_sources: int = MAX_RULE_SOURCES,
+) -> ProjectPlan:
+    """Work out what ``update_project`` would change, without changing it.
+
+    Discovery and the marker and diff logic are the same as for a sync, but
+    set_rules is never called, so there are no actions to wait for.
+
     Args:
         project: Project definition that holds the API token and firewall names.
         cf_cidrs: Cloudflare CIDR model downloaded at runtime.
         project_index: 1-based index of the project being processed, used for logging.
+        max_sources: Most source IPs a single rule may hold.
+
+    Returns:
+        ProjectPlan: The planned changes, firewall by firewall.
+    """
+    client = make_client(project)
+    resolved = _resolve_firewalls(client, project, project_index=project_index)
+    firewalls: list[FirewallPlan] = []
+    for _, fw in resolved.found:
+        logging.info(f"Planning hcloud firewall {fw.name!r} in project {project_index}")
+        changes: list[RuleChange] = []
+        needs_update = apply_cloudflare_rules(
+            fw,
+            cf_cidrs,
+            project_index=project_index,
+            max_sources=max_sources,
+            changes=changes,
+        )
+        firewalls.append(FirewallPlan(fw.name or "", fw.id, needs_update, changes))
+    return ProjectPlan(
+        index=project_index,
+        outcome=ProjectOutcome(skipped=resolved.skipped, failed=resolved.failed),
+        firewalls=firewalls,
+    )
+
+
+def count_rules_changed(changes: list[RuleChange]) -> None:
+    """Count the marked rules a successful set_rules rewrote.
+
+    Args:
+        changes: The firewall's rule changes, from ``apply_cloudflare_rules``.
+    """
+    RULES_CHANGED.inc(amount=sum(1 for c in changes if c.added or c.removed))
+
+
+def _seen_rules(changes: list[RuleChange]) -> list[tuple[str, frozenset[object]]]:
+    """Reduce planned rule changes to what the optimistic check compares.
+
+    Args:
+        changes: Rule changes, from a plan or computed just now.
+
+    Returns:
+        list[tuple[str, frozenset[object]]]: Each marked rule's description
+        and its current CIDRs as ``cidr_key`` values, in rule order.
+    """
+    return [
+        (change.description, frozenset(map(cidr_key, change.current)))
+        for change in changes
+    ]
+
+
+def apply_project_plan(
+    *,
+    project: Project,
+    firewalls: list[FirewallPlan],
+    cf_cidrs: CloudflareCIDRs,
+    project_index: int,
+    max_sources: int = MAX_RULE_SOURCES,
+) -> ProjectOutcome:
+    """Push the changes a plan recorded for one project's firewalls.
+
+    Only firewalls the plan marks as needing an update are touched, and each
+    costs one ``get_by_name`` before its write. A firewall whose marked rules
+    no longer hold the CIDRs the plan saw was changed by someone else since,
+    so it is left alone and recorded as failed. The others get the planned
+    ranges applied to their current rules, are submitted one after another,
+    and their actions are awaited together.
+
+    Args:
+        project: Project definition that holds the API token.
+        firewalls: The plan's firewalls for this project.
+        cf_cidrs: Cloudflare ranges the plan was computed against.
+        project_index: 1-based index of the project being processed, used for logging.
+        max_sources: Most source IPs per rule the plan was computed with.
 
     Returns:
-        ProjectOutcome: Labels of skipped and failed firewalls, project-prefixed.
+        ProjectOutcome: Labels of firewalls gone since the plan was made
+        (skipped), of stale or failed ones, and of those the deadline cut off.
     """
-    client = Client(token=project.token.get_secret_value(), timeout=HCLOUD_TIMEOUT)
+    client = make_client(project)
+    to_apply = [planned for planned in firewalls if planned.needs_update]
     skipped: list[str] = []
     failed: list[str] = []
-    for name in project.firewalls:
-        label = f"project {project_index}:{name!r}"
+    pending: list[PendingRules] = []
+    untouched: list[str] = []
+    for planned in to_apply:
+        label = f"project {project_index}:{planned.name!r}"
+        if not RUN_DEADLINE.allows(MIN_FIREWALL_TIME):
+            untouched.append(label)
+            continue
         try:
-            fw = client.firewalls.get_by_name(name)
+            with timed("get_by_name", label):
+                fw = client.firewalls.get_by_name(planned.name)
         except (APIException, RequestException) as e:
             log_error(
                 "hcloud/firewalls.get_by_name failed for "
-                f"{name!r} in project {project_index}: {_describe_sdk_error(e)}"
+                f"{planned.name!r} in project {project_index}: "
+                f"{_describe_sdk_error(e)}"
             )
             failed.append(label)
             continue
-        if fw:
-            logging.info(
-                f"Inspecting hcloud firewall {name!r} in project {project_index}"
-            )
-            if not update_firewall(client, fw, cf_cidrs, project_index=project_index):
-                failed.append(label)
-        else:
+        if not fw:
             logging.debug(
-                f"hcloud firewall {name!r} not found in project {project_index}"
+                f"hcloud firewall {planned.name!r} not found in project {project_index}"
             )
             skipped.append(label)
-    return ProjectOutcome(skipped=skipped, failed=failed)
+            continue
+        changes: list[RuleChange] = []
+        needs_update = apply_cloudflare_rules(
+            fw,
+            cf_cidrs,
+            project_index=project_index,
+            max_sources=max_sources,
+            changes=changes,
+        )
+        if _seen_rules(changes) != _seen_rules(planned.rules):
+            log_error(
+                f"hcloud firewall {planned.name!r} in project {project_index} "
+                "changed since the plan was made - not updating it"
+            )
+            failed.append(label)
+            continue
+        if not needs_update:
+            continue
+        actions = fw_set_rules(client, fw, project_index=project_index)
+        if actions is None:
+            failed.append(label)
+            continue
+        count_rules_changed(changes)
+        if actions:
+            pending.append(PendingRules(label=label, fw=fw, actions=actions))
+    log_untouched(untouched, project_index=project_index)
+    failed.extend(wait_for_actions(pending, project_index=project_index))
+    outcome = ProjectOutcome(skipped=skipped, failed=failed, untouched=tuple(untouched))
+    count_project(len(to_apply), outcome)
+    return outcome
+
+
+def _cidr_delta(current: list[str], desired: list[str]) -> tuple[list[str], list[str]]:
+    """Compare two CIDR lists by network, ignoring order and spelling.
+
+    Args:
+        current: CIDRs on the firewall.
+        desired: CIDRs the rule should hold.
+
+    Returns:
+        tuple[list[str], list[str]]: CIDRs only in ``desired`` (added) and
+        only in ``current`` (removed), each in its list's order.
+    """
+    current_keys = set(map(cidr_key, current))
+    desired_keys = set(map(cidr_key, desired))
+    return (
+        [cidr for cidr in desired if cidr_key(cidr) not in current_keys],
+        [cidr for cidr in current if cidr_key(cidr) not in desired_keys],
+    )
 
 
 def update_source_ips(
-    fw: Firewall, rule: FirewallRule, cidrs: list[str], kind: str, *, project_index: int
+    fw: Firewall, rule: FirewallRule, desired: SourceList, *, project_index: int
 ) -> bool:
     """Update a rule's source CIDRs when they differ.
 
     Args:
         fw: Firewall currently being mutated.
         rule: Individual firewall rule within the firewall.
-        cidrs: Desired list of CIDR strings.
-        kind: Human-readable tag (IPv4/IPv6) for logging.
+        desired: Desired CIDRs, shared by every rule with the same marker.
         project_index: 1-based index of the project being processed, used for logging.
 
     Returns:
         bool: True when the rule was modified.
     """
-    # Compare order-independently: Hetzner may return source_ips in a different
-    # order than we wrote them, and re-pushing an identically-membered list only
-    # causes needless API writes and firewall churn.
-    needs_update = set(rule.source_ips or []) != set(cidrs)
+    # Compare order- and spelling-independently: Hetzner may return source_ips
+    # in a different order or notation than we wrote them, and re-pushing an
+    # identically-membered list only causes needless API writes and churn.
+    current = rule.source_ips or []
+    needs_update = set(map(cidr_key, current)) != desired.members
     if needs_update:
-        rule.source_ips = cidrs
+        added, removed = _cidr_delta(current, desired.cidrs)
+        rule.source_ips = desired.cidrs
         logging.debug(
             f"Updating {fw.name!r}/{rule.description!r} in project {project_index} "
-            f"with {kind} addresses"
+            f"with {desired.kind} addresses: added {added}, removed {removed}"
         )
     else:
         logging.debug(
@@ -174,22 +676,147 @@ def update_firewall_rule(
     """
     if not ip_targets.ipv4 and not ip_targets.ipv6:
         return False
+    desired = cf_cidrs.source_lists[ip_targets.ipv4, ip_targets.ipv6]
+    return update_source_ips(fw, rule, desired, project_index=project_index)
+
+
+def _continuation_description(description: str, number: int) -> str:
+    """Return a rule description with every marker numbered.
+
+    Args:
+        description: Description of the marked rule being split.
+        number: 2 for the first overflow rule, 3 for the next, and so on.
+
+    Returns:
+        str: The description of that overflow rule.
+    """
+    return _MARKER.sub(
+        lambda m: f"__CLOUDFLARE_IPS{m.group(1) or ''}_{number}__", description
+    )
+
+
+def _rule_key(rule: FirewallRule) -> tuple[object, ...]:
+    """Identify a rule by content, ignoring the order of its addresses.
+
+    Args:
+        rule: Any firewall rule.
+
+    Returns:
+        tuple[object, ...]: Hashable key; equal for rules Hetzner treats alike.
+    """
+    return (
+        rule.direction,
+        rule.protocol,
+        rule.port,
+        rule.description,
+        frozenset(map(cidr_key, rule.source_ips or [])),
+        frozenset(map(cidr_key, rule.destination_ips or [])),
+    )
+
+
+def _base_key(rule: FirewallRule, description: str) -> tuple[object, ...]:
+    """Identify the marked rule an overflow rule continues.
+
+    Args:
+        rule: A marked rule, or an overflow rule split from one.
+        description: The marked rule's description.
+
+    Returns:
+        tuple[object, ...]: Hashable key; equal for a marked rule and every
+        overflow rule split from it.
+    """
+    return (
+        rule.direction,
+        rule.protocol,
+        rule.port,
+        frozenset(map(cidr_key, rule.destination_ips or [])),
+        description,
+    )
+
+
+def _join_continuations(rules: list[FirewallRule]) -> list[FirewallRule]:
+    """Fold numbered overflow rules back into the marked rule they continue.
+
+    Overflow sources are appended in number order to the inbound rule with
+    the same protocol, port and destinations whose description is the
+    overflow rule's with the number taken out, so that rule holds its whole
+    list again and is compared against the desired ranges as one. Inbound
+    overflow rules whose marked rule is gone are dropped; outbound rules are
+    never touched.
+
+    Args:
+        rules: The firewall's rules as returned by the API.
+
+    Returns:
+        list[FirewallRule]: The rules without any inbound overflow rule.
+    """
+    bases: dict[tuple[object, ...], FirewallRule] = {}
+    kept: list[FirewallRule] = []
+    overflow: list[tuple[int, FirewallRule]] = []
+    for rule in rules:
+        description = rule.description or ""
+        if rule.direction != FirewallRule.DIRECTION_IN:
+            kept.append(rule)
+        elif match := _CONTINUATION_MARKER.search(description):
+            overflow.append((int(match[2]), rule))
+        else:
+            kept.append(rule)
+            if _MARKER.search(description):
+                bases.setdefault(_base_key(rule, description), rule)
+    for _, extra in sorted(overflow, key=itemgetter(0)):
+        description = _CONTINUATION_MARKER.sub(
+            r"__CLOUDFLARE_IPS\1__", extra.description or ""
+        )
+        if (base := bases.get(_base_key(extra, description))) is not None:
+            base.source_ips = [*(base.source_ips or []), *(extra.source_ips or [])]
+    return kept
+
+
+def _split_rule(rule: FirewallRule, max_sources: int) -> list[FirewallRule]:
+    """Move the sources beyond ``max_sources`` into numbered overflow rules.
+
+    The sources are put in address order, IPv4 first, before being cut, so
+    the same set always splits the same way whatever order Hetzner returns it
+    in.
 
-    ip_types: dict[tuple[bool, bool], tuple[list[str], str]] = {
-        (True, True): (cf_cidrs.ipv4_cidrs + cf_cidrs.ipv6_cidrs, "IPv4+IPv6"),
-        (True, False): (cf_cidrs.ipv4_cidrs, "IPv4"),
-        (False, True): (cf_cidrs.ipv6_cidrs, "IPv6"),
-    }
-    ip_cidrs, ip_type = ip_types[ip_targets.ipv4, ip_targets.ipv6]
-    return update_source_ips(fw, rule, ip_cidrs, ip_type, project_index=project_index)
+    Args:
+        rule: Marked rule holding its whole list of sources; keeps the first
+            ``max_sources`` of them.
+        max_sources: Most source IPs a single rule may hold.
 
+    Returns:
+        list[FirewallRule]: Overflow rules with the same direction, protocol,
+        port and destinations, to be placed after ``rule``; empty when the
+        list fits.
+    """
+    sources = sorted(rule.source_ips or [], key=cidr_key)
+    if len(sources) <= max_sources:
+        return []
+    rule.source_ips = sources[:max_sources]
+    return [
+        FirewallRule(
+            direction=rule.direction,
+            protocol=rule.protocol,
+            source_ips=sources[start : start + max_sources],
+            port=rule.port,
+            destination_ips=rule.destination_ips,
+            description=_continuation_description(rule.description or "", number),
+        )
+        for number, start in enumerate(
+            range(max_sources, len(sources), max_sources), start=2
+        )
+    ]
 
-def fw_set_rules(client: Client, fw: Firewall, project_index: int) -> bool:
-    """Persist rule updates to Hetzner via the SDK.
+
+def fw_set_rules(
+    client: Client, fw: Firewall, project_index: int
+) -> list[BoundAction] | None:
+    """Submit rule updates to Hetzner via the SDK without waiting on them.
 
     set_rules is asynchronous: the SDK returns one action per request and each
-    only reflects the final result once finished. We wait on every action so a
-    later failure or timeout is surfaced instead of being reported as success.
+    only reflects the final result once finished. The actions are handed back
+    so the caller can await every firewall's actions together with
+    ``wait_for_actions`` instead of one firewall at a time.
 
     Args:
         client: Authenticated Hetzner Cloud client.
@@ -197,62 +824,221 @@ def fw_set_rules(client: Client, fw: Firewall, project_index: int) -> bool:
         project_index: 1-based index of the project being processed, used for logging.
 
     Returns:
-        bool: True on success, False when the API call or an action failed.
+        list[BoundAction] | None: The submitted actions, or None when the API
+        call failed.
     """
     logging.info(
         f"Updating rules for hcloud firewall {fw.name!r} in project {project_index}"
     )
     try:
         rules = fw.rules or []
-        actions = client.firewalls.set_rules(fw, rules)
-        for action in actions:
-            action.wait_until_finished()
-    except (APIException, ActionException, RequestException) as e:
+        with timed("set_rules", f"project {project_index}:{fw.name!r}"):
+            return client.firewalls.set_rules(fw, rules)
+    except (APIException, RequestException) as e:
         log_error(
             f"hcloud/firewall.set_rules failed for {fw.name!r} in project "
             f"{project_index}: {_describe_sdk_error(e)}"
         )
-        return False
-    return True
+        return None
 
 
-def update_firewall(
-    client: Client, fw: Firewall, cf_cidrs: CloudflareCIDRs, *, project_index: int
+def _poll_actions(actions: list[BoundAction]) -> list[BoundAction]:
+    """Reload each action once and return those still running.
+
+    Args:
+        actions: Actions of one firewall that were running at the last poll.
+
+    Returns:
+        list[BoundAction]: The actions that have not finished yet.
+
+    Raises:
+        ActionFailedException: If any of the actions finished with an error.
+    """
+    for action in actions:
+        action.reload()
+    errored = next((a for a in actions if a.status == Action.STATUS_ERROR), None)
+    if errored is not None:
+        raise ActionFailedException(action=errored)
+    return [a for a in actions if a.status == Action.STATUS_RUNNING]
+
+
+def wait_for_actions(pending: list[PendingRules], *, project_index: int) -> list[str]:
+    """Await the set_rules actions of several firewalls with one shared poll loop.
+
+    Every round reloads each still-running action once, then sleeps once, so
+    the wait is bounded by the slowest action rather than the sum of all of
+    them. A firewall fails on its first failed, unreadable, or timed-out
+    action; its remaining actions are no longer polled. Actions still running
+    when the poll budget or the ``--deadline`` runs out count as timed out.
+    Each firewall's wait is timed from the start of the loop until its actions
+    are settled.
+
+    Args:
+        pending: Submitted set_rules requests, one per changed firewall.
+        project_index: 1-based index of the project being processed, used for logging.
+
+    Returns:
+        list[str]: Labels of the firewalls whose actions did not succeed.
+    """
+    failed: list[str] = []
+    started = time.perf_counter()
+
+    def settle(entry: PendingRules) -> None:
+        waited = time.perf_counter() - started
+        record_timing("wait_actions", waited, entry.label)
+        ACTION_WAIT.observe(waited)
+
+    def fail(entry: PendingRules, e: Exception) -> None:
+        settle(entry)
+        log_error(
+            f"hcloud/firewall.set_rules failed for {entry.fw.name!r} in project "
+            f"{project_index}: {_describe_sdk_error(e)}"
+        )
+        failed.append(entry.label)
+
+    running = [(entry, list(entry.actions)) for entry in pending if entry.actions]
+    rounds = 0
+    while running:
+        still_running: list[tuple[PendingRules, list[BoundAction]]] = []
+        for entry, actions in running:
+            try:
+                left = _poll_actions(actions)
+            except (APIException, ActionException, RequestException) as e:
+                fail(entry, e)
+                continue
+            if left:
+                still_running.append((entry, left))
+            else:
+                settle(entry)
+        running = still_running
+        rounds += 1
+        if running and (
+            rounds >= ACTION_POLL_MAX_ROUNDS
+            or not RUN_DEADLINE.allows(ACTION_POLL_INTERVAL)
+        ):
+            for entry, actions in running:
+                fail(entry, ActionTimeoutException(action=actions[0]))
+            break
+        if running:
+            time.sleep(ACTION_POLL_INTERVAL)
+    return failed
+
+
+def apply_cloudflare_rules(
+    fw: Firewall,
+    cf_cidrs: CloudflareCIDRs,
+    *,
+    project_index: int,
+    max_sources: int = MAX_RULE_SOURCES,
+    changes: list[RuleChange] | None = None,
 ) -> bool:
-    """Refresh all Cloudflare-tagged rules on a firewall and push changes.
+    """Rewrite every Cloudflare-tagged inbound rule of a firewall in place.
+
+    Only the in-memory rules are touched; pushing them is left to the caller,
+    so the threaded and the asyncio engine share one marker and diff logic.
+
+    A marked rule whose ranges do not fit in ``max_sources`` keeps the first
+    ``max_sources`` and is followed by numbered overflow rules holding the
+    rest. Existing overflow rules are folded back in first, so they are
+    resized, recreated or deleted as the ranges and the limit change.
 
     Args:
-        client: Authenticated Hetzner Cloud client.
         fw: Firewall retrieved from the API.
         cf_cidrs: Cloudflare CIDR model downloaded at runtime.
         project_index: 1-based index of the project being processed, used for logging.
+        max_sources: Most source IPs a single rule may hold.
+        changes: When given, a ``RuleChange`` is appended for every marked
+            rule, changed or not.
 
     Returns:
-        bool: True on success (including no-op), False when pushing rules failed.
+        bool: True when at least one rule changed and set_rules is needed.
     """
-    if fw.rules:
-        needs_update = False
-        for rule in fw.rules:
-            if rule.direction == FirewallRule.DIRECTION_IN and rule.description:
-                ip_targets = IPVersionTargets(
-                    ipv4=CF_ALL in rule.description or CF_IPV4 in rule.description,
-                    ipv6=CF_ALL in rule.description or CF_IPV6 in rule.description,
-                )
-                needs_update |= update_firewall_rule(
-                    fw,
-                    rule,
-                    cf_cidrs,
-                    ip_targets,
-                    project_index=project_index,
-                )
-        if needs_update:
-            return fw_set_rules(client, fw, project_index=project_index)
-        logging.info(
-            f"hcloud firewall {fw.name!r} in project {project_index} already up-to-date"
-        )
-    else:
+    if not fw.rules:
         logging.warning(
             f"hcloud firewall {fw.name!r} in project {project_index} "
             "has no rules - ignoring it"
         )
-    return True
+        return False
+    before = Counter(_rule_key(rule) for rule in fw.rules)
+    rules: list[FirewallRule] = []
+    needs_update = False
+    for rule in _join_continuations(fw.rules):
+        rules.append(rule)
+        if rule.direction == FirewallRule.DIRECTION_IN and rule.description:
+            ip_targets = IPVersionTargets(
+                ipv4=CF_ALL in rule.description or CF_IPV4 in rule.description,
+                ipv6=CF_ALL in rule.description or CF_IPV6 in rule.description,
+            )
+            current = rule.source_ips or []
+            needs_update |= update_firewall_rule(
+                fw,
+                rule,
+                cf_cidrs,
+                ip_targets,
+                project_index=project_index,
+            )
+            if ip_targets.ipv4 or ip_targets.ipv6:
+                if changes is not None:
+                    desired = cf_cidrs.source_lists[ip_targets.ipv4, ip_targets.ipv6]
+                    changes.append(
+                        RuleChange(
+                            rule.description,
+                            rule.protocol,
+                            rule.port,
+                            current,
+                            desired.cidrs,
+                            *_cidr_delta(current, desired.cidrs),
+                        )
+                    )
+                overflow = _split_rule(rule, max_sources)
+                if overflow:
+                    logging.debug(
+                        f"Splitting {fw.name!r}/{rule.description!r} in project "
+                        f"{project_index} across {len(overflow) + 1} rules"
+                    )
+                rules.extend(overflow)
+    fw.rules = rules
+    # Splitting can change the rules when no marked rule's ranges did, e.g.
+    # when the limit changed or an overflow rule was edited by hand.
+    needs_update |= Counter(_rule_key(rule) for rule in rules) != before
+    if not needs_update:
+        logging.info(
+            f"hcloud firewall {fw.name!r} in project {project_index} already up-to-date"
+        )
+    return needs_update
+
+
+def update_firewall(
+    client: Client,
+    fw: Firewall,
+    cf_cidrs: CloudflareCIDRs,
+    *,
+    project_index: int,
+    max_sources: int = MAX_RULE_SOURCES,
+) -> list[BoundAction] | None:
+    """Refresh all Cloudflare-tagged rules on a firewall and submit changes.
+
+    Args:
+        client: Authenticated Hetzner Cloud client.
+        fw: Firewall retrieved from the API.
+        cf_cidrs: Cloudflare CIDR model downloaded at runtime.
+        project_index: 1-based index of the project being processed, used for logging.
+        max_sources: Most source IPs a single rule may hold.
+
+    Returns:
+        list[BoundAction] | None: Actions still to be awaited (empty on a
+        no-op), or None when submitting the rules failed.
+    """
+    changes: list[RuleChange] = []
+    if not apply_cloudflare_rules(
+        fw,
+        cf_cidrs,
+        project_index=project_index,
+        max_sources=max_sources,
+        changes=changes,
+    ):
+        return []
+    actions = fw_set_rules(client, fw, project_index=project_index)
+    if actions is not None:
+        count_rules_changed(changes)
+    return actions
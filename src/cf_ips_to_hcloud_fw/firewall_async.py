@@ -0,0 +1,735 @@
+"""Asyncio sync engine that keeps many Hetzner requests in flight at once."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any
+
+import httpx
+from hcloud import APIException
+from hcloud.actions import (
+    Action,
+    ActionException,
+    ActionFailedException,
+    ActionTimeoutException,
+)
+from hcloud.firewalls.domain import Firewall, FirewallRule
+
+from cf_ips_to_hcloud_fw import __version__
+from cf_ips_to_hcloud_fw.custom_logging import log_error
+from cf_ips_to_hcloud_fw.deadline import MIN_FIREWALL_TIME, RUN_DEADLINE
+from cf_ips_to_hcloud_fw.firewall import (
+    ACTION_POLL_INTERVAL,
+    ACTION_POLL_MAX_ROUNDS,
+    HCLOUD_API_ENDPOINT,
+    HCLOUD_TIMEOUT,
+    MAX_RULE_SOURCES,
+    ProjectOutcome,
+    RuleChange,
+    apply_cloudflare_rules,
+    count_rules_changed,
+    log_untouched,
+    out_of_time,
+)
+from cf_ips_to_hcloud_fw.metrics import ACTION_WAIT, count_project, observe_request
+from cf_ips_to_hcloud_fw.ratelimit import bucket_for, pacing_delay
+from cf_ips_to_hcloud_fw.retry import is_retryable, next_retry
+from cf_ips_to_hcloud_fw.timing import timed
+
+if TYPE_CHECKING:  # pragma: no cover
+    from collections.abc import Awaitable  # pragma: no cover
+
+    from cf_ips_to_hcloud_fw.models import CloudflareCIDRs, Project  # pragma: no cover
+
+# The largest page size the firewalls listing accepts.
+_PER_PAGE = 50
+
+# KeyError and TypeError come from a successful response that lacks the fields
+# read from it; like a failed request, that fails one firewall, not the run.
+_SYNC_ERRORS = (APIException, ActionException, httpx.HTTPError, KeyError, TypeError)
+
+
+class PacingPastDeadlineError(httpx.TransportError):
+    """Raised instead of waiting for a rate limit slot the deadline won't reach.
+
+    The ``httpx`` counterpart of ``ratelimit.PacingPastDeadlineError``: a
+    transport error that is neither a timeout nor a network error, so it is
+    not retried and fails the request like any other.
+    """
+
+
+def _describe_http_error(e: Exception) -> str:
+    """Summarize an HTTP failure without echoing anything that holds the token.
+
+    httpx's counterpart of requests' ``InvalidHeader`` is ``LocalProtocolError``:
+    h11 refuses a header value containing a newline and quotes it back, which
+    would put the ``Authorization`` value into the log. Everything else is
+    response- or connection-derived and kept, as in ``firewall.py``; a
+    response missing a field is named as malformed.
+
+    Args:
+        e: The exception raised while talking to the API.
+
+    Returns:
+        str: Message text for the log line.
+    """
+    if isinstance(e, httpx.LocalProtocolError):
+        return type(e).__name__
+    if isinstance(e, KeyError | TypeError):
+        return f"malformed response ({type(e).__name__}: {e})"
+    return str(e)
+
+
+def _read_response(response: httpx.Response) -> dict[str, Any]:
+    """Decode a Hetzner API response, raising the SDK's own exception on errors.
+
+    Mirrors ``hcloud``'s response handling so both engines report API errors
+    with the same text.
+
+    Args:
+        response: Raw HTTP response.
+
+    Returns:
+        dict[str, Any]: The decoded JSON payload.
+
+    Raises:
+        APIException: If the body is not a JSON object or the status is not a
+            success.
+    """
+    correlation_id = response.headers.get("X-Correlation-Id")
+    payload: dict[str, Any] = {}
+    try:
+        if response.content:
+            payload = response.json()
+    except ValueError as exc:
+        raise APIException(
+            code=response.status_code,
+            message=response.reason_phrase,
+            details={"content": response.content},
+            correlation_id=correlation_id,
+        ) from exc
+    if response.is_success and not isinstance(payload, dict):
+        raise APIException(
+            code=response.status_code,
+            message=response.reason_phrase,
+            details={"content": response.content},
+            correlation_id=correlation_id,
+        )
+    if not response.is_success:
+        error = payload.get("error") if isinstance(payload, dict) else None
+        if not error:
+            raise APIException(
+                code=response.status_code,
+                message=response.reason_phrase,
+                details={"content": response.content},
+                correlation_id=correlation_id,
+            )
+        raise APIException(
+            code=error["code"],
+            message=error["message"],
+            details=error.get("details"),
+            correlation_id=correlation_id,
+        )
+    return payload
+
+
+class HetznerApi:
+    """One API token's view of the Hetzner API over a shared HTTP client."""
+
+    def __init__(
+        self, http: httpx.AsyncClient, token: str, limit: asyncio.Semaphore
+    ) -> None:
+        """Bind a token and its in-flight limit to the shared HTTP client.
+
+        Args:
+            http: Connection-pooled client shared by every token.
+            token: Hetzner Cloud API token.
+            limit: Semaphore bounding this token's requests in flight.
+        """
+        self._http = http
+        self._limit = limit
+        self._bucket = bucket_for(token)
+        self._headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json",
+        }
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        params: dict[str, str | int] | None = None,
+        json: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        """Perform a request, retrying it while it fails transiently.
+
+        Transient failures are retried like ``PacedSession`` does, from the
+        same per-sync budget; the backoff is slept without holding a
+        semaphore slot.
+
+        Args:
+            method: HTTP method.
+            path: Path below the API endpoint, e.g. ``/firewalls``.
+            params: Query parameters.
+            json: JSON request body.
+
+        Returns:
+            dict[str, Any]: The decoded JSON payload.
+
+        Raises:
+            TimeoutException: If the last attempt timed out.
+            NetworkError: If no connection could be used on the last attempt.
+        """
+        label = f"{method} {path}"
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await self._send(method, path, params=params, json=json)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                delay = next_retry(label, attempt, type(e).__name__)
+                if delay is None:
+                    raise
+            else:
+                if not is_retryable(response.status_code, response.content):
+                    return _read_response(response)
+                delay = next_retry(
+                    label, attempt, str(response.status_code), response.headers
+                )
+                if delay is None:
+                    return _read_response(response)
+            await asyncio.sleep(delay)
+
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        *,
+        params: dict[str, str | int] | None,
+        json: dict[str, Any] | None,
+    ) -> httpx.Response:
+        """Send one request while holding a slot of the token's semaphore.
+
+        The request is first paced by the token's rate limit budget, shared
+        with the threaded engine's clients; the wait happens before taking a
+        semaphore slot, so a paced request does not hold one while sleeping.
+        Like ``PacedSession``, it is counted in the API metrics, and its
+        timeouts are shrunk to end by the ``--deadline``.
+
+        Args:
+            method: HTTP method.
+            path: Path below the API endpoint, e.g. ``/firewalls``.
+            params: Query parameters.
+            json: JSON request body.
+
+        Returns:
+            httpx.Response: The response, whatever its status.
+
+        Raises:
+            PacingPastDeadlineError: If the wait for a slot would end past the
+                ``--deadline``; nothing is sent then.
+            HTTPError: If no response arrived; re-raised after counting.
+        """
+        delay = pacing_delay(self._bucket)
+        if delay and not RUN_DEADLINE.allows(delay):
+            msg = f"rate limit pacing would wait {delay:.1f}s, past the deadline"
+            raise PacingPastDeadlineError(msg)
+        if delay:
+            await asyncio.sleep(delay)
+        async with self._limit:
+            connect, read = RUN_DEADLINE.clamp(HCLOUD_TIMEOUT)
+            started = time.perf_counter()
+            try:
+                response = await self._http.request(
+                    method,
+                    path,
+                    headers=self._headers,
+                    params=params,
+                    json=json,
+                    timeout=httpx.Timeout(read, connect=connect),
+                )
+            except httpx.HTTPError:
+                observe_request(method, path, "error", time.perf_counter() - started)
+                raise
+        observe_request(
+            method, path, str(response.status_code), time.perf_counter() - started
+        )
+        self._bucket.update(response.headers)
+        return response
+
+
+def _firewall_from_json(data: dict[str, Any]) -> Firewall:
+    """Build the SDK's firewall domain object from an API payload.
+
+    Args:
+        data: One ``firewall`` object as returned by the API.
+
+    Returns:
+        Firewall: Domain object the shared rule logic operates on.
+    """
+    rules = [
+        FirewallRule(
+            direction=rule["direction"],
+            protocol=rule["protocol"],
+            source_ips=rule.get("source_ips"),
+            port=rule.get("port"),
+            destination_ips=rule.get("destination_ips"),
+            description=rule.get("description"),
+        )
+        for rule in data.get("rules") or []
+    ]
+    return Firewall(id=data["id"], name=data["name"], rules=rules)
+
+
+def _action_from_json(data: dict[str, Any]) -> Action:
+    """Build the SDK's action domain object from an API payload.
+
+    Args:
+        data: One ``action`` object as returned by the API.
+
+    Returns:
+        Action: Domain object usable with the SDK's action exceptions.
+    """
+    return Action(
+        id=data["id"],
+        command=data.get("command"),
+        status=data.get("status"),
+        error=data.get("error"),
+    )
+
+
+async def _gather(*aws: Awaitable[Any]) -> list[Any]:
+    """Run awaitables concurrently and re-raise the first failure.
+
+    Unlike a bare ``asyncio.gather``, every awaitable is allowed to finish
+    before the first exception is re-raised, so no sibling is left running
+    with an exception nobody retrieves.
+
+    Args:
+        *aws: Awaitables to run.
+
+    Returns:
+        list[Any]: Results in argument order.
+    """
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def _index_firewalls(
+    api: HetznerApi, *, project_index: int
+) -> dict[str, Firewall] | None:
+    """List every firewall in a project and index it by name.
+
+    The first page reports how many pages exist; the rest are fetched
+    concurrently.
+
+    Args:
+        api: Token-bound API accessor.
+        project_index: 1-based index of the project being processed, used for logging.
+
+    Returns:
+        dict[str, Firewall] | None: Firewalls keyed by name, or None when the
+        listing failed and per-name lookups should be used instead.
+    """
+
+    def page(number: int) -> Awaitable[dict[str, Any]]:
+        return api.request(
+            "GET", "/firewalls", params={"page": number, "per_page": _PER_PAGE}
+        )
+
+    try:
+        with timed("get_all"):
+            first = await page(1)
+            pagination = (first.get("meta") or {}).get("pagination") or {}
+            last_page = pagination.get("last_page") or 1
+            rest = await _gather(*(page(number) for number in range(2, last_page + 1)))
+        return {
+            data["name"]: _firewall_from_json(data)
+            for listing in (first, *rest)
+            for data in listing["firewalls"]
+        }
+    except _SYNC_ERRORS as e:
+        logging.warning(
+            f"hcloud/firewalls.get_all failed in project {project_index}, "
+            f"falling back to per-name lookups: {_describe_http_error(e)}"
+        )
+        return None
+
+
+async def _get_by_name(api: HetznerApi, name: str, label: str) -> Firewall | None:
+    """Look up a single firewall by its exact name.
+
+    Args:
+        api: Token-bound API accessor.
+        name: Firewall name from the config.
+        label: Project-prefixed firewall label, for the timings.
+
+    Returns:
+        Firewall | None: The firewall, or None when no firewall has that name.
+    """
+    with timed("get_by_name", label):
+        listing = await api.request("GET", "/firewalls", params={"name": name})
+    firewalls = listing["firewalls"]
+    return _firewall_from_json(firewalls[0]) if firewalls else None
+
+
+async def _wait_for_action(api: HetznerApi, data: dict[str, Any]) -> None:
+    """Poll one action until it leaves the running state.
+
+    Args:
+        api: Token-bound API accessor.
+        data: The action as returned by ``set_rules``.
+
+    Raises:
+        ActionFailedException: If the action finished with an error.
+        ActionTimeoutException: If it was still running after the poll budget
+            or when the deadline came.
+    """
+    polls = 0
+    # The status of the last allowed poll counts, as in wait_for_actions.
+    while data.get("status") == Action.STATUS_RUNNING:
+        if polls >= ACTION_POLL_MAX_ROUNDS or not RUN_DEADLINE.allows(
+            ACTION_POLL_INTERVAL
+        ):
+            raise ActionTimeoutException(action=_action_from_json(data))
+        await asyncio.sleep(ACTION_POLL_INTERVAL)
+        data = (await api.request("GET", f"/actions/{data['id']}"))["action"]
+        polls += 1
+    if data.get("status") == Action.STATUS_ERROR:
+        raise ActionFailedException(action=_action_from_json(data))
+
+
+async def _sync_firewall(
+    api: HetznerApi,
+    fw: Firewall,
+    cf_cidrs: CloudflareCIDRs,
+    *,
+    project_index: int,
+    max_sources: int = MAX_RULE_SOURCES,
+) -> bool:
+    """Apply the Cloudflare rules to one firewall and await its actions.
+
+    Args:
+        api: Token-bound API accessor.
+        fw: Firewall retrieved from the API.
+        cf_cidrs: Cloudflare CIDR model downloaded at runtime.
+        project_index: 1-based index of the project being processed, used for logging.
+        max_sources: Most source IPs a single rule may hold.
+
+    Returns:
+        bool: True on success (including no-op), False when pushing rules failed.
+    """
+    changes: list[RuleChange] = []
+    if not apply_cloudflare_rules(
+        fw,
+        cf_cidrs,
+        project_index=project_index,
+        max_sources=max_sources,
+        changes=changes,
+    ):
+        return True
+    logging.info(
+        f"Updating rules for hcloud firewall {fw.name!r} in project {project_index}"
+    )
+    label = f"project {project_index}:{fw.name!r}"
+    try:
+        with timed("set_rules", label):
+            response = await api.request(
+                "POST",
+                f"/firewalls/{fw.id}/actions/set_rules",
+                json={"rules": [rule.to_payload() for rule in fw.rules or []]},
+            )
+        count_rules_changed(changes)
+        with timed("wait_actions", label), ACTION_WAIT.time():
+            await _gather(*(_wait_for_action(api, a) for a in response["actions"]))
+    except _SYNC_ERRORS as e:
+        log_error(
+            f"hcloud/firewall.set_rules failed for {fw.name!r} in project "
+            f"{project_index}: {_describe_http_error(e)}"
+        )
+        return False
+    return True
+
+
+async def update_project_async(
+    api: HetznerApi,
+    *,
+    project: Project,
+    cf_cidrs: CloudflareCIDRs,
+    project_index: int,
+    max_sources: int = MAX_RULE_SOURCES,
+) -> ProjectOutcome:
+    """Synchronize every firewall of a project, all of them concurrently.
+
+    The asyncio counterpart of ``firewall.update_project``, with the same
+    discovery, skip, failure and deadline semantics and the same log lines.
+    Firewalls all start together once looked up, so the deadline is checked
+    before the lookup and before they start.
+
+    Args:
+        api: Token-bound API accessor for the project's token.
+        project: Project definition that holds the firewall names.
+        cf_cidrs: Cloudflare CIDR model downloaded at runtime.
+        project_index: 1-based index of the project being processed, used for logging.
+        max_sources: Most source IPs a single rule may hold.
+
+    Returns:
+        ProjectOutcome: Labels of skipped, failed and untouched firewalls,
+        project-prefixed.
+    """
+    if not RUN_DEADLINE.allows(MIN_FIREWALL_TIME):
+        return out_of_time(project, project_index=project_index)
+    names = project.firewalls
+    by_name = (
+        await _index_firewalls(api, project_index=project_index)
+        if len(names) > 1
+        else None
+    )
+    if by_name is not None:
+        found: list[Firewall | BaseException | None] = [by_name.get(n) for n in names]
+    else:
+        found = await asyncio.gather(
+            *(
+                _get_by_name(api, name, f"project {project_index}:{name!r}")
+                for name in names
+            ),
+            return_exceptions=True,
+        )
+
+    skipped: list[str] = []
+    failed: list[str] = []
+    to_sync: list[tuple[str, Firewall]] = []
+    for name, result in zip(names, found, strict=True):
+        label = f"project {project_index}:{name!r}"
+        if isinstance(result, _SYNC_ERRORS):
+            log_error(
+                "hcloud/firewalls.get_by_name failed for "
+                f"{name!r} in project {project_index}: {_describe_http_error(result)}"
+            )
+            failed.append(label)
+        elif isinstance(result, BaseException):
+            raise result
+        elif result:
+            logging.info(
+                f"Inspecting hcloud firewall {name!r} in project {project_index}"
+            )
+            to_sync.append((label, result))
+        else:
+            logging.debug(
+                f"hcloud firewall {name!r} not found in project {project_index}"
+            )
+            skipped.append(label)
+
+    untouched: list[str] = []
+    if not RUN_DEADLINE.allows(MIN_FIREWALL_TIME):
+        untouched = [label for label, _ in to_sync]
+        to_sync = []
+        log_untouched(untouched, project_index=project_index)
+    synced = await _gather(
+        *(
+            _sync_firewall(
+                api,
+                fw,
+                cf_cidrs,
+                project_index=project_index,
+                max_sources=max_sources,
+            )
+            for _, fw in to_sync
+        )
+    )
+    failed.extend(
+        label for (label, _), ok in zip(to_sync, synced, strict=True) if not ok
+    )
+    order = {f"project {project_index}:{name!r}": i for i, name in enumerate(names)}
+    failed.sort(key=order.__getitem__)
+    outcome = ProjectOutcome(skipped=skipped, failed=failed, untouched=tuple(untouched))
+    count_project(len(names), outcome)
+    return outcome
+
+
+def _http_client(transport: httpx.AsyncBaseTransport | None) -> httpx.AsyncClient:
+    """Build the pooled HTTP client every project's requests go through.
+
+    Args:
+        transport: Optional transport override, used by tests.
+
+    Returns:
+        httpx.AsyncClient: Client for the Hetzner API endpoint.
+    """
+    connect, read = HCLOUD_TIMEOUT
+    return httpx.AsyncClient(
+        base_url=HCLOUD_API_ENDPOINT,
+        headers={"User-Agent": f"cf-ips-to-hcloud-fw/{__version__}"},
+        timeout=httpx.Timeout(read, connect=connect),
+        # Concurrency is bounded per token by the semaphores, not by the pool.
+        limits=httpx.Limits(max_connections=None),
+        transport=transport,
+    )
+
+
+async def _sync_over(
+    http: httpx.AsyncClient,
+    projects: list[Project],
+    cf_cidrs: CloudflareCIDRs,
+    *,
+    max_in_flight: int,
+    max_sources: int,
+) -> list[ProjectOutcome]:
+    """Sync every project concurrently over the given HTTP client.
+
+    Args:
+        http: Pooled client for the Hetzner API.
+        projects: Ordered project definitions from the config.
+        cf_cidrs: Cloudflare CIDR model downloaded at runtime.
+        max_in_flight: Requests allowed in flight per API token.
+        max_sources: Most source IPs a single rule may hold.
+
+    Returns:
+        list[ProjectOutcome]: One outcome per project, in config order.
+    """
+    semaphores: dict[str, asyncio.Semaphore] = {}
+    runs = []
+    for idx, project in enumerate(projects, start=1):
+        token = project.token.get_secret_value()
+        limit = semaphores.setdefault(token, asyncio.Semaphore(max_in_flight))
+        runs.append(
+            update_project_async(
+                HetznerApi(http, token, limit),
+                project=project,
+                cf_cidrs=cf_cidrs,
+                project_index=idx,
+                max_sources=max_sources,
+            )
+        )
+    return await _gather(*runs)
+
+
+async def _sync_all(
+    projects: list[Project],
+    cf_cidrs: CloudflareCIDRs,
+    *,
+    max_in_flight: int,
+    max_sources: int = MAX_RULE_SOURCES,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> list[ProjectOutcome]:
+    """Sync every project concurrently over a pooled client of its own.
+
+    Args:
+        projects: Ordered project definitions from the config.
+        cf_cidrs: Cloudflare CIDR model downloaded at runtime.
+        max_in_flight: Requests allowed in flight per API token.
+        max_sources: Most source IPs a single rule may hold.
+        transport: Optional transport override, used by tests.
+
+    Returns:
+        list[ProjectOutcome]: One outcome per project, in config order.
+    """
+    async with _http_client(transport) as http:
+        return await _sync_over(
+            http,
+            projects,
+            cf_cidrs,
+            max_in_flight=max_in_flight,
+            max_sources=max_sources,
+        )
+
+
+def sync_projects_async(
+    projects: list[Project],
+    cf_cidrs: CloudflareCIDRs,
+    *,
+    max_in_flight: int,
+    max_sources: int = MAX_RULE_SOURCES,
+) -> list[ProjectOutcome]:
+    """Run the asyncio engine over every project and wait for it to finish.
+
+    Args:
+        projects: Ordered project definitions from the config.
+        cf_cidrs: Cloudflare CIDR model downloaded at runtime.
+        max_in_flight: Requests allowed in flight per API token.
+        max_sources: Most source IPs a single rule may hold.
+
+    Returns:
+        list[ProjectOutcome]: One outcome per project, in config order.
+    """
+    return asyncio.run(
+        _sync_all(
+            projects,
+            cf_cidrs,
+            max_in_flight=max_in_flight,
+            max_sources=max_sources,
+        )
+    )
+
+
+class KeptAliveEngine:
+    """The asyncio engine for watch mode, kept alive from one sync to the next.
+
+    ``sync_projects_async`` starts an event loop and a client per call, so
+    every sync would pay for new TCP and TLS handshakes. Here one event loop
+    and one pooled client serve every sync, and a sync reuses the connections
+    the previous one left open. Both live until ``close`` is called.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_in_flight: int,
+        max_sources: int = MAX_RULE_SOURCES,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        """Set up the event loop; the client is built on the first sync.
+
+        Args:
+            max_in_flight: Requests allowed in flight per API token.
+            max_sources: Most source IPs a single rule may hold.
+            transport: Optional transport override, used by tests.
+        """
+        self._loop = asyncio.new_event_loop()
+        self._http: httpx.AsyncClient | None = None
+        self._max_in_flight = max_in_flight
+        self._max_sources = max_sources
+        self._transport = transport
+
+    def sync(
+        self, projects: list[Project], cf_cidrs: CloudflareCIDRs
+    ) -> list[ProjectOutcome]:
+        """Run one sync of every project and wait for it to finish.
+
+        Args:
+            projects: Ordered project definitions from the config.
+            cf_cidrs: Cloudflare CIDR model downloaded at runtime.
+
+        Returns:
+            list[ProjectOutcome]: One outcome per project, in config order.
+        """
+        return self._loop.run_until_complete(self._sync(projects, cf_cidrs))
+
+    def close(self) -> None:
+        """Close the client's connections and the event loop.
+
+        The engine can't sync afterwards.
+        """
+        if self._http is not None:
+            self._loop.run_until_complete(self._http.aclose())
+        self._loop.close()
+
+    async def _sync(
+        self, projects: list[Project], cf_cidrs: CloudflareCIDRs
+    ) -> list[ProjectOutcome]:
+        # Built inside the loop it will be used from.
+        if self._http is None:
+            self._http = _http_client(self._transport)
+        return await _sync_over(
+            self._http,
+            projects,
+            cf_cidrs,
+            max_in_flight=self._max_in_flight,
+            max_sources=self._max_sources,
+        )
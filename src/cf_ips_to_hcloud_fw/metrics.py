@@ -0,0 +1,478 @@
+"""Prometheus metrics of sync runs, as a node_exporter textfile or over HTTP."""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import re
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:  # pragma: no cover
+    from collections.abc import Generator  # pragma: no cover
+
+    from cf_ips_to_hcloud_fw.firewall import ProjectOutcome  # pragma: no cover
+
+PREFIX = "cf_ips_to_hcloud_fw_"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Loopback unless told otherwise; exposing the endpoint is the operator's call.
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+# Prometheus client defaults: single API calls, from a few ms to seconds.
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# set_rules actions take about a second and are given up on after 120.
+ACTION_WAIT_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Every Hetzner API path starts with the version; IDs are folded into one
+# label value so the number of series stays bounded by the set of endpoints.
+_API_VERSION_PREFIX = "/v1"
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def _format_value(value: float) -> str:
+    """Render a sample value the way the text format expects.
+
+    Args:
+        value: Sample value.
+
+    Returns:
+        str: Integral values without a fraction, others in full precision.
+    """
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the text format.
+
+    Args:
+        value: Raw label value.
+
+    Returns:
+        str: The value with backslashes, quotes and newlines escaped.
+    """
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    """Render a label set, or nothing for an unlabelled sample.
+
+    Args:
+        names: Label names.
+        values: Label values, in the order of ``names``.
+
+    Returns:
+        str: ``{name="value",...}`` or an empty string.
+    """
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    )
+    return f"{{{pairs}}}"
+
+
+class _Metric(ABC):
+    """Name, help text and label names shared by every metric type."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...]) -> None:
+        """Register the metric for export.
+
+        Args:
+            name: Metric name without the package prefix.
+            documentation: Help text.
+            labels: Label names.
+        """
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _check(self, values: tuple[str, ...]) -> None:
+        """Refuse label values that don't match the label names.
+
+        Args:
+            values: Label values passed by the caller.
+
+        Raises:
+            ValueError: If there are more or fewer values than label names.
+        """
+        if len(values) != len(self.labels):
+            msg = f"{self.name} takes labels {self.labels}, got {values}"
+            raise ValueError(msg)
+
+    def header(self) -> list[str]:
+        """Return the ``# HELP`` and ``# TYPE`` lines.
+
+        Returns:
+            list[str]: The two header lines.
+        """
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    @abstractmethod
+    def samples(self) -> list[str]:
+        """Return the sample lines of every series.
+
+        Returns:
+            list[str]: One line per sample, in text format.
+        """
+
+
+class Counter(_Metric):
+    """A value that only goes up, per label set."""
+
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labels: tuple[str, ...] = ()
+    ) -> None:
+        """Register a counter.
+
+        Args:
+            name: Metric name without the package prefix, ending in ``_total``.
+            documentation: Help text.
+            labels: Label names.
+        """
+        super().__init__(name, documentation, labels)
+        # An unlabelled counter is exported as 0 before its first increment.
+        self._values: dict[tuple[str, ...], float] = {} if labels else {(): 0.0}
+
+    def inc(self, *values: str, amount: float = 1.0) -> None:
+        """Add ``amount`` to the series of the given label values.
+
+        Args:
+            *values: Label values, in the order of the label names.
+            amount: Increment.
+        """
+        self._check(values)
+        with self._lock:
+            self._values[values] = self._values.get(values, 0.0) + amount
+
+    def value(self, *values: str) -> float:
+        """Return the current value of one series.
+
+        Args:
+            *values: Label values, in the order of the label names.
+
+        Returns:
+            float: The value; 0 for a series never incremented.
+        """
+        with self._lock:
+            return self._values.get(values, 0.0)
+
+    def samples(self) -> list[str]:
+        """Return one sample line per series.
+
+        Returns:
+            list[str]: Sample lines, sorted by label values.
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(_Metric):
+    """A single unlabelled value that is set, not accumulated."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        """Register a gauge; it has no sample until first set.
+
+        Args:
+            name: Metric name without the package prefix.
+            documentation: Help text.
+        """
+        super().__init__(name, documentation, ())
+        self._value: float | None = None
+
+    def set(self, value: float) -> None:
+        """Set the value.
+
+        Args:
+            value: New value.
+        """
+        with self._lock:
+            self._value = value
+
+    def samples(self) -> list[str]:
+        """Return the sample line, if the gauge has been set.
+
+        Returns:
+            list[str]: Zero or one sample line.
+        """
+        with self._lock:
+            value = self._value
+        return [] if value is None else [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, per label set."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        *,
+        buckets: tuple[float, ...],
+    ) -> None:
+        """Register a histogram.
+
+        Args:
+            name: Metric name without the package prefix.
+            documentation: Help text.
+            labels: Label names.
+            buckets: Ascending upper bounds; ``+Inf`` is implied.
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # Per series: a count per bucket plus one for +Inf, and the sum.
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, seconds: float, *values: str) -> None:
+        """Count one observation.
+
+        Args:
+            seconds: Observed value.
+            *values: Label values, in the order of the label names.
+        """
+        self._check(values)
+        with self._lock:
+            counts, total = self._series.setdefault(
+                values, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            total[0] += seconds
+
+    @contextmanager
+    def time(self, *values: str) -> Generator[None, None, None]:
+        """Observe how long the enclosed block took, whether it returns or raises.
+
+        Args:
+            *values: Label values, in the order of the label names.
+
+        Yields:
+            None: Control to the timed block.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *values)
+
+    def samples(self) -> list[str]:
+        """Return the bucket, sum and count lines of every series.
+
+        Returns:
+            list[str]: Sample lines, sorted by label values.
+        """
+        with self._lock:
+            series = sorted(
+                (key, list(counts), total[0])
+                for key, (counts, total) in self._series.items()
+            )
+        lines = []
+        bounds = [_format_value(float(b)) for b in self.buckets] + ["+Inf"]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts, strict=True):
+                cumulative += count
+                labels = _labels((*self.labels, "le"), (*key, bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labels, key)
+            lines.extend((
+                f"{self.name}_sum{labels} {_format_value(total)}",
+                f"{self.name}_count{labels} {cumulative}",
+            ))
+        return lines
+
+
+_REGISTRY: list[_Metric] = []
+
+API_REQUESTS = Counter(
+    "hetzner_api_requests_total",
+    "Hetzner API requests by endpoint, method and HTTP status ('error' when no "
+    "response arrived).",
+    ("endpoint", "method", "status"),
+)
+API_REQUEST_DURATION = Histogram(
+    "hetzner_api_request_duration_seconds",
+    "Latency of Hetzner API requests, not counting rate limit pacing.",
+    ("endpoint",),
+    buckets=REQUEST_BUCKETS,
+)
+API_RETRIES = Counter(
+    "hetzner_api_retries_total",
+    "Hetzner API requests sent again after a transient failure.",
+)
+ACTION_WAIT = Histogram(
+    "action_wait_duration_seconds",
+    "Time from the start of the wait until a firewall's set_rules actions settled.",
+    buckets=ACTION_WAIT_BUCKETS,
+)
+CLOUDFLARE_FETCHES = Counter(
+    "cloudflare_fetches_total",
+    "Cloudflare ips.list fetches by outcome: fetched, cached, file, error or invalid.",
+    ("outcome",),
+)
+RULES_CHANGED = Counter(
+    "rules_changed_total",
+    "Cloudflare-marked firewall rules whose source IPs were rewritten.",
+)
+FIREWALLS = Counter(
+    "firewalls_total",
+    "Configured firewalls by sync result: synced, skipped (not found), failed or "
+    "untouched (cut off by the deadline).",
+    ("result",),
+)
+LAST_SYNC = Gauge(
+    "last_sync_timestamp_seconds",
+    "UNIX time at which the last sync finished.",
+)
+
+
+def endpoint_label(path: str) -> str:
+    """Reduce a request URL or path to its endpoint, e.g. ``/actions/{id}``.
+
+    Args:
+        path: Absolute URL, or a path relative to the API endpoint.
+
+    Returns:
+        str: The path without query string or API version, IDs replaced.
+    """
+    path = urlsplit(path).path
+    _, sep, rest = path.partition(_API_VERSION_PREFIX + "/")
+    path = "/" + rest if sep else path
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+def observe_request(method: str, url: str, status: str, seconds: float) -> None:
+    """Count one Hetzner API request and its latency.
+
+    Args:
+        method: HTTP method.
+        url: Request URL, or a path relative to the API endpoint.
+        status: HTTP status code, or ``error`` when no response arrived.
+        seconds: Time from sending the request to receiving the response.
+    """
+    endpoint = endpoint_label(url)
+    API_REQUESTS.inc(endpoint, method, status)
+    API_REQUEST_DURATION.observe(seconds, endpoint)
+
+
+def count_project(configured: int, outcome: ProjectOutcome) -> None:
+    """Count a project's firewalls by result.
+
+    Args:
+        configured: Number of firewalls the project was asked to sync.
+        outcome: The project's outcome.
+    """
+    skipped = len(outcome.skipped)
+    failed = len(outcome.failed)
+    untouched = len(outcome.untouched)
+    FIREWALLS.inc("synced", amount=configured - skipped - failed - untouched)
+    FIREWALLS.inc("skipped", amount=skipped)
+    FIREWALLS.inc("failed", amount=failed)
+    FIREWALLS.inc("untouched", amount=untouched)
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text format.
+
+    Returns:
+        str: The exposition, one metric family after another.
+    """
+    lines: list[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.header())
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str) -> None:
+    """Write the metrics for node_exporter's textfile collector.
+
+    The file is replaced atomically, so the collector never reads a partial
+    file, and made world-readable: it holds no secrets and the collector
+    usually runs as another user. A failed write is logged as a warning; the
+    sync itself has already happened.
+
+    Args:
+        path: Target file, conventionally ending in ``.prom``.
+    """
+    target = Path(path)
+    tmp_path: Path | None = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf-8",
+            dir=target.parent,
+            prefix=f".{target.name}.",
+            delete=False,
+        ) as tmp:
+            tmp_path = Path(tmp.name)
+            tmp.write(render())
+        tmp_path.chmod(0o644)
+        tmp_path.replace(target)
+    except OSError as e:
+        logging.warning(f"Couldn't write metrics file {path!r}: {e}")
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves ``GET /metrics``."""
+
+    def log_message(self, format: str, *args: object) -> None:  # ruff:ignore[builtin-argument-shadowing]
+        """Keep scrapes out of the log."""
+
+    def do_GET(self) -> None:
+        """Answer a scrape."""
+        if urlsplit(self.path).path != "/metrics":
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        body = render().encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve ``/metrics`` from a background thread.
+
+    Args:
+        host: Address to bind to.
+        port: Port to bind to; 0 picks a free one.
+
+    Returns:
+        ThreadingHTTPServer: The running server; call ``shutdown`` and
+        ``server_close`` to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -2,25 +2,31 @@
 
 from __future__ import annotations
 
-from ipaddress import IPv4Network, IPv6Network
-from typing import Annotated, TypeVar
+from functools import cached_property, lru_cache
+from ipaddress import IPv4Network, IPv6Network, collapse_addresses, ip_network
+from typing import TYPE_CHECKING, Annotated, NamedTuple
 
 from pydantic import (
-    AfterValidator,
     BaseModel,
     BeforeValidator,
     ConfigDict,
     Field,
     SecretStr,
+    ValidationError,
+    WrapValidator,
 )
+from pydantic_core import InitErrorDetails, PydanticCustomError
 
-_Network = TypeVar("_Network", IPv4Network, IPv6Network)
+if TYPE_CHECKING:  # pragma: no cover
+    from collections.abc import Iterable, Sequence  # pragma: no cover
+
+    from pydantic import ValidatorFunctionWrapHandler  # pragma: no cover
 
 # Special-purpose blocks that must never reach a Cloudflare-only allow rule:
 # the not-globally-reachable entries of the IANA IPv4 Special-Purpose Address
 # Registry, plus multicast and the reserved 240.0.0.0/4.
 #
-# These are tested with `overlaps()`, NOT with the ipaddress `is_*` flags. On a
+# These are tested for overlap, NOT with the ipaddress `is_*` flags. On a
 # *network*, those flags are a conjunction over the two endpoints -
 # `network_address.is_private and broadcast_address.is_private` - so a range
 # that merely CONTAINS private space sets none of them: `128.0.0.0/1` spans
@@ -70,14 +76,107 @@ _RESERVED_IPV6 = tuple(
 # bottoms out at /13 (IPv4) and /29 (IPv6), so these sit 32x and 8192x broader
 # than anything actually published - wide enough that a legitimately broader
 # future range still passes, tight enough that a spanning aggregate cannot.
-# Defence in depth: `overlaps()` above already rejects every aggregate large
+# Defence in depth: the overlap check already rejects every aggregate large
 # enough to swallow a reserved block.
 _MIN_PREFIXLEN_IPV4 = 8
 _MIN_PREFIXLEN_IPV6 = 16
 
 
-def _require_globally_routable(network: _Network) -> _Network:
-    """Reject CIDRs that must never end up in a Cloudflare-only allow rule.
+class _ReservedIntervals(NamedTuple):
+    """Reserved blocks of one IP version as sorted, disjoint integer intervals.
+
+    Attributes:
+        starts: First address of each block, ascending.
+        ends: Last address of each block; ascending too, as blocks are disjoint.
+        names: Each block in CIDR notation, for error messages.
+    """
+
+    starts: list[int]
+    ends: list[int]
+    names: list[str]
+
+
+def _interval(network: IPv4Network | IPv6Network) -> tuple[int, int]:
+    """Return the first and last address of a network as integers.
+
+    Args:
+        network: Any parsed network.
+
+    Returns:
+        tuple[int, int]: Inclusive ``(start, end)`` bounds.
+    """
+    start = int(network.network_address)
+    return start, start | int(network.hostmask)
+
+
+def _reserved_intervals(
+    blocks: Iterable[IPv4Network | IPv6Network],
+) -> _ReservedIntervals:
+    """Index reserved blocks for the sweep-based overlap check.
+
+    Args:
+        blocks: Reserved blocks of one IP version, in any order.
+
+    Returns:
+        _ReservedIntervals: The blocks sorted by start address.
+
+    Raises:
+        ValueError: If two blocks overlap, which would break the sweep's
+            reliance on ascending ``ends``; a nested block is redundant and
+            belongs out of the table.
+    """
+    intervals = _ReservedIntervals([], [], [])
+    for block in sorted(blocks):
+        start, end = _interval(block)
+        if intervals.ends and start <= intervals.ends[-1]:
+            msg = f"Reserved block {block} overlaps {intervals.names[-1]}"
+            raise ValueError(msg)
+        intervals.starts.append(start)
+        intervals.ends.append(end)
+        intervals.names.append(str(block))
+    return intervals
+
+
+_RESERVED_IPV4_INTERVALS = _reserved_intervals(_RESERVED_IPV4)
+_RESERVED_IPV6_INTERVALS = _reserved_intervals(_RESERVED_IPV6)
+_GLOBAL_UNICAST_IPV6_START, _GLOBAL_UNICAST_IPV6_END = _interval(_GLOBAL_UNICAST_IPV6)
+
+
+def _sweep_overlaps(
+    reserved: _ReservedIntervals, intervals: list[tuple[int, int]]
+) -> list[list[str]]:
+    """Name the reserved blocks each interval shares an address with.
+
+    The intervals are visited in start order in one pass over the reserved
+    table: a block that ends before one interval starts ends before every
+    later one too, so the first candidate block only ever moves forward, and
+    each interval looks at no block beyond the ones it overlaps and the next.
+
+    Args:
+        reserved: Indexed reserved blocks of the intervals' IP version.
+        intervals: Inclusive ``(start, end)`` bounds, in any order.
+
+    Returns:
+        list[list[str]]: For each interval, in input order, the overlapping
+        blocks in address order.
+    """
+    overlaps: list[list[str]] = [[] for _ in intervals]
+    first = 0
+    for i in sorted(range(len(intervals)), key=lambda i: intervals[i][0]):
+        start, end = intervals[i]
+        while first < len(reserved.ends) and reserved.ends[first] < start:
+            first += 1
+        last = first
+        while last < len(reserved.starts) and reserved.starts[last] <= end:
+            last += 1
+        overlaps[i] = reserved.names[first:last]
+    return overlaps
+
+
+def _check_globally_routable(
+    network: IPv4Network | IPv6Network, overlapping: list[str]
+) -> None:
+    """Reject a CIDR that must never end up in a Cloudflare-only allow rule.
 
     Parsing only proves a CIDR is well-formed, so a tampered or malfunctioning
     API response could hand us a range that is syntactically fine and
@@ -91,8 +190,8 @@ def _require_globally_routable(network: _Network) -> _Network:
     tables would be refused, and unallocated space is not routable to an
     attacker anyway.
 
-    Note the blast radius of a false rejection. ``overlaps()`` is bidirectional,
-    so this refuses a range that merely *contains* a reserved block, and
+    Note the blast radius of a false rejection. Overlap is bidirectional, so
+    this refuses a range that merely *contains* a reserved block, and
     ``get_cloudflare_cidrs`` turns any rejection into ``log_error_and_exit`` -
     one bad CIDR aborts the whole sync and leaves every firewall on stale
     rules. That is deliberate: dropping the offending range and syncing the
@@ -103,25 +202,26 @@ def _require_globally_routable(network: _Network) -> _Network:
 
     Args:
         network: A parsed CIDR from the Cloudflare response.
-
-    Returns:
-        The network unchanged, when it is globally routable.
+        overlapping: The reserved blocks it overlaps, from ``_sweep_overlaps``.
 
     Raises:
         ValueError: If the network is over-broad or overlaps reserved space.
     """
     if isinstance(network, IPv4Network):
-        reserved: tuple = _RESERVED_IPV4
         floor = _MIN_PREFIXLEN_IPV4
+        global_unicast = True
     else:
-        reserved = _RESERVED_IPV6
+        start, end = _interval(network)
         floor = _MIN_PREFIXLEN_IPV6
+        global_unicast = (
+            start >= _GLOBAL_UNICAST_IPV6_START and end <= _GLOBAL_UNICAST_IPV6_END
+        )
 
     # Containment is checked before the floor so the message names the real
     # reason: fc00::/7, fe80::/10 and ff00::/8 are all shorter than the /16
     # floor, and reporting them as merely "too broad" would send an operator
     # looking for a prefix problem when the range is not unicast at all.
-    if isinstance(network, IPv6Network) and not network.subnet_of(_GLOBAL_UNICAST_IPV6):
+    if not global_unicast:
         msg = (
             f"{network} is not globally routable: outside global unicast "
             f"{_GLOBAL_UNICAST_IPV6}"
@@ -135,7 +235,6 @@ def _require_globally_routable(network: _Network) -> _Network:
         )
         raise ValueError(msg)
 
-    overlapping = [str(block) for block in reserved if network.overlaps(block)]
     if overlapping:
         msg = (
             f"{network} is not globally routable: overlaps reserved space "
@@ -143,30 +242,264 @@ def _require_globally_routable(network: _Network) -> _Network:
         )
         raise ValueError(msg)
 
-    return network
 
+def _find_unroutable(
+    networks: list[IPv4Network | IPv6Network],
+) -> list[tuple[int, ValueError]]:
+    """Check a whole list of networks for global routability.
 
-GloballyRoutableIPv4Network = Annotated[
-    IPv4Network, AfterValidator(_require_globally_routable)
+    The overlap with reserved space is found for every network of a version
+    in one sweep of the sorted list against the reserved table, rather than
+    with a lookup per network.
+
+    Args:
+        networks: Parsed CIDRs of either IP version.
+
+    Returns:
+        list[tuple[int, ValueError]]: The index of every network that is not
+        globally routable, in input order, with the error explaining why.
+    """
+    overlaps: list[list[str]] = [[] for _ in networks]
+    for version, reserved in (
+        (IPv4Network, _RESERVED_IPV4_INTERVALS),
+        (IPv6Network, _RESERVED_IPV6_INTERVALS),
+    ):
+        positions = [i for i, net in enumerate(networks) if isinstance(net, version)]
+        swept = _sweep_overlaps(reserved, [_interval(networks[i]) for i in positions])
+        for i, overlapping in zip(positions, swept, strict=True):
+            overlaps[i] = overlapping
+    unroutable: list[tuple[int, ValueError]] = []
+    for i, (network, overlapping) in enumerate(zip(networks, overlaps, strict=True)):
+        try:
+            _check_globally_routable(network, overlapping)
+        except ValueError as e:  # ruff:ignore[try-except-in-loop]
+            unroutable.append((i, e))
+    return unroutable
+
+
+def require_all_globally_routable(
+    value: object, handler: ValidatorFunctionWrapHandler
+) -> list[IPv4Network | IPv6Network]:
+    """Parse a list of CIDRs and check all of them for global routability.
+
+    Errors are reported exactly as a validator on each entry would report
+    them: one per entry that does not parse or is not globally routable, at
+    that entry's index and with that entry as the input, so a response with
+    several bad ranges names every one of them.
+
+    Args:
+        value: The raw list of CIDRs.
+        handler: Pydantic's parser for the list.
+
+    Returns:
+        list[IPv4Network | IPv6Network]: The networks, in input order.
+
+    Raises:
+        ValidationError: If any entry does not parse or is not globally
+            routable.
+    """
+    # Errors name the entry as given, like a validator per entry would.
+    entries: Sequence[object] | None = (
+        value if isinstance(value, list | tuple) else None
+    )
+    errors: list[InitErrorDetails] = []
+    try:
+        networks = handler(value)
+    except ValidationError as e:
+        # Without an index per error (not a list at all, say) there is no
+        # entry left to check.
+        if entries is None or not all(err["loc"] for err in e.errors()):
+            raise
+        # Entries fail to parse with pydantic's own custom errors, which are
+        # rebuilt from their type and message.
+        errors = [
+            InitErrorDetails(
+                type=PydanticCustomError(
+                    err["type"],  # ty: ignore[invalid-argument-type]
+                    err["msg"],  # ty: ignore[invalid-argument-type]
+                ),
+                loc=err["loc"],
+                input=err["input"],
+            )
+            for err in e.errors()
+        ]
+        failed = {err["loc"][0] for err in errors}
+        networks = handler([v for i, v in enumerate(entries) if i not in failed])
+    else:
+        failed = set()
+        entries = entries or networks
+    positions = [i for i in range(len(entries)) if i not in failed]
+    errors.extend(
+        InitErrorDetails(
+            type="value_error",
+            loc=(positions[i],),
+            input=entries[positions[i]],
+            ctx={"error": error},
+        )
+        for i, error in _find_unroutable(networks)
+    )
+    if errors:
+        errors.sort(key=lambda err: err["loc"][0])
+        # The title is dropped: pydantic reports these under the field.
+        error = ValidationError.from_exception_data(title="list", line_errors=errors)
+        raise error
+    return networks
+
+
+GloballyRoutableIPv4Networks = Annotated[
+    list[IPv4Network], WrapValidator(require_all_globally_routable)
 ]
-GloballyRoutableIPv6Network = Annotated[
-    IPv6Network, AfterValidator(_require_globally_routable)
+GloballyRoutableIPv6Networks = Annotated[
+    list[IPv6Network], WrapValidator(require_all_globally_routable)
 ]
 
 
+# Strings repeat across every firewall of a run, so each is parsed once; the
+# bound only matters for a watch-mode process that sees many distinct lists.
+@lru_cache(maxsize=4096)
+def cidr_key(cidr: str) -> tuple[int, int, int, str]:
+    """Return a key that is equal for every spelling of the same network.
+
+    ``2400:CB00::/32``, ``2400:cb00:0::/32`` and ``2400:cb00::1/32`` all give
+    the same key, and keys sort numerically, IPv4 before IPv6. A string that
+    does not parse keeps itself as the key, so it only equals itself.
+
+    Args:
+        cidr: A CIDR as written by us or returned by Hetzner.
+
+    Returns:
+        tuple[int, int, int, str]: ``(version, network address, prefix length,
+        "")``, or ``(0, 0, 0, cidr)`` when the string is not a network.
+    """
+    try:
+        network = ip_network(cidr, strict=False)
+    except ValueError:
+        return (0, 0, 0, cidr)
+    return (network.version, int(network.network_address), network.prefixlen, "")
+
+
+class SourceList(NamedTuple):
+    """The source CIDRs a marked rule should hold, in both forms it needs.
+
+    Attributes:
+        cidrs: Canonical list written to rules. Shared by every rule that gets
+            it, so it is never mutated in place.
+        members: The CIDRs' ``cidr_key`` values, for comparison that ignores
+            order and spelling.
+        kind: Human-readable IP versions (``IPv4``, ``IPv6``, ``IPv4+IPv6``).
+    """
+
+    cidrs: list[str]
+    members: frozenset[tuple[int, int, int, str]]
+    kind: str
+
+
 class CloudflareIPNetworks(BaseModel):
     """Cloudflare CIDRs parsed as IP network objects, used to validate input."""
 
-    ipv4_cidrs: list[GloballyRoutableIPv4Network]
-    ipv6_cidrs: list[GloballyRoutableIPv6Network]
+    ipv4_cidrs: GloballyRoutableIPv4Networks
+    ipv6_cidrs: GloballyRoutableIPv6Networks
+
+    def to_cidrs(self) -> CloudflareCIDRs:
+        """Convert the parsed networks into the model the sync consumes.
+
+        Returns:
+            CloudflareCIDRs: Canonical strings in address order, with the
+            parsed networks attached in the same order so nothing has to parse
+            them again.
+        """
+        return CloudflareCIDRs.from_networks(self.ipv4_cidrs, self.ipv6_cidrs)
 
 
 class CloudflareCIDRs(BaseModel):
-    """Cloudflare CIDRs kept as strings for writing to firewall rules."""
+    """Cloudflare CIDRs kept as strings for writing to firewall rules.
+
+    Only the strings are fields, so equality, the cache file and the state
+    fingerprint depend on them alone. The parsed networks come along when the
+    model was built by ``CloudflareIPNetworks.to_cidrs`` and are parsed on
+    first use otherwise, e.g. for ranges served from the cache.
+    """
 
     ipv4_cidrs: list[str]
     ipv6_cidrs: list[str]
 
+    @classmethod
+    def from_networks(
+        cls, ipv4: Iterable[IPv4Network], ipv6: Iterable[IPv6Network]
+    ) -> CloudflareCIDRs:
+        """Build the model from parsed networks without parsing them again.
+
+        Args:
+            ipv4: IPv4 ranges, in any order.
+            ipv6: IPv6 ranges, in any order.
+
+        Returns:
+            CloudflareCIDRs: Canonical strings sorted by address, then prefix
+            length, with the networks attached in the same order.
+        """
+        ipv4_sorted = sorted(ipv4)
+        ipv6_sorted = sorted(ipv6)
+        cidrs = cls(
+            ipv4_cidrs=[str(n) for n in ipv4_sorted],
+            ipv6_cidrs=[str(n) for n in ipv6_sorted],
+        )
+        # Seed the cached properties; they are not fields, so they are neither
+        # serialized nor compared.
+        cidrs.__dict__["ipv4_networks"] = ipv4_sorted
+        cidrs.__dict__["ipv6_networks"] = ipv6_sorted
+        return cidrs
+
+    def collapsed(self) -> CloudflareCIDRs:
+        """Merge adjacent and nested ranges into the fewest equivalent prefixes.
+
+        The covered address space is unchanged: ``10.0.0.0/25`` and
+        ``10.0.0.128/25`` become ``10.0.0.0/24``, and a range inside another
+        one is dropped.
+
+        Returns:
+            CloudflareCIDRs: The collapsed ranges.
+        """
+        return CloudflareCIDRs.from_networks(
+            collapse_addresses(self.ipv4_networks),
+            collapse_addresses(self.ipv6_networks),
+        )
+
+    @cached_property
+    def source_lists(self) -> dict[tuple[bool, bool], SourceList]:
+        """The desired source lists per marker, built once for every rule.
+
+        Returns:
+            dict[tuple[bool, bool], SourceList]: Keyed by whether the marker
+            targets IPv4 and IPv6, e.g. ``(True, False)`` for IPv4 only.
+        """
+        lists = {
+            (True, False): (self.ipv4_cidrs, "IPv4"),
+            (False, True): (self.ipv6_cidrs, "IPv6"),
+            (True, True): ([*self.ipv4_cidrs, *self.ipv6_cidrs], "IPv4+IPv6"),
+        }
+        return {
+            targets: SourceList(cidrs, frozenset(map(cidr_key, cidrs)), kind)
+            for targets, (cidrs, kind) in lists.items()
+        }
+
+    @cached_property
+    def ipv4_networks(self) -> list[IPv4Network]:
+        """The IPv4 ranges as network objects, in ``ipv4_cidrs`` order.
+
+        Returns:
+            list[IPv4Network]: One network per string.
+        """
+        return [IPv4Network(c) for c in self.ipv4_cidrs]
+
+    @cached_property
+    def ipv6_networks(self) -> list[IPv6Network]:
+        """The IPv6 ranges as network objects, in ``ipv6_cidrs`` order.
+
+        Returns:
+            list[IPv6Network]: One network per string.
+        """
+        return [IPv6Network(c) for c in self.ipv6_cidrs]
+
 
 def _strip_token(value: object) -> object:
     """Trim surrounding whitespace from a token before it is wrapped.
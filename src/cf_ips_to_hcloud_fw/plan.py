@@ -0,0 +1,124 @@
+"""The machine-readable plan written by ``--plan`` and run by ``--apply-plan``."""
+
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from pydantic import BaseModel, PositiveInt
+
+from cf_ips_to_hcloud_fw.firewall import FirewallPlan
+from cf_ips_to_hcloud_fw.models import CloudflareIPNetworks
+from cf_ips_to_hcloud_fw.state import read_private_json, write_private_json
+
+if TYPE_CHECKING:  # pragma: no cover
+    from cf_ips_to_hcloud_fw.firewall import ProjectPlan  # pragma: no cover
+    from cf_ips_to_hcloud_fw.models import CloudflareCIDRs  # pragma: no cover
+
+# Bumped whenever the document changes incompatibly.
+PLAN_VERSION = 1
+
+
+def plan_document(
+    cf_cidrs: CloudflareCIDRs, plans: list[ProjectPlan], *, max_sources: int
+) -> dict[str, Any]:
+    """Build the JSON document for a plan.
+
+    Projects are identified by their 1-based index in the config; tokens are
+    never written.
+
+    Args:
+        cf_cidrs: Cloudflare ranges the plan was computed against.
+        plans: One plan per project, in config order.
+        max_sources: Most source IPs per rule the plan was computed with.
+
+    Returns:
+        dict[str, Any]: JSON-serializable plan.
+    """
+    return {
+        "version": PLAN_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "cidrs": cf_cidrs.model_dump(),
+        "max_rule_sources": max_sources,
+        "projects": [
+            {
+                "index": plan.index,
+                "skipped": plan.outcome.skipped,
+                "failed": plan.outcome.failed,
+                "firewalls": [
+                    {
+                        **fw._asdict(),
+                        "rules": [rule._asdict() for rule in fw.rules],
+                    }
+                    for fw in plan.firewalls
+                ],
+            }
+            for plan in plans
+        ],
+    }
+
+
+def write_plan(
+    path: str, cf_cidrs: CloudflareCIDRs, plans: list[ProjectPlan], *, max_sources: int
+) -> None:
+    """Write a plan to ``path`` and log what it contains.
+
+    Args:
+        path: Path of the plan file; replaced atomically.
+        cf_cidrs: Cloudflare ranges the plan was computed against.
+        plans: One plan per project, in config order.
+        max_sources: Most source IPs per rule the plan was computed with.
+    """
+    write_private_json(
+        Path(path), plan_document(cf_cidrs, plans, max_sources=max_sources)
+    )
+    firewalls = [fw for plan in plans for fw in plan.firewalls]
+    changing = sum(fw.needs_update for fw in firewalls)
+    logging.info(
+        f"Wrote plan to {path!r}: {changing} of {len(firewalls)} firewalls "
+        "would be updated"
+    )
+
+
+class PlannedProject(BaseModel):
+    """One project's entry of a plan, as far as ``--apply-plan`` needs it."""
+
+    index: PositiveInt
+    firewalls: list[FirewallPlan]
+
+
+class PlanFile(BaseModel):
+    """A plan read back from disk.
+
+    The ranges are validated again, including the routability check, so a
+    plan file can't put anything on an allow list that a fetch couldn't.
+    """
+
+    version: int
+    cidrs: CloudflareIPNetworks
+    max_rule_sources: PositiveInt
+    projects: list[PlannedProject]
+
+
+def read_plan(path: str) -> PlanFile:
+    """Read and validate a plan written by ``write_plan``.
+
+    The file is trusted the way the config file is: it is refused when group
+    or others can write to it, since it decides what lands on the allow list.
+
+    Args:
+        path: Path of the plan file.
+
+    Returns:
+        PlanFile: The validated plan.
+
+    Raises:
+        ValueError: The plan was written by an incompatible version.
+    """
+    plan = PlanFile.model_validate(read_private_json(Path(path)))
+    if plan.version != PLAN_VERSION:
+        msg = f"plan version {plan.version} is not supported (expected {PLAN_VERSION})"
+        raise ValueError(msg)
+    return plan
@@ -0,0 +1,321 @@
+"""Pace Hetzner API requests per token from the API's RateLimit-* headers."""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cf_ips_to_hcloud_fw.deadline import RUN_DEADLINE
+from cf_ips_to_hcloud_fw.metrics import observe_request
+from cf_ips_to_hcloud_fw.retry import is_retryable, next_retry
+
+if TYPE_CHECKING:  # pragma: no cover
+    from collections.abc import Mapping  # pragma: no cover
+
+    from requests import PreparedRequest, Response  # pragma: no cover
+
+# Hetzner refills a project's budget at one request per second (3600/hour).
+# Used until a response's headers tell the real rate.
+DEFAULT_REFILL_PER_SECOND = 1.0
+
+# Waits shorter than this are routine pacing and not worth a log line.
+_LOG_WAIT_THRESHOLD = 1.0
+
+# Connections kept open per host after use; requests' own default. Grown to the
+# number of projects synced at once by ``PacedSession.grow_pool``.
+DEFAULT_POOL_SIZE = 10
+
+
+class TokenBucket:
+    """Request budget of one API token, mirrored from the API's headers.
+
+    Hetzner enforces its limit per project, which is what a token identifies,
+    and reports it on every response: ``RateLimit-Limit`` is the bucket size,
+    ``RateLimit-Remaining`` what is left, and ``RateLimit-Reset`` the UNIX time
+    at which the bucket is full again. The gap between the two over the time
+    to reset gives the refill rate.
+
+    Callers reserve a slot before each request. While the budget lasts that
+    costs nothing; once it runs dry, requests are spaced at the refill rate,
+    so a large run slows down instead of running into 429 responses and
+    recording the remaining firewalls as failed. Until the first response has
+    been seen nothing is known about the budget and nothing is paced.
+
+    Thread-safe, and usable from asyncio as well: :meth:`reserve` only
+    computes the wait, the caller does the sleeping.
+    """
+
+    def __init__(self) -> None:
+        """Start with an unknown budget."""
+        self._lock = threading.Lock()
+        self._capacity: float | None = None
+        self._tokens = 0.0
+        self._rate = DEFAULT_REFILL_PER_SECOND
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        """Add the requests regained since the last refill.
+
+        Args:
+            now: Current ``time.monotonic()`` value.
+        """
+        if self._capacity is not None:
+            regained = (now - self._updated) * self._rate
+            self._tokens = min(self._capacity, self._tokens + regained)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Take one request from the budget.
+
+        Returns:
+            float: Seconds to wait before sending the request; 0.0 while the
+            budget lasts.
+        """
+        with self._lock:
+            if self._capacity is None:
+                return 0.0
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self._rate)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Align the budget with the ``RateLimit-*`` headers of a response.
+
+        The reported remainder only lowers the local count. Responses to
+        concurrent requests arrive out of order, and a remainder reported
+        before the other in-flight requests were counted would otherwise hand
+        their slots out a second time.
+
+        Args:
+            headers: Response headers; ignored when the fields are missing or
+                malformed.
+        """
+        try:
+            limit = int(headers["RateLimit-Limit"])
+            remaining = int(headers["RateLimit-Remaining"])
+            reset = float(headers["RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+        until_reset = reset - time.time()
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit > remaining and until_reset > 0:
+                self._rate = (limit - remaining) / until_reset
+            if self._capacity is None:
+                self._tokens = float(remaining)
+            else:
+                self._tokens = min(self._tokens, float(remaining))
+            self._capacity = float(limit)
+
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket_for(token: str) -> TokenBucket:
+    """Return the bucket shared by every client using ``token``.
+
+    Projects that repeat a token share its budget, and in watch mode the
+    budget carries over from one sync to the next.
+
+    Args:
+        token: Hetzner Cloud API token.
+
+    Returns:
+        TokenBucket: The token's bucket, created on first use.
+    """
+    with _buckets_lock:
+        return _buckets.setdefault(token, TokenBucket())
+
+
+def pacing_delay(bucket: TokenBucket) -> float:
+    """Reserve a request slot and log waits long enough to notice.
+
+    Args:
+        bucket: The token's bucket.
+
+    Returns:
+        float: Seconds to wait before sending the request.
+    """
+    delay = bucket.reserve()
+    if delay >= _LOG_WAIT_THRESHOLD:
+        logging.info(
+            f"Hetzner API rate limit nearly used up, pacing: next request in "
+            f"{delay:.1f}s"
+        )
+    return delay
+
+
+class PacingPastDeadlineError(requests.RequestException):
+    """Raised instead of waiting for a rate limit slot the deadline won't reach.
+
+    A ``RequestException`` but neither a connection error nor a timeout, so
+    it is not retried and the SDK call fails like any other transport error.
+    """
+
+
+class PacedSession(requests.Session):
+    """``requests`` session that paces every request by its API token.
+
+    Installed as an hcloud ``Client``'s session, it sits below
+    ``get_by_name``, ``set_rules`` and action polling alike, and below the
+    SDK's retries, which ``make_client`` turns off in favor of the ones here:
+    transient failures are sent again per ``retry.next_retry``, each attempt
+    paced like any other request. The bucket is picked from the request's
+    ``Authorization`` header, so one session can serve clients of several
+    tokens.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE) -> None:
+        """Start with a connection pool of ``pool_size`` per host.
+
+        Args:
+            pool_size: Connections kept open per host for reuse.
+        """
+        super().__init__()
+        self._pool_lock = threading.Lock()
+        self.pool_size = 0
+        self.grow_pool(pool_size)
+
+    def grow_pool(self, pool_size: int) -> None:
+        """Keep at least ``pool_size`` connections per host open for reuse.
+
+        urllib3 opens a connection for every request in flight whatever the
+        pool size; the size is how many it keeps afterwards. Too small a pool
+        closes the surplus with a warning, and the next request pays for a new
+        TLS handshake. Growing mounts a new adapter and closes the old one's
+        pool, so its idle connections are dropped rather than leaked; call it
+        before the sync starts.
+
+        Args:
+            pool_size: Connections the threads sharing this session need.
+        """
+        with self._pool_lock:
+            if pool_size <= self.pool_size:
+                return
+            replaced = self.adapters["https://"]
+            self.mount("https://", HTTPAdapter(pool_maxsize=pool_size))
+            self.pool_size = pool_size
+        # A request still in flight on the old pool finishes; its connection
+        # is discarded instead of returned.
+        replaced.close()
+
+    def send(
+        self,
+        request: PreparedRequest,
+        **kwargs: Any,  # ruff:ignore[any-type] # mirrors requests.Session.send
+    ) -> Response:
+        """Send a request, retrying it while it fails transiently.
+
+        Set-rules requests replace the whole rule list, so sending one again
+        after a timeout can't apply it twice. Certificate errors are not
+        transient and fail at once.
+
+        Args:
+            request: The prepared request.
+            **kwargs: Transport options, passed through unchanged.
+
+        Returns:
+            Response: The response; after the last attempt, possibly an error.
+
+        Raises:
+            ConnectionError: If no connection could be used on the last attempt.
+            Timeout: If the last attempt timed out.
+        """
+        label = f"{request.method} {request.path_url}"
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self._send_paced(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = (
+                    None
+                    if isinstance(e, requests.exceptions.SSLError)
+                    else next_retry(label, attempt, type(e).__name__)
+                )
+                if delay is None:
+                    raise
+            else:
+                if not is_retryable(response.status_code, response.content):
+                    return response
+                delay = next_retry(
+                    label, attempt, str(response.status_code), response.headers
+                )
+                if delay is None:
+                    return response
+            time.sleep(delay)
+
+    def _send_paced(
+        self,
+        request: PreparedRequest,
+        **kwargs: Any,  # ruff:ignore[any-type] # mirrors requests.Session.send
+    ) -> Response:
+        """Wait for a slot, send the request, and learn from the response.
+
+        Every request is also counted in the API metrics, by endpoint and
+        status, with its latency not counting the wait. Its timeouts are
+        shrunk to end by the ``--deadline``.
+
+        Args:
+            request: The prepared request.
+            **kwargs: Transport options, passed through unchanged.
+
+        Returns:
+            Response: The response.
+
+        Raises:
+            PacingPastDeadlineError: If the wait for a slot would end past the
+                ``--deadline``; nothing is sent then.
+            RequestException: If no response arrived; re-raised after counting.
+        """
+        authorization = request.headers.get("Authorization")
+        bucket = None
+        if isinstance(authorization, str) and authorization.startswith("Bearer "):
+            bucket = bucket_for(authorization.removeprefix("Bearer "))
+            delay = pacing_delay(bucket)
+            if delay and not RUN_DEADLINE.allows(delay):
+                msg = f"rate limit pacing would wait {delay:.1f}s, past the deadline"
+                raise PacingPastDeadlineError(msg)
+            if delay:
+                time.sleep(delay)
+        # make_client always passes a (connect, read) pair.
+        timeout = kwargs.get("timeout")
+        if isinstance(timeout, tuple):
+            kwargs["timeout"] = RUN_DEADLINE.clamp(timeout)
+        method, url = request.method or "", request.url or ""
+        started = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException:
+            observe_request(method, url, "error", time.perf_counter() - started)
+            raise
+        observe_request(
+            method, url, str(response.status_code), time.perf_counter() - started
+        )
+        if bucket is not None:
+            bucket.update(response.headers)
+        return response
+
+
+_shared_session = PacedSession()
+
+
+def shared_session() -> PacedSession:
+    """Return the session shared by every hcloud client of the process.
+
+    All requests go to the same API host, so one pool of kept-alive
+    connections serves every project: a project reuses a connection another
+    one opened instead of paying for its own TCP and TLS handshake. Requests
+    carry their token in their own headers, and pacing picks the bucket from
+    them, so nothing in the session is tied to a token.
+
+    Returns:
+        PacedSession: The shared session.
+    """
+    return _shared_session
@@ -0,0 +1,183 @@
+"""Retry transient Hetzner API failures with jittered exponential backoff."""
+
+from __future__ import annotations
+
+import json
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING
+
+from cf_ips_to_hcloud_fw.deadline import RUN_DEADLINE
+from cf_ips_to_hcloud_fw.metrics import API_RETRIES
+
+if TYPE_CHECKING:  # pragma: no cover
+    from collections.abc import Mapping  # pragma: no cover
+
+# Statuses that say "try again later" whatever the body holds.
+RETRYABLE_STATUSES = frozenset({429, 502, 503, 504})
+
+# Hetzner error codes for conditions that clear up on their own: a resource
+# locked by a running action, a concurrent modification, an exhausted rate
+# limit, or a backend that is briefly unavailable. Everything else - invalid
+# input, missing permissions, not found - fails the same way every time.
+RETRYABLE_CODES = frozenset({
+    "conflict",
+    "locked",
+    "rate_limit_exceeded",
+    "server_error",
+    "timeout",
+    "unavailable",
+})
+
+# Most times one request is sent, the first attempt included.
+MAX_ATTEMPTS = 4
+
+# Backoff before retry n is drawn uniformly from [0, min(CAP, BASE * 2**(n-1))).
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+# Retries allowed per sync across all projects and requests.
+DEFAULT_RETRY_BUDGET = 20
+
+
+class RetryBudget:
+    """Retries left in the current sync, shared by every request of the process.
+
+    Thread-safe. Each retry takes one; once none are left, failures are
+    reported as they are, so a struggling API costs at most the budget's worth
+    of waits instead of a retry cycle for every request.
+    """
+
+    def __init__(self, total: int) -> None:
+        """Start with ``total`` retries.
+
+        Args:
+            total: Retries allowed until the next reset.
+        """
+        self._lock = threading.Lock()
+        self._left = total
+        # With retries turned off there is nothing to run out of.
+        self._warned = total <= 0
+
+    def reset(self, total: int) -> None:
+        """Refill the budget for the next sync.
+
+        Args:
+            total: Retries allowed until the next reset.
+        """
+        with self._lock:
+            self._left = total
+            self._warned = total <= 0
+
+    def take(self) -> bool:
+        """Take one retry from the budget.
+
+        Logs a warning the first time a non-zero budget runs dry.
+
+        Returns:
+            bool: Whether a retry was left.
+        """
+        with self._lock:
+            if self._left > 0:
+                self._left -= 1
+                return True
+            warn = not self._warned
+            self._warned = True
+        if warn:
+            logging.warning(
+                "Hetzner API retry budget used up; further transient failures "
+                "are not retried in this sync"
+            )
+        return False
+
+
+RETRY_BUDGET = RetryBudget(DEFAULT_RETRY_BUDGET)
+
+
+def is_retryable(status_code: int, content: bytes) -> bool:
+    """Tell whether a response reports a transient failure.
+
+    Args:
+        status_code: HTTP status of the response.
+        content: Raw response body, holding Hetzner's error object if any.
+
+    Returns:
+        bool: True when sending the request again may succeed.
+    """
+    if status_code < 400:  # ruff:ignore[magic-value-comparison]
+        return False
+    if status_code in RETRYABLE_STATUSES:
+        return True
+    try:
+        code = json.loads(content)["error"]["code"]
+    except (ValueError, TypeError, KeyError):
+        return False
+    return code in RETRYABLE_CODES
+
+
+def retry_after(headers: Mapping[str, str]) -> float | None:
+    """Read a ``Retry-After`` header, given in seconds or as an HTTP date.
+
+    Args:
+        headers: Response headers.
+
+    Returns:
+        float | None: Seconds to wait, or None when the header is missing or
+        unreadable.
+    """
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def next_retry(
+    request: str,
+    attempt: int,
+    reason: str,
+    headers: Mapping[str, str] | None = None,
+) -> float | None:
+    """Decide whether a failed request is sent again, and after how long.
+
+    The wait is the response's ``Retry-After`` when it has one, and full
+    jitter backoff otherwise. A ``Retry-After`` longer than ``BACKOFF_CAP`` is
+    not waited for: the failure is reported instead of stalling the run. Nor
+    is a wait that would end past the ``--deadline``.
+
+    Args:
+        request: Method and URL of the request, for the log.
+        attempt: Times the request has been sent so far.
+        reason: What went wrong: the HTTP status or the exception's name.
+        headers: Headers of the failed response, if one arrived.
+
+    Returns:
+        float | None: Seconds to wait before sending it again, or None to give
+        up and report the failure.
+    """
+    if attempt >= MAX_ATTEMPTS:
+        return None
+    delay = retry_after(headers) if headers is not None else None
+    if delay is None:
+        delay = random.uniform(  # ruff:ignore[suspicious-non-cryptographic-random-usage]
+            0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1))
+        )
+    elif delay > BACKOFF_CAP:
+        return None
+    if not RUN_DEADLINE.allows(delay) or not RETRY_BUDGET.take():
+        return None
+    API_RETRIES.inc()
+    logging.info(
+        f"Hetzner API {request} failed ({reason}), retrying in {delay:.1f}s "
+        f"(attempt {attempt + 1} of {MAX_ATTEMPTS})"
+    )
+    return delay
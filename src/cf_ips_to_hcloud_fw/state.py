@@ -0,0 +1,251 @@
+"""Owner-only JSON files on disk and the applied-state store built on them."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:  # pragma: no cover
+    from cf_ips_to_hcloud_fw.firewall import ProjectOutcome  # pragma: no cover
+    from cf_ips_to_hcloud_fw.models import CloudflareCIDRs, Project  # pragma: no cover
+
+# Default age, in minutes, after which a firewall recorded as up to date is
+# read from Hetzner again, so manual edits in the console are still undone.
+DEFAULT_REVERIFY_AFTER = 60
+
+
+def read_private_json(path: Path) -> dict[str, Any]:
+    """Read a JSON object from a file, refusing one others could have written.
+
+    Args:
+        path: Path of the file.
+
+    Returns:
+        dict[str, Any]: The decoded JSON object.
+
+    Raises:
+        PermissionError: If group or others may write to the file.
+        TypeError: If the file does not hold a JSON object.
+    """
+    with path.open(encoding="utf-8") as f:
+        mode = stat.S_IMODE(os.fstat(f.fileno()).st_mode)
+        if os.name == "posix" and mode & (stat.S_IWGRP | stat.S_IWOTH):
+            msg = f"insecure permissions ({mode:o}); group/other write bits are set"
+            raise PermissionError(msg)
+        document = json.load(f)
+    if not isinstance(document, dict):
+        msg = f"expected a JSON object, got {type(document).__name__}"
+        raise TypeError(msg)
+    return document
+
+
+def write_private_json(path: Path, data: object) -> None:
+    """Atomically replace a file with a JSON document readable by its owner only.
+
+    The document is written to a temporary file in the same directory, created
+    with mode 0600, and renamed over the target, so a concurrent reader never
+    sees half of it.
+
+    Args:
+        path: Path of the file.
+        data: JSON-serializable document.
+    """
+    tmp_path: Path | None = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf-8",
+            dir=path.resolve().parent,
+            prefix=f".{path.name}.",
+            delete=False,
+        ) as f:
+            tmp_path = Path(f.name)
+            json.dump(data, f)
+        tmp_path.replace(path)
+    except BaseException:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def cidrs_fingerprint(cf_cidrs: CloudflareCIDRs, max_sources: int) -> str:
+    """Digest the rules a sync would write, independent of range order.
+
+    The cap on sources per rule is part of it: the same ranges split under
+    another ``--max-rule-sources`` give different rules, so a firewall left
+    matching under the old cap has to be checked again.
+
+    Args:
+        cf_cidrs: Validated Cloudflare ranges.
+        max_sources: Most source IPs a single rule may hold.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    payload = json.dumps([
+        sorted(cf_cidrs.ipv4_cidrs),
+        sorted(cf_cidrs.ipv6_cidrs),
+        max_sources,
+    ])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _firewall_key(project: Project, name: str) -> str:
+    """Identify a firewall across runs without storing its project's token.
+
+    Firewall names are only unique within a project, and the token is the only
+    thing that identifies a project, so the key combines a truncated digest of
+    the token with the name.
+
+    Args:
+        project: Project the firewall belongs to.
+        name: Firewall name from the config.
+
+    Returns:
+        str: Stable key for the state file.
+    """
+    token = project.token.get_secret_value().encode()
+    return f"{hashlib.sha256(token).hexdigest()[:16]}/{name}"
+
+
+class AppliedState:
+    """Which firewalls were last seen matching which Cloudflare range set.
+
+    A firewall is recorded once a sync leaves it matching the ranges - either
+    because ``set_rules`` succeeded or because it already matched. Until the
+    ranges change or ``reverify_after`` passes, later runs leave it out and
+    make no Hetzner request for it at all.
+    """
+
+    def __init__(
+        self, path: Path, entries: dict[str, Any], reverify_after: float
+    ) -> None:
+        """Wrap the loaded entries; use :meth:`load` to read them from disk.
+
+        Args:
+            path: Path of the state file.
+            entries: Firewall key to ``fingerprint``/``verified_at`` entry.
+            reverify_after: Seconds after which a recorded firewall is
+                re-read from Hetzner even when the ranges are unchanged.
+        """
+        self._path = path
+        self._entries = entries
+        self._reverify_after = reverify_after
+
+    @classmethod
+    def load(cls, state_file: str, *, reverify_after: float) -> AppliedState:
+        """Read the state file, starting empty when there is none.
+
+        Like the Cloudflare cache, the state is only ever an optimization: an
+        unreadable, malformed or group/other-writable file is logged and
+        ignored, which costs one full sync and nothing else.
+
+        Args:
+            state_file: Path of the state file.
+            reverify_after: Seconds after which a recorded firewall is re-read.
+
+        Returns:
+            AppliedState: The loaded state.
+        """
+        path = Path(state_file)
+        entries: dict[str, Any] = {}
+        try:
+            document = read_private_json(path)
+            entries = dict(document["firewalls"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring state file {state_file!r}: {e}")
+        return cls(path, entries, reverify_after)
+
+    def _is_fresh(self, key: str, fingerprint: str, now: float) -> bool:
+        """Tell whether a firewall was verified against ``fingerprint`` recently.
+
+        Args:
+            key: Firewall key, see ``_firewall_key``.
+            fingerprint: Fingerprint of the ranges about to be applied.
+            now: Current wall-clock time; a timestamp from the future counts
+                as stale, so a clock jump cannot pin a firewall indefinitely.
+
+        Returns:
+            bool: True when the firewall can be left out of this sync.
+        """
+        entry = self._entries.get(key)
+        if not isinstance(entry, dict) or entry.get("fingerprint") != fingerprint:
+            return False
+        verified_at = entry.get("verified_at")
+        return isinstance(verified_at, (int, float)) and (
+            0 <= now - verified_at < self._reverify_after
+        )
+
+    def pending(self, projects: list[Project], fingerprint: str) -> list[Project]:
+        """Drop the firewalls already known to match ``fingerprint``.
+
+        Projects stay in place, possibly with no firewall left, so project
+        indices in log lines and reports do not shift.
+
+        Args:
+            projects: Ordered project definitions from the config.
+            fingerprint: Fingerprint of the ranges about to be applied.
+
+        Returns:
+            list[Project]: The projects restricted to firewalls still to sync.
+        """
+        now = time.time()
+        result: list[Project] = []
+        for idx, project in enumerate(projects, start=1):
+            names: list[str] = []
+            for name in project.firewalls:
+                if self._is_fresh(_firewall_key(project, name), fingerprint, now):
+                    logging.info(
+                        f"hcloud firewall {name!r} in project {idx} matched these "
+                        "Cloudflare ranges at its last check - skipping"
+                    )
+                else:
+                    names.append(name)
+            result.append(project.model_copy(update={"firewalls": names}))
+        return result
+
+    def record(
+        self,
+        projects: list[Project],
+        outcomes: list[ProjectOutcome],
+        fingerprint: str,
+    ) -> None:
+        """Record every synced firewall that didn't fail, go missing or time out.
+
+        Args:
+            projects: The projects as passed to the sync, in config order.
+            outcomes: Their outcomes, in the same order.
+            fingerprint: Fingerprint of the ranges that were applied.
+        """
+        now = time.time()
+        for idx, (project, outcome) in enumerate(
+            zip(projects, outcomes, strict=True), start=1
+        ):
+            not_synced = (
+                set(outcome.failed) | set(outcome.skipped) | set(outcome.untouched)
+            )
+            for name in project.firewalls:
+                key = _firewall_key(project, name)
+                if f"project {idx}:{name!r}" in not_synced:
+                    self._entries.pop(key, None)
+                else:
+                    self._entries[key] = {
+                        "fingerprint": fingerprint,
+                        "verified_at": now,
+                    }
+
+    def save(self) -> None:
+        """Write the state back to disk; a failure is logged, not raised."""
+        try:
+            write_private_json(self._path, {"firewalls": self._entries})
+        except OSError as e:
+            logging.warning(f"Couldn't write state file {str(self._path)!r}: {e}")
@@ -0,0 +1,166 @@
+"""Phase timers behind the ``--timings`` run summary."""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:  # pragma: no cover
+    from collections.abc import Generator  # pragma: no cover
+
+# Firewalls listed by total time in the summary.
+SLOWEST_FIREWALLS = 5
+
+
+class Timing(NamedTuple):
+    """One measured call.
+
+    Attributes:
+        phase: Kind of call, e.g. ``cf_ips_list`` or ``set_rules``.
+        seconds: Wall-clock duration.
+        subject: Label of the firewall the call was for, if any.
+    """
+
+    phase: str
+    seconds: float
+    subject: str | None
+
+
+class Timings:
+    """Collect phase durations from every thread and event loop of a run.
+
+    Recording is off until :meth:`enable` is called, so a run without
+    ``--timings`` - in particular a long-lived ``--watch`` daemon - does not
+    accumulate records nobody reads.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty, disabled collection."""
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._records: list[Timing] = []
+
+    def enable(self) -> None:
+        """Start recording."""
+        self.enabled = True
+
+    def add(self, phase: str, seconds: float, subject: str | None = None) -> None:
+        """Record one duration, if recording is enabled.
+
+        Args:
+            phase: Kind of call.
+            seconds: Wall-clock duration.
+            subject: Label of the firewall the call was for, if any.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._records.append(Timing(phase, seconds, subject))
+
+    def drain(self) -> list[Timing]:
+        """Return every record so far and start over.
+
+        Returns:
+            list[Timing]: Records in the order they were taken.
+        """
+        with self._lock:
+            records, self._records = self._records, []
+        return records
+
+
+_TIMINGS = Timings()
+
+
+def enable_timings() -> None:
+    """Start recording phase durations for the summary."""
+    _TIMINGS.enable()
+
+
+def record_timing(phase: str, seconds: float, subject: str | None = None) -> None:
+    """Record a duration measured by the caller.
+
+    For waits that do not map onto one block of code, such as a firewall's
+    actions inside the shared poll loop.
+
+    Args:
+        phase: Kind of call.
+        seconds: Wall-clock duration.
+        subject: Label of the firewall the call was for, if any.
+    """
+    _TIMINGS.add(phase, seconds, subject)
+
+
+@contextmanager
+def timed(phase: str, subject: str | None = None) -> Generator[None, None, None]:
+    """Time the enclosed block, whether it returns or raises.
+
+    Works around ``await`` as well; the asyncio engine's durations then
+    include time spent waiting for the event loop, like a caller would see.
+
+    Args:
+        phase: Kind of call.
+        subject: Label of the firewall the call is for, if any.
+
+    Yields:
+        None: Control to the timed block.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _TIMINGS.add(phase, time.perf_counter() - started, subject)
+
+
+def _percentile(ordered: list[float], share: float) -> float:
+    """Nearest-rank percentile of an ascending, non-empty list.
+
+    Args:
+        ordered: Values sorted in ascending order.
+        share: Percentile as a fraction, e.g. 0.95.
+
+    Returns:
+        float: The smallest value with at least ``share`` of values at or below it.
+    """
+    return ordered[max(0, math.ceil(share * len(ordered)) - 1)]
+
+
+def timing_summary() -> list[str]:
+    """Summarize and reset the recorded durations.
+
+    One line per phase, in the order phases first ran, with the call count,
+    total, p50, p95 and maximum; then the firewalls that took longest over all
+    their calls.
+
+    Returns:
+        list[str]: Log lines; empty when nothing was recorded.
+    """
+    records = _TIMINGS.drain()
+    by_phase: dict[str, list[float]] = {}
+    by_subject: dict[str, float] = {}
+    for record in records:
+        by_phase.setdefault(record.phase, []).append(record.seconds)
+        if record.subject is not None:
+            by_subject[record.subject] = (
+                by_subject.get(record.subject, 0.0) + record.seconds
+            )
+    lines = []
+    for phase, durations in by_phase.items():
+        ordered = sorted(durations)
+        lines.append(
+            f"Timing {phase}: {len(ordered)} call(s), {sum(ordered):.3f}s total, "
+            f"p50 {_percentile(ordered, 0.5):.3f}s, "
+            f"p95 {_percentile(ordered, 0.95):.3f}s, max {ordered[-1]:.3f}s"
+        )
+    if by_subject:
+        slowest = sorted(by_subject.items(), key=lambda item: -item[1])
+        lines.append(
+            "Slowest firewalls: "
+            + ", ".join(
+                f"{subject} {seconds:.3f}s"
+                for subject, seconds in slowest[:SLOWEST_FIREWALLS]
+            )
+        )
+    return lines
@@ -0,0 +1,76 @@
+"""Long-running mode: poll Cloudflare and sync only when its ranges change."""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from cf_ips_to_hcloud_fw.custom_logging import log_error
+from cf_ips_to_hcloud_fw.firewall import summarize_outcomes
+
+if TYPE_CHECKING:  # pragma: no cover
+    import threading  # pragma: no cover
+    from collections.abc import Callable  # pragma: no cover
+
+    from cf_ips_to_hcloud_fw.firewall import ProjectOutcome  # pragma: no cover
+    from cf_ips_to_hcloud_fw.models import CloudflareCIDRs  # pragma: no cover
+
+
+def watch(
+    *,
+    fetch: Callable[[], CloudflareCIDRs],
+    sync: Callable[[CloudflareCIDRs], list[ProjectOutcome]],
+    interval: float,
+    reconcile_interval: float,
+    stop: threading.Event,
+) -> None:
+    """Poll Cloudflare every ``interval`` seconds until ``stop`` is set.
+
+    The Hetzner side runs only when the validated ranges differ from the last
+    successfully applied ones, or when ``reconcile_interval`` seconds have
+    passed since the last full sync. A sync with failed firewalls is not
+    recorded as applied, so the next poll retries it.
+
+    A failed Cloudflare fetch or validation skips that poll and keeps the
+    rules as they are. The fetch helpers report those failures through
+    ``log_error_and_exit``, which is right for a one-shot run; here the error
+    is already logged when ``SystemExit`` arrives, so it is absorbed and the
+    daemon keeps running.
+
+    Args:
+        fetch: Returns freshly fetched and validated Cloudflare ranges.
+        sync: Applies the given ranges to every project's firewalls.
+        interval: Seconds between Cloudflare polls.
+        reconcile_interval: Seconds between full syncs of unchanged ranges.
+        stop: Set to end the loop after the current poll.
+    """
+    applied: CloudflareCIDRs | None = None
+    last_sync = 0.0
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            cf_cidrs = fetch()
+        except SystemExit:
+            logging.warning("Cloudflare poll failed; keeping current firewall rules")
+        else:
+            if cf_cidrs != applied:
+                logging.info("Cloudflare ranges changed; syncing firewalls")
+            elif started - last_sync >= reconcile_interval:
+                logging.info("Running scheduled full reconcile")
+            else:
+                logging.debug("Cloudflare ranges unchanged; nothing to do")
+                cf_cidrs = None
+            if cf_cidrs is not None:
+                outcomes = sync(cf_cidrs)
+                report = summarize_outcomes(outcomes)
+                if report:
+                    log_error(report)
+                # Only a sync without failures counts as applied; anything
+                # else is retried on the next poll rather than at the next
+                # reconcile. Firewalls that were merely not found do not
+                # block this - retrying would not make them appear.
+                if not any(outcome.failed for outcome in outcomes):
+                    applied = cf_cidrs
+                    last_sync = started
+        stop.wait(max(0.0, interval - (time.monotonic() - started)))
@@ -0,0 +1,27 @@
+"""Shared test fixtures."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+from cf_ips_to_hcloud_fw.deadline import RUN_DEADLINE
+from cf_ips_to_hcloud_fw.retry import RETRY_BUDGET
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+
+@pytest.fixture(autouse=True)
+def no_retries_or_deadline() -> Iterator[None]:
+    """Fail requests at once and never run out of time, unless a test says so.
+
+    Yields:
+        None: Control to the test.
+    """
+    RETRY_BUDGET.reset(0)
+    RUN_DEADLINE.start(None)
+    yield
+    RETRY_BUDGET.reset(0)
+    RUN_DEADLINE.start(None)
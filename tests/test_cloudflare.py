@@ -2,6 +2,9 @@
 
 from __future__ import annotations
 
+import json
+import os
+from typing import TYPE_CHECKING
 from unittest.mock import MagicMock, patch
 
 import cloudflare
@@ -10,11 +13,23 @@ import httpx
 import pytest
 
 from cf_ips_to_hcloud_fw.cloudflare import (
+    _NETWORKS_ADAPTER,
+    CLOUDFLARE_TIMEOUT,
+    cf_ips_get,
     cf_ips_list,
+    collapse_cidrs,
     get_cloudflare_cidrs,
+    read_cloudflare_cidrs,
+    shared_client,
 )
 from cf_ips_to_hcloud_fw.models import CloudflareCIDRs
 
+if TYPE_CHECKING:
+    from pathlib import Path
+
+OWNER_ONLY = 0o600
+HTTP_TOO_MANY_REQUESTS = 429
+
 
 @patch("cloudflare.Cloudflare")
 def test_cf_ips_list_sends_no_credentials(mock_cloudflare: MagicMock) -> None:
@@ -28,9 +43,10 @@ def test_cf_ips_list_sends_no_credentials(mock_cloudflare: MagicMock) -> None:
     # No api_key/api_token/etc. is passed to the client constructor, but the
     # base URL is pinned so CLOUDFLARE_BASE_URL cannot redirect the fetch.
     mock_cloudflare.assert_called_once_with(
-        base_url="https://api.cloudflare.com/client/v4"
+        base_url="https://api.cloudflare.com/client/v4", http_client=shared_client()
     )
     _, kwargs = mock_cloudflare.return_value.ips.list.call_args
+    assert kwargs["timeout"] == httpx.Timeout(60.0, connect=5.0)
     headers = kwargs["extra_headers"]
     assert set(headers) == {
         "Authorization",
@@ -47,10 +63,10 @@ def test_cf_ips_list_ignores_base_url_env_var() -> None:
     real_client = cloudflare.Cloudflare
     created: list[cloudflare.Cloudflare] = []
 
-    def build(*, base_url: str) -> MagicMock:
+    def build(*, base_url: str, http_client: httpx.Client) -> MagicMock:
         # Build a real client so the SDK's own env-var fallback gets its chance,
         # then hand cf_ips_list a stub so no request is attempted.
-        created.append(real_client(base_url=base_url))
+        created.append(real_client(base_url=base_url, http_client=http_client))
         return MagicMock()
 
     with patch("cloudflare.Cloudflare", side_effect=build):
@@ -99,6 +115,139 @@ def test_cf_ips_list_api_status_error(
     mock_logging.assert_called_once_with("Error getting CloudFlare IPs: rate-limit")
 
 
+IPS_URL = "https://api.cloudflare.com/client/v4/ips"
+
+
+def _http_response(
+    status_code: int = 200, *, json: object = None, text: str | None = None
+) -> httpx.Response:
+    return httpx.Response(
+        status_code, request=httpx.Request("GET", IPS_URL), json=json, text=text
+    )
+
+
+def _envelope(etag: str | None = "etag-1") -> dict[str, object]:
+    return {
+        "result": {
+            "etag": etag,
+            "ipv4_cidrs": ["199.27.128.0/21", "198.27.128.0/21"],
+            "ipv6_cidrs": ["2606:4700::/32", "2400:cb00::/32"],
+        },
+        "success": True,
+        "errors": [],
+        "messages": [],
+    }
+
+
+@patch.dict("os.environ", {"CLOUDFLARE_BASE_URL": "http://attacker.example.invalid"})
+@patch("httpx.Client.get")
+def test_cf_ips_get_sends_no_credentials(mock_get: MagicMock) -> None:
+    """The plain GET goes to the pinned URL and carries no credentials."""
+    mock_get.return_value = _http_response(json=_envelope())
+
+    result = cf_ips_get()
+
+    assert result == _envelope()["result"]
+    mock_get.assert_called_once()
+    args, kwargs = mock_get.call_args
+    assert args == (IPS_URL,)
+    assert not {"Authorization", "X-Auth-Key"} & set(kwargs["headers"])
+    # Proxy and CA settings from the environment must keep applying.
+    assert "trust_env" not in kwargs
+
+
+@patch("cloudflare.Cloudflare")
+def test_both_backends_share_one_http_client(mock_cloudflare: MagicMock) -> None:
+    """Every poll, through either backend, reuses one kept-alive client."""
+    with patch("httpx.Client.get", autospec=True) as mock_get:
+        mock_get.return_value = _http_response(json=_envelope())
+        cf_ips_get()
+        cf_ips_get()
+    cf_ips_list()
+    cf_ips_list()
+
+    get_clients = {call.args[0] for call in mock_get.call_args_list}
+    sdk_clients = {
+        call.kwargs["http_client"] for call in mock_cloudflare.call_args_list
+    }
+    assert get_clients == sdk_clients == {shared_client()}
+
+
+@patch("cf_ips_to_hcloud_fw.cloudflare.RUN_DEADLINE")
+@patch("httpx.Client.get")
+def test_cf_ips_get_timeout_ends_by_the_deadline(
+    mock_get: MagicMock, mock_deadline: MagicMock
+) -> None:
+    """The fetch's timeouts are shrunk so it can't outlast the deadline."""
+    mock_get.return_value = _http_response(json=_envelope())
+    mock_deadline.clamp.return_value = (1.0, 2.0)
+
+    cf_ips_get()
+
+    mock_deadline.clamp.assert_called_once_with(CLOUDFLARE_TIMEOUT)
+    assert mock_get.call_args.kwargs["timeout"] == httpx.Timeout(2.0, connect=1.0)
+
+
+@pytest.mark.parametrize(
+    ("response", "message"),
+    [
+        pytest.param(
+            httpx.ConnectTimeout("timed out"),
+            "Error getting CloudFlare IPs: timed out",
+            id="timeout",
+        ),
+        pytest.param(
+            _http_response(HTTP_TOO_MANY_REQUESTS),
+            f"Error getting CloudFlare IPs: Client error '429 Too Many Requests' "
+            f"for url '{IPS_URL}'",
+            id="status",
+        ),
+        pytest.param(
+            _http_response(text="<html>"),
+            "Error getting CloudFlare IPs: Expecting value: line 1 column 1 (char 0)",
+            id="not-json",
+        ),
+    ],
+)
+@patch("logging.error")
+def test_cf_ips_get_errors(
+    mock_logging: MagicMock, response: object, message: str
+) -> None:
+    """Transport errors, error statuses and non-JSON bodies end the run."""
+    with (
+        patch("httpx.Client.get", side_effect=[response]),
+        pytest.raises(SystemExit) as e,
+    ):
+        cf_ips_get()
+    assert e.value.code == 1
+    assert mock_logging.call_args[0][0].startswith(message)
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        pytest.param({"result": None, "success": False}, id="null-result"),
+        pytest.param(["not", "an", "envelope"], id="not-an-object"),
+    ],
+)
+def test_cf_ips_get_without_result(body: object) -> None:
+    """A response without a result object counts as no payload."""
+    with patch("httpx.Client.get", return_value=_http_response(json=body)):
+        assert cf_ips_get() is None
+
+
+def test_get_cloudflare_cidrs_http_backend(tmp_path: Path) -> None:
+    """The default backend feeds the same validation and cache as the SDK."""
+    cache_file = tmp_path / "cache.json"
+    with (
+        patch("httpx.Client.get", return_value=_http_response(json=_envelope())),
+        patch("cloudflare.Cloudflare") as mock_cloudflare,
+    ):
+        assert get_cloudflare_cidrs(str(cache_file)) == EXPECTED
+    mock_cloudflare.assert_not_called()
+    assert json.loads(cache_file.read_text())["etag"] == "etag-1"
+
+
 @patch(
     "cf_ips_to_hcloud_fw.cloudflare.cf_ips_list",
     MagicMock(return_value=None),
@@ -107,7 +256,7 @@ def test_cf_ips_list_api_status_error(
 def test_get_cloudflare_cidrs_no_response(mock_logging: MagicMock) -> None:
     """get_cloudflare_cidrs aborts when the SDK returns an empty payload."""
     with pytest.raises(SystemExit) as e:
-        get_cloudflare_cidrs()
+        get_cloudflare_cidrs(backend="sdk")
     assert e.value.code == 1
     mock_logging.assert_called_once_with("Cloudflare/ips.list: no response")
 
@@ -125,7 +274,7 @@ def test_get_cloudflare_cidrs_no_response(mock_logging: MagicMock) -> None:
 def test_get_cloudflare_cidrs_empty_ipv4(mock_logging: MagicMock) -> None:
     """get_cloudflare_cidrs aborts when the API returns an empty IPv4 CIDR list."""
     with pytest.raises(SystemExit) as e:
-        get_cloudflare_cidrs()
+        get_cloudflare_cidrs(backend="sdk")
     assert e.value.code == 1
     mock_logging.assert_called_once_with("Cloudflare/ips.list: empty IPv4 CIDR list")
 
@@ -143,7 +292,7 @@ def test_get_cloudflare_cidrs_empty_ipv4(mock_logging: MagicMock) -> None:
 def test_get_cloudflare_cidrs_empty_ipv6(mock_logging: MagicMock) -> None:
     """get_cloudflare_cidrs aborts when the API returns an empty IPv6 CIDR list."""
     with pytest.raises(SystemExit) as e:
-        get_cloudflare_cidrs()
+        get_cloudflare_cidrs(backend="sdk")
     assert e.value.code == 1
     mock_logging.assert_called_once_with("Cloudflare/ips.list: empty IPv6 CIDR list")
 
@@ -161,7 +310,7 @@ def test_get_cloudflare_cidrs_empty_ipv6(mock_logging: MagicMock) -> None:
 def test_get_cloudflare_cidrs_invalid(mock_logging: MagicMock) -> None:
     """Invalid IP payloads propagate a validation error through log_error_and_exit."""
     with pytest.raises(SystemExit) as e:
-        get_cloudflare_cidrs()
+        get_cloudflare_cidrs(backend="sdk")
     assert e.value.code == 1
     mock_logging.assert_called_once()
     assert "Cloudflare/ips.list didn't validate" in mock_logging.call_args[0][0]
@@ -196,7 +345,7 @@ def test_get_cloudflare_cidrs_rejects_unroutable(
         ),
         pytest.raises(SystemExit) as e,
     ):
-        get_cloudflare_cidrs()
+        get_cloudflare_cidrs(backend="sdk")
 
     assert e.value.code == 1
     mock_logging.assert_called_once()
@@ -214,8 +363,267 @@ def test_get_cloudflare_cidrs_rejects_unroutable(
 )
 def test_get_cloudflare_cidrs() -> None:
     """Valid payloads are converted to sorted CloudflareCIDRs instances."""
-    result = get_cloudflare_cidrs()
+    result = get_cloudflare_cidrs(backend="sdk")
     assert result == CloudflareCIDRs(
         ipv4_cidrs=["198.27.128.0/21", "199.27.128.0/21"],
         ipv6_cidrs=["2400:cb00::/32", "2606:4700::/32"],
     )
+
+
+def _response(etag: str | None = "etag-1") -> MagicMock:
+    return MagicMock(
+        return_value=cloudflare.types.ips.ip_list_response.PublicIPIPs(
+            etag=etag,
+            ipv4_cidrs=["199.27.128.0/21", "198.27.128.0/21"],
+            ipv6_cidrs=["2606:4700::/32", "2400:cb00::/32"],
+        )
+    )
+
+
+EXPECTED = CloudflareCIDRs(
+    ipv4_cidrs=["198.27.128.0/21", "199.27.128.0/21"],
+    ipv6_cidrs=["2400:cb00::/32", "2606:4700::/32"],
+)
+
+
+def test_get_cloudflare_cidrs_writes_cache(tmp_path: Path) -> None:
+    """A validated response is cached owner-only together with its etag."""
+    cache_file = tmp_path / "cache.json"
+    with patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()):
+        assert get_cloudflare_cidrs(str(cache_file), backend="sdk") == EXPECTED
+
+    entry = json.loads(cache_file.read_text())
+    assert entry["etag"] == "etag-1"
+    assert "fetched_at" in entry
+    assert CloudflareCIDRs.model_validate(entry["cidrs"]) == EXPECTED
+    if os.name == "posix":
+        assert cache_file.stat().st_mode & 0o777 == OWNER_ONLY
+    assert [p.name for p in tmp_path.iterdir()] == ["cache.json"]
+
+
+def test_get_cloudflare_cidrs_cache_hit_skips_validation(tmp_path: Path) -> None:
+    """An unchanged etag is answered from the cache without validating."""
+    cache_file = str(tmp_path / "cache.json")
+    with patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()):
+        get_cloudflare_cidrs(cache_file, backend="sdk")
+
+    with (
+        patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()),
+        patch("cf_ips_to_hcloud_fw.cloudflare._NETWORKS_ADAPTER") as mock_adapter,
+    ):
+        assert get_cloudflare_cidrs(cache_file, backend="sdk") == EXPECTED
+    mock_adapter.validate_python.assert_not_called()
+
+
+@patch("cf_ips_to_hcloud_fw.cloudflare.CLOUDFLARE_FETCHES")
+def test_get_cloudflare_cidrs_counts_fetches(
+    mock_fetches: MagicMock, tmp_path: Path
+) -> None:
+    """Fresh, cached and rejected responses are counted by outcome."""
+    cache_file = str(tmp_path / "cache.json")
+    with patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()):
+        get_cloudflare_cidrs(cache_file, backend="sdk")
+        get_cloudflare_cidrs(cache_file, backend="sdk")
+    empty = cloudflare.types.ips.ip_list_response.PublicIPIPs(
+        ipv4_cidrs=["198.27.128.0/21"], ipv6_cidrs=[]
+    )
+    with (
+        patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", return_value=empty),
+        patch("logging.error"),
+        pytest.raises(SystemExit),
+    ):
+        get_cloudflare_cidrs(backend="sdk")
+    timeout = cloudflare.APITimeoutError(
+        httpx.Request("GET", "https://api.cloudflare.com/client/v4/ips")
+    )
+    with (
+        patch("cloudflare.Cloudflare") as mock_cloudflare,
+        patch("logging.error"),
+    ):
+        mock_cloudflare.return_value.ips.list.side_effect = timeout
+        with pytest.raises(SystemExit):
+            get_cloudflare_cidrs(backend="sdk")
+    assert [c.args for c in mock_fetches.inc.call_args_list] == [
+        ("fetched",),
+        ("cached",),
+        ("invalid",),
+        ("error",),
+    ]
+
+
+def test_get_cloudflare_cidrs_cache_stale_etag(tmp_path: Path) -> None:
+    """A new etag validates the response and replaces the cache entry."""
+    cache_file = tmp_path / "cache.json"
+    with patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()):
+        get_cloudflare_cidrs(str(cache_file), backend="sdk")
+
+    bad = cloudflare.types.ips.ip_list_response.PublicIPIPs(
+        etag="etag-2", ipv4_cidrs=["10.0.0.0/8"], ipv6_cidrs=["2400:cb00::/32"]
+    )
+    with (
+        patch(
+            "cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", MagicMock(return_value=bad)
+        ),
+        patch("logging.error"),
+        pytest.raises(SystemExit),
+    ):
+        get_cloudflare_cidrs(str(cache_file), backend="sdk")
+    # A rejected response never reaches the cache.
+    assert json.loads(cache_file.read_text())["etag"] == "etag-1"
+
+    with patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response("etag-3")):
+        get_cloudflare_cidrs(str(cache_file), backend="sdk")
+    assert json.loads(cache_file.read_text())["etag"] == "etag-3"
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        pytest.param("{not json", id="malformed"),
+        pytest.param('{"etag": "etag-1"}', id="missing-cidrs"),
+        pytest.param('{"etag": "etag-1", "cidrs": {"ipv4_cidrs": 1}}', id="bad-shape"),
+        pytest.param("[]", id="not-an-object"),
+    ],
+)
+@patch("logging.warning")
+def test_get_cloudflare_cidrs_ignores_broken_cache(
+    mock_warning: MagicMock, tmp_path: Path, content: str
+) -> None:
+    """A broken cache file is reported and the response validated as usual."""
+    cache_file = tmp_path / "cache.json"
+    cache_file.write_text(content)
+    cache_file.chmod(OWNER_ONLY)
+    with patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()):
+        assert get_cloudflare_cidrs(str(cache_file), backend="sdk") == EXPECTED
+    mock_warning.assert_called_once()
+    assert "Ignoring Cloudflare cache" in mock_warning.call_args[0][0]
+    assert json.loads(cache_file.read_text())["etag"] == "etag-1"
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions only")
+@patch("logging.warning")
+def test_get_cloudflare_cidrs_refuses_writable_cache(
+    mock_warning: MagicMock, tmp_path: Path
+) -> None:
+    """A cache others can write to is not trusted to skip validation."""
+    cache_file = tmp_path / "cache.json"
+    with patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()):
+        get_cloudflare_cidrs(str(cache_file), backend="sdk")
+    cache_file.chmod(0o666)
+
+    with (
+        patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()),
+        patch(
+            "cf_ips_to_hcloud_fw.cloudflare._NETWORKS_ADAPTER",
+            wraps=_NETWORKS_ADAPTER,
+        ) as mock_adapter,
+    ):
+        assert get_cloudflare_cidrs(str(cache_file), backend="sdk") == EXPECTED
+    mock_adapter.validate_python.assert_called_once()
+    assert "insecure permissions (666)" in mock_warning.call_args[0][0]
+
+
+def test_get_cloudflare_cidrs_without_etag_skips_cache(tmp_path: Path) -> None:
+    """Without an etag there is nothing to key the cache on."""
+    cache_file = tmp_path / "cache.json"
+    with patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response(None)):
+        assert get_cloudflare_cidrs(str(cache_file), backend="sdk") == EXPECTED
+    assert not cache_file.exists()
+
+
+@patch("logging.warning")
+def test_get_cloudflare_cidrs_cache_write_failure(
+    mock_warning: MagicMock, tmp_path: Path
+) -> None:
+    """A failed cache write is a warning, never a failed run."""
+    cache_file = tmp_path / "cache.json"
+    with (
+        patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()),
+        patch("pathlib.Path.replace", side_effect=OSError("disk full")),
+    ):
+        assert get_cloudflare_cidrs(str(cache_file), backend="sdk") == EXPECTED
+    mock_warning.assert_called_once_with(
+        f"Couldn't write Cloudflare cache {str(cache_file)!r}: disk full"
+    )
+    assert list(tmp_path.iterdir()) == []
+
+
+@patch("logging.warning")
+def test_get_cloudflare_cidrs_cache_dir_missing(
+    mock_warning: MagicMock, tmp_path: Path
+) -> None:
+    """A cache path in a missing directory is reported, not fatal."""
+    cache_file = tmp_path / "missing" / "cache.json"
+    with patch("cf_ips_to_hcloud_fw.cloudflare.cf_ips_list", _response()):
+        assert get_cloudflare_cidrs(str(cache_file), backend="sdk") == EXPECTED
+    mock_warning.assert_called_once()
+    assert "Couldn't write Cloudflare cache" in mock_warning.call_args[0][0]
+
+
+@pytest.mark.parametrize(
+    "document",
+    [_envelope(), _envelope()["result"]],
+    ids=["envelope", "result"],
+)
+@patch("cf_ips_to_hcloud_fw.cloudflare.CLOUDFLARE_FETCHES")
+def test_read_cloudflare_cidrs_from_file(
+    mock_fetches: MagicMock, document: dict[str, object], tmp_path: Path
+) -> None:
+    """A saved response or its result object is validated like a fetched one."""
+    source = tmp_path / "ips.json"
+    source.write_text(json.dumps(document))
+    with patch("httpx.Client.get") as mock_get:
+        assert read_cloudflare_cidrs(str(source)) == EXPECTED
+    mock_get.assert_not_called()
+    mock_fetches.inc.assert_called_once_with("file")
+
+
+def test_read_cloudflare_cidrs_from_stdin() -> None:
+    """``-`` reads the document from standard input."""
+    with patch("sys.stdin") as mock_stdin:
+        mock_stdin.read.return_value = json.dumps(_envelope())
+        assert read_cloudflare_cidrs("-") == EXPECTED
+
+
+@pytest.mark.parametrize(
+    ("content", "message"),
+    [
+        (None, "Couldn't read Cloudflare IPs from {source!r}: "),
+        ("{not json", "Couldn't read Cloudflare IPs from {source!r}: "),
+        ("[]", "Cloudflare IPs from {source!r}: expected a JSON object"),
+        (
+            json.dumps({"ipv4_cidrs": ["10.0.0.0/8"], "ipv6_cidrs": []}),
+            "Cloudflare IPs from {source!r} didn't validate: ",
+        ),
+        (
+            json.dumps({"ipv4_cidrs": [], "ipv6_cidrs": ["2400:cb00::/32"]}),
+            "Cloudflare IPs from {source!r}: empty IPv4 CIDR list",
+        ),
+    ],
+    ids=["missing", "malformed", "not-an-object", "unroutable", "empty"],
+)
+@patch("logging.error")
+def test_read_cloudflare_cidrs_rejects_bad_documents(
+    mock_logging: MagicMock, content: str | None, message: str, tmp_path: Path
+) -> None:
+    """Unreadable, malformed and invalid documents end the run."""
+    source = tmp_path / "ips.json"
+    if content is not None:
+        source.write_text(content)
+    with pytest.raises(SystemExit) as e:
+        read_cloudflare_cidrs(str(source))
+    assert e.value.code == 1
+    assert mock_logging.call_args.args[0].startswith(message.format(source=str(source)))
+
+
+@patch("logging.info")
+def test_collapse_cidrs_reports_saved_entries(mock_info: MagicMock) -> None:
+    """The run says how many rule entries collapsing saved."""
+    cidrs = CloudflareCIDRs(
+        ipv4_cidrs=["198.27.128.0/21", "198.27.136.0/21", "199.27.128.0/21"],
+        ipv6_cidrs=["2400:cb00::/32"],
+    )
+    assert collapse_cidrs(cidrs).ipv4_cidrs == ["198.27.128.0/20", "199.27.128.0/21"]
+    mock_info.assert_called_once_with(
+        "Collapsed 4 Cloudflare ranges into 3 (1 entries saved)"
+    )
@@ -0,0 +1,47 @@
+"""Tests for the run deadline."""
+
+from __future__ import annotations
+
+from unittest.mock import MagicMock, patch
+
+from cf_ips_to_hcloud_fw.deadline import MIN_REQUEST_TIMEOUT, Deadline
+
+TIMEOUT = (5.0, 30.0)
+DEADLINE = 60
+LEFT = 10.0
+
+
+@patch("cf_ips_to_hcloud_fw.deadline.time.monotonic")
+def test_deadline_counts_down(mock_monotonic: MagicMock) -> None:
+    """The time left shrinks with the clock and goes negative once it passes."""
+    mock_monotonic.return_value = 100.0
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert deadline.allows(1e9)
+
+    deadline.start(DEADLINE)
+    mock_monotonic.return_value = 100.0 + DEADLINE - LEFT
+    assert deadline.remaining() == LEFT
+    assert deadline.allows(LEFT - 1)
+    assert not deadline.allows(LEFT)
+
+    mock_monotonic.return_value = 100.0 + DEADLINE + 1
+    assert deadline.remaining() == -1
+
+    deadline.start(None)
+    assert deadline.remaining() is None
+
+
+@patch("cf_ips_to_hcloud_fw.deadline.time.monotonic")
+def test_deadline_clamps_timeouts(mock_monotonic: MagicMock) -> None:
+    """Timeouts end by the deadline but never drop below the floor."""
+    mock_monotonic.return_value = 0.0
+    deadline = Deadline()
+    assert deadline.clamp(TIMEOUT) == TIMEOUT
+
+    deadline.start(DEADLINE)
+    assert deadline.clamp(TIMEOUT) == TIMEOUT
+    mock_monotonic.return_value = DEADLINE - LEFT
+    assert deadline.clamp(TIMEOUT) == (5.0, LEFT)
+    mock_monotonic.return_value = DEADLINE + 1
+    assert deadline.clamp(TIMEOUT) == (MIN_REQUEST_TIMEOUT, MIN_REQUEST_TIMEOUT)
@@ -2,29 +2,47 @@
 
 from __future__ import annotations
 
+from copy import deepcopy
 from unittest.mock import MagicMock, call, patch
 
 import pytest
 import requests
 from hcloud import APIException
-from hcloud.actions import ActionFailedException, ActionTimeoutException
 from hcloud.firewalls.domain import Firewall, FirewallRule
 from pydantic import SecretStr
 from requests.exceptions import ConnectionError as RequestsConnectionError
 from requests.exceptions import RequestException
 
+from cf_ips_to_hcloud_fw.deadline import RUN_DEADLINE
 from cf_ips_to_hcloud_fw.firewall import (
     CF_ALL,
     CF_IPV4,
     CF_IPV6,
+    MAX_RULE_SOURCES,
+    FirewallPlan,
     IPVersionTargets,
+    PendingRules,
+    ProjectOutcome,
+    RuleChange,
+    apply_cloudflare_rules,
+    apply_project_plan,
     fw_set_rules,
+    make_client,
+    plan_project,
+    summarize_outcomes,
     update_firewall,
     update_firewall_rule,
     update_project,
     update_source_ips,
+    wait_for_actions,
 )
-from cf_ips_to_hcloud_fw.models import CloudflareCIDRs, Project
+from cf_ips_to_hcloud_fw.models import (
+    CloudflareCIDRs,
+    Project,
+    SourceList,
+    cidr_key,
+)
+from cf_ips_to_hcloud_fw.ratelimit import PacedSession
 
 
 @pytest.mark.parametrize(
@@ -41,7 +59,8 @@ def test_update_source_ips(*, ips: list[str], cidrs: list[str], expected: bool)
     """update_source_ips should rewrite rules whenever the CIDR list changes."""
     rule = FirewallRule(FirewallRule.DIRECTION_IN, FirewallRule.PROTOCOL_TCP, ips)
     fw = Firewall(rules=[rule])
-    needs_update = update_source_ips(fw, rule, cidrs, "", project_index=1)
+    desired = SourceList(cidrs, frozenset(map(cidr_key, cidrs)), "IPv4")
+    needs_update = update_source_ips(fw, rule, desired, project_index=1)
     assert needs_update == expected
     assert fw.rules
     assert fw.rules[0].source_ips == cidrs
@@ -52,8 +71,12 @@ def test_update_source_ips_reordered_is_noop() -> None:
     existing = ["127.2/32", "127.1/32"]
     rule = FirewallRule(FirewallRule.DIRECTION_IN, FirewallRule.PROTOCOL_TCP, existing)
     fw = Firewall(rules=[rule])
+    cidrs = ["127.1/32", "127.2/32"]
     needs_update = update_source_ips(
-        fw, rule, ["127.1/32", "127.2/32"], "", project_index=1
+        fw,
+        rule,
+        SourceList(cidrs, frozenset(map(cidr_key, cidrs)), "IPv4"),
+        project_index=1,
     )
     assert needs_update is False
     assert fw.rules
@@ -61,6 +84,47 @@ def test_update_source_ips_reordered_is_noop() -> None:
     assert fw.rules[0].source_ips == existing
 
 
+def test_update_source_ips_respelled_is_noop() -> None:
+    """The same networks spelled differently by Hetzner are not a change."""
+    existing = ["2400:CB00::/32", "2606:4700:0::/32"]
+    rule = FirewallRule(FirewallRule.DIRECTION_IN, FirewallRule.PROTOCOL_TCP, existing)
+    fw = Firewall(rules=[rule])
+    cidrs = ["2400:cb00::/32", "2606:4700::/32"]
+    needs_update = update_source_ips(
+        fw,
+        rule,
+        SourceList(cidrs, frozenset(map(cidr_key, cidrs)), "IPv6"),
+        project_index=1,
+    )
+    assert needs_update is False
+    assert rule.source_ips == existing
+
+
+@patch("logging.debug")
+def test_update_source_ips_logs_delta(mock_logging: MagicMock) -> None:
+    """A changed rule is logged with the CIDRs added to and removed from it."""
+    rule = FirewallRule(
+        FirewallRule.DIRECTION_IN,
+        FirewallRule.PROTOCOL_TCP,
+        ["127.1/32", "127.3/32"],
+        description=CF_IPV4,
+    )
+    fw = Firewall(name="fw-1", rules=[rule])
+    cidrs = ["127.1/32", "127.2/32"]
+
+    update_source_ips(
+        fw,
+        rule,
+        SourceList(cidrs, frozenset(map(cidr_key, cidrs)), "IPv4"),
+        project_index=1,
+    )
+
+    mock_logging.assert_called_once_with(
+        f"Updating 'fw-1'/{CF_IPV4!r} in project 1 with IPv4 addresses: "
+        "added ['127.2/32'], removed ['127.3/32']"
+    )
+
+
 @pytest.mark.parametrize(
     ("ipv4", "ipv6", "kind"),
     [
@@ -88,7 +152,7 @@ def test_update_firewall_rule(
         else:
             ips = cf_ips.ipv6_cidrs
         mock_update_source_ips.assert_called_once_with(
-            fw, r, ips, kind, project_index=1
+            fw, r, SourceList(ips, frozenset(map(cidr_key, ips)), kind), project_index=1
         )
         # Second update should not change anything
         assert not update_firewall_rule(fw, r, cf_ips, ip_targets, project_index=1)
@@ -260,6 +324,25 @@ def test_update_firewall_already_up_to_date(
     mock_firewalls_set_rules.assert_not_called()
 
 
+def _action(*statuses: str) -> MagicMock:
+    """Build an action whose status advances to the next value on each reload().
+
+    Args:
+        statuses: Status reported after the first, second, ... reload.
+
+    Returns:
+        MagicMock: A stand-in for a running ``BoundAction``.
+    """
+    action = MagicMock(error=None, command="set_rules", id=42, status="running")
+    remaining = iter(statuses)
+
+    def reload() -> None:
+        action.status = next(remaining)
+
+    action.reload.side_effect = reload
+    return action
+
+
 @pytest.mark.parametrize(
     "rules",
     [
@@ -274,15 +357,17 @@ def test_update_firewall_already_up_to_date(
 )
 @patch("cf_ips_to_hcloud_fw.firewall.Client")
 def test_fw_set_rules(mock_client: MagicMock, *, rules: list[FirewallRule]) -> None:
-    """fw_set_rules forwards the rules and waits for every returned action."""
+    """fw_set_rules forwards the rules and hands back the actions unawaited."""
     expected = rules or []
     fw = Firewall(name="fw-1", rules=rules)
     action1, action2 = MagicMock(), MagicMock()
     mock_client.firewalls.set_rules.return_value = [action1, action2]
-    assert fw_set_rules(mock_client, fw, 1) is True
+    assert fw_set_rules(mock_client, fw, 1) == [action1, action2]
     mock_client.firewalls.set_rules.assert_called_once_with(fw, expected)
-    action1.wait_until_finished.assert_called_once_with()
-    action2.wait_until_finished.assert_called_once_with()
+    # Waiting is left to wait_for_actions, which polls every firewall at once.
+    action1.reload.assert_not_called()
+    action1.wait_until_finished.assert_not_called()
+    action2.wait_until_finished.assert_not_called()
 
 
 @patch("cf_ips_to_hcloud_fw.firewall.Client")
@@ -293,7 +378,7 @@ def test_fw_set_rules_fail(mock_logging: MagicMock, mock_client: MagicMock) -> N
     mock_client.firewalls.set_rules.side_effect = APIException(
         "Test exception", "Message", "Details"
     )
-    assert fw_set_rules(mock_client, fw, 1) is False
+    assert fw_set_rules(mock_client, fw, 1) is None
     mock_client.firewalls.set_rules.assert_called_once_with(fw, [])
     mock_logging.assert_called_once_with(
         "hcloud/firewall.set_rules failed for 'fw-1' in project 1: "
@@ -301,31 +386,117 @@ def test_fw_set_rules_fail(mock_logging: MagicMock, mock_client: MagicMock) -> N
     )
 
 
-@pytest.mark.parametrize(
-    "exc_cls",
-    [ActionFailedException, ActionTimeoutException],
-)
-@patch("cf_ips_to_hcloud_fw.firewall.Client")
+@patch("cf_ips_to_hcloud_fw.firewall.time.sleep")
+def test_wait_for_actions_shares_one_poll_loop(mock_sleep: MagicMock) -> None:
+    """Actions of several firewalls are polled together, sleeping once per round."""
+    slow = _action("running", "running", "success")
+    fast = _action("success")
+    pending = [
+        PendingRules("project 1:'fw-1'", Firewall(name="fw-1"), [slow]),
+        PendingRules("project 1:'fw-2'", Firewall(name="fw-2"), [fast]),
+    ]
+
+    assert wait_for_actions(pending, project_index=1) == []
+
+    assert slow.reload.call_count == len(["running", "running", "success"])
+    # A finished action is not polled again in later rounds.
+    fast.reload.assert_called_once_with()
+    # Two rounds ended with work left: the sleep is per round, not per firewall.
+    assert mock_sleep.call_count == slow.reload.call_count - 1
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.time.sleep", MagicMock())
+@patch("cf_ips_to_hcloud_fw.firewall.record_timing")
+def test_wait_for_actions_times_each_firewall(mock_record: MagicMock) -> None:
+    """Each firewall's wait is timed once, when it succeeds or fails."""
+    pending = [
+        PendingRules("project 1:'fw-1'", Firewall(name="fw-1"), [_action("error")]),
+        PendingRules(
+            "project 1:'fw-2'", Firewall(name="fw-2"), [_action("running", "success")]
+        ),
+    ]
+    wait_for_actions(pending, project_index=1)
+    assert [c.args[0] for c in mock_record.call_args_list] == ["wait_actions"] * 2
+    assert [c.args[2] for c in mock_record.call_args_list] == [
+        "project 1:'fw-1'",
+        "project 1:'fw-2'",
+    ]
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.time.sleep", MagicMock())
 @patch("logging.error")
-def test_fw_set_rules_action_fail(
-    mock_logging: MagicMock,
-    mock_client: MagicMock,
-    exc_cls: type[ActionFailedException | ActionTimeoutException],
-) -> None:
-    """An action that fails or times out while waiting reports failure."""
-    fw = Firewall(name="fw-1", rules=[])
-    failed_action = MagicMock(error=None, command="set_rules", id=42)
+def test_wait_for_actions_failed_action(mock_logging: MagicMock) -> None:
+    """An action that finishes with an error fails only its own firewall."""
+    broken = _action("error")
+    broken.error = {"code": "invalid_input", "message": "bad rule", "details": {}}
+    ok = _action("running", "success")
+    pending = [
+        PendingRules("project 1:'fw-1'", Firewall(name="fw-1"), [broken]),
+        PendingRules("project 1:'fw-2'", Firewall(name="fw-2"), [ok]),
+    ]
+
+    assert wait_for_actions(pending, project_index=1) == ["project 1:'fw-1'"]
+
+    mock_logging.assert_called_once_with(
+        "hcloud/firewall.set_rules failed for 'fw-1' in project 1: "
+        "The pending action failed: bad rule (invalid_input, 42)"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.ACTION_POLL_MAX_ROUNDS", 2)
+@patch("cf_ips_to_hcloud_fw.firewall.time.sleep", MagicMock())
+@patch("logging.error")
+def test_wait_for_actions_timeout(mock_logging: MagicMock) -> None:
+    """Actions still running after the poll budget are reported as timed out."""
+    stuck = _action("running", "running")
+    pending = [PendingRules("project 1:'fw-1'", Firewall(name="fw-1"), [stuck])]
+
+    assert wait_for_actions(pending, project_index=1) == ["project 1:'fw-1'"]
+
+    mock_logging.assert_called_once_with(
+        "hcloud/firewall.set_rules failed for 'fw-1' in project 1: "
+        "The pending action timed out (set_rules, 42)"
+    )
+
+
+@patch("logging.error")
+def test_wait_for_actions_reload_fail(mock_logging: MagicMock) -> None:
+    """A transport error while polling fails that firewall, not the run."""
     action = MagicMock()
-    action.wait_until_finished.side_effect = exc_cls(action=failed_action)
-    mock_client.firewalls.set_rules.return_value = [action]
-    assert fw_set_rules(mock_client, fw, 1) is False
-    action.wait_until_finished.assert_called_once_with()
-    mock_logging.assert_called_once()
-    assert mock_logging.call_args.args[0].startswith(
+    action.reload.side_effect = RequestsConnectionError("boom")
+    pending = [PendingRules("project 1:'fw-1'", Firewall(name="fw-1"), [action])]
+
+    assert wait_for_actions(pending, project_index=1) == ["project 1:'fw-1'"]
+
+    mock_logging.assert_called_once_with(
+        "hcloud/firewall.set_rules failed for 'fw-1' in project 1: boom"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.time.sleep")
+@patch("logging.error")
+def test_wait_for_actions_stops_at_the_deadline(
+    mock_logging: MagicMock, mock_sleep: MagicMock
+) -> None:
+    """Actions still running when the deadline is near are given up on."""
+    RUN_DEADLINE.start(0)
+    stuck = _action("running", "running")
+    pending = [PendingRules("project 1:'fw-1'", Firewall(name="fw-1"), [stuck])]
+
+    assert wait_for_actions(pending, project_index=1) == ["project 1:'fw-1'"]
+
+    mock_sleep.assert_not_called()
+    mock_logging.assert_called_once_with(
         "hcloud/firewall.set_rules failed for 'fw-1' in project 1: "
+        "The pending action timed out (set_rules, 42)"
     )
 
 
+def test_wait_for_actions_nothing_pending() -> None:
+    """With nothing submitted there is nothing to poll."""
+    assert wait_for_actions([], project_index=1) == []
+
+
 @patch("cf_ips_to_hcloud_fw.firewall.Client")
 @patch("logging.error")
 def test_fw_set_rules_transport_fail(
@@ -334,7 +505,7 @@ def test_fw_set_rules_transport_fail(
     """A transport error (e.g. connection failure) reports failure, not a crash."""
     fw = Firewall(name="fw-1", rules=[])
     mock_client.firewalls.set_rules.side_effect = RequestsConnectionError("boom")
-    assert fw_set_rules(mock_client, fw, 1) is False
+    assert fw_set_rules(mock_client, fw, 1) is None
     mock_client.firewalls.set_rules.assert_called_once_with(fw, [])
     # Connection detail is preserved: only InvalidHeader quotes the header
     # back, so blanking every transport error would cost real diagnostics.
@@ -359,6 +530,422 @@ def test_update_firewall_no_rules(
     mock_firewalls_set_rules.assert_not_called()
 
 
+SPLIT_CIDRS = CloudflareCIDRs(
+    ipv4_cidrs=["192.0.2.0/24", "198.51.100.0/24", "203.0.113.0/24"],
+    ipv6_cidrs=["2001:db8::/32"],
+)
+
+
+def _tcp_rule(description: str, source_ips: list[str]) -> FirewallRule:
+    """Build an inbound TCP/443 rule.
+
+    Args:
+        description: Rule description, possibly carrying a marker.
+        source_ips: Current source CIDRs.
+
+    Returns:
+        FirewallRule: The rule.
+    """
+    return FirewallRule(
+        FirewallRule.DIRECTION_IN,
+        FirewallRule.PROTOCOL_TCP,
+        source_ips=source_ips,
+        port="443",
+        description=description,
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.fw_set_rules")
+def test_update_firewall_splits_oversized_rules(
+    mock_firewalls_set_rules: MagicMock,
+) -> None:
+    """Ranges beyond the limit move to numbered rules right after their rule."""
+    ssh = _tcp_rule("ssh", ["203.0.113.7/32"])
+    fw = Firewall(name="fw-1", rules=[_tcp_rule(f"web {CF_ALL}", []), ssh])
+
+    update_firewall(MagicMock(), fw, SPLIT_CIDRS, project_index=1, max_sources=2)
+
+    assert [(r.description, r.source_ips, r.port) for r in fw.rules or []] == [
+        (f"web {CF_ALL}", ["192.0.2.0/24", "198.51.100.0/24"], "443"),
+        ("web __CLOUDFLARE_IPS_2__", ["203.0.113.0/24", "2001:db8::/32"], "443"),
+        ("ssh", ["203.0.113.7/32"], "443"),
+    ]
+    mock_firewalls_set_rules.assert_called_once()
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.fw_set_rules")
+def test_update_firewall_split_rules_are_a_noop(
+    mock_firewalls_set_rules: MagicMock,
+) -> None:
+    """An existing split is recognised whatever order Hetzner returns it in."""
+    fw = Firewall(
+        name="fw-1",
+        rules=[
+            _tcp_rule(CF_IPV4, ["198.51.100.0/24", "192.0.2.0/24"]),
+            _tcp_rule("__CLOUDFLARE_IPS_V4_2__", ["203.0.113.0/24"]),
+        ],
+    )
+
+    update_firewall(MagicMock(), fw, SPLIT_CIDRS, project_index=1, max_sources=2)
+
+    mock_firewalls_set_rules.assert_not_called()
+
+
+def test_split_rules_with_the_same_marker_keep_their_own_overflow() -> None:
+    """Two marked rules on different ports each fold back only their overflow."""
+    http = _tcp_rule(CF_ALL, [])
+    http.port = "80"
+    fw = Firewall(name="fw-1", rules=[_tcp_rule(CF_ALL, []), http])
+    assert apply_cloudflare_rules(fw, SPLIT_CIDRS, project_index=1, max_sources=2)
+    split = [(r.description, r.source_ips, r.port) for r in fw.rules or []]
+    assert [port for _, _, port in split] == ["443", "443", "80", "80"]
+
+    # Hetzner hands the same rules back unchanged.
+    fw = Firewall(name="fw-1", rules=deepcopy(fw.rules))
+    assert not apply_cloudflare_rules(fw, SPLIT_CIDRS, project_index=1, max_sources=2)
+    assert [(r.description, r.source_ips, r.port) for r in fw.rules or []] == split
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.fw_set_rules")
+def test_update_firewall_leaves_outbound_overflow_rules(
+    mock_firewalls_set_rules: MagicMock,
+) -> None:
+    """A numbered marker on an outbound rule is not ours to fold or delete."""
+    outbound = FirewallRule(
+        FirewallRule.DIRECTION_OUT,
+        FirewallRule.PROTOCOL_TCP,
+        destination_ips=["192.0.2.0/24"],
+        port="443",
+        description="__CLOUDFLARE_IPS_2__",
+    )
+    fw = Firewall(
+        name="fw-1",
+        rules=[_tcp_rule(CF_IPV4, SPLIT_CIDRS.ipv4_cidrs), outbound],
+    )
+
+    update_firewall(MagicMock(), fw, SPLIT_CIDRS, project_index=1)
+
+    assert fw.rules == [_tcp_rule(CF_IPV4, SPLIT_CIDRS.ipv4_cidrs), outbound]
+    mock_firewalls_set_rules.assert_not_called()
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.fw_set_rules")
+def test_update_firewall_drops_unneeded_overflow_rules(
+    mock_firewalls_set_rules: MagicMock,
+) -> None:
+    """A raised limit folds overflow back; orphaned overflow rules are deleted."""
+    fw = Firewall(
+        name="fw-1",
+        rules=[
+            _tcp_rule(CF_IPV4, ["192.0.2.0/24", "198.51.100.0/24"]),
+            _tcp_rule("__CLOUDFLARE_IPS_V4_2__", ["203.0.113.0/24"]),
+            _tcp_rule("__CLOUDFLARE_IPS_V6_2__", ["2001:db8::/32"]),
+        ],
+    )
+
+    update_firewall(
+        MagicMock(), fw, SPLIT_CIDRS, project_index=1, max_sources=MAX_RULE_SOURCES
+    )
+
+    assert [(r.description, r.source_ips) for r in fw.rules or []] == [
+        (CF_IPV4, SPLIT_CIDRS.ipv4_cidrs),
+    ]
+    mock_firewalls_set_rules.assert_called_once()
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.fw_set_rules")
+def test_update_firewall_shares_desired_lists(
+    mock_firewalls_set_rules: MagicMock,
+) -> None:
+    """Every rule with the same marker gets the one list built for the run."""
+    fws = [
+        Firewall(name=f"fw-{i}", rules=[_tcp_rule(CF_ALL, []), _tcp_rule(CF_ALL, [])])
+        for i in range(1, 3)
+    ]
+    cf_ips = CloudflareCIDRs(ipv4_cidrs=["127.1/32"], ipv6_cidrs=["::1/64"])
+
+    for fw in fws:
+        update_firewall(MagicMock(), fw, cf_ips, project_index=1)
+
+    lists = [rule.source_ips for fw in fws for rule in fw.rules or []]
+    assert lists[0] == ["127.1/32", "::1/64"]
+    assert all(cidrs is lists[0] for cidrs in lists)
+    assert mock_firewalls_set_rules.call_count == len(fws)
+
+
+@pytest.mark.parametrize(
+    ("actions", "counted"),
+    [
+        pytest.param([], [call(amount=1)], id="written"),
+        pytest.param(None, [], id="set-rules-failed"),
+    ],
+)
+@patch("cf_ips_to_hcloud_fw.firewall.RULES_CHANGED")
+@patch("cf_ips_to_hcloud_fw.firewall.fw_set_rules")
+def test_update_firewall_counts_changed_rules_once_written(
+    mock_firewalls_set_rules: MagicMock,
+    mock_rules_changed: MagicMock,
+    actions: list[MagicMock] | None,
+    counted: list[object],
+) -> None:
+    """Only rules a successful set_rules rewrote count as changed."""
+    mock_firewalls_set_rules.return_value = actions
+    fw = Firewall(
+        name="fw-1",
+        rules=[
+            _tcp_rule(CF_IPV4, []),
+            _tcp_rule(CF_IPV6, SPLIT_CIDRS.ipv6_cidrs),
+        ],
+    )
+
+    assert update_firewall(MagicMock(), fw, SPLIT_CIDRS, project_index=1) == actions
+
+    assert mock_rules_changed.inc.call_args_list == counted
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.RULES_CHANGED")
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+def test_plan_project_counts_no_changed_rules(
+    mock_client: MagicMock, mock_rules_changed: MagicMock
+) -> None:
+    """A plan writes nothing, so it changes no rules."""
+    mock_client.return_value.firewalls.get_by_name.return_value = Firewall(
+        1, "fw-1", rules=[_tcp_rule(CF_ALL, [])]
+    )
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    plan = plan_project(project=project, cf_cidrs=SPLIT_CIDRS, project_index=1)
+
+    assert plan.firewalls[0].needs_update
+    mock_rules_changed.inc.assert_not_called()
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+def test_plan_project_reports_changes_without_writing(mock_client: MagicMock) -> None:
+    """Planning records every marked rule's delta and never calls set_rules."""
+    fw1 = Firewall(
+        1,
+        "fw-1",
+        rules=[
+            _tcp_rule(CF_IPV4, ["192.0.2.0/24", "198.51.100.0/24"]),
+            _tcp_rule("__CLOUDFLARE_IPS_V4_2__", ["203.0.113.0/24"]),
+            _tcp_rule("ssh", ["203.0.113.7/32"]),
+        ],
+    )
+    fw2 = Firewall(2, "fw-2", rules=[_tcp_rule(CF_IPV6, ["2001:db8::/32"])])
+    mock_client.return_value.firewalls.get_all.return_value = [fw1, fw2]
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2", "fw-3"])
+    cf_ips = CloudflareCIDRs(
+        ipv4_cidrs=["192.0.2.0/24", "203.0.113.0/24"], ipv6_cidrs=["2001:db8::/32"]
+    )
+
+    plan = plan_project(project=project, cf_cidrs=cf_ips, project_index=1)
+
+    assert plan.index == 1
+    assert plan.outcome == ProjectOutcome(skipped=["project 1:'fw-3'"], failed=[])
+    assert plan.firewalls == [
+        FirewallPlan(
+            name="fw-1",
+            id=1,
+            needs_update=True,
+            rules=[
+                RuleChange(
+                    description=CF_IPV4,
+                    protocol=FirewallRule.PROTOCOL_TCP,
+                    port="443",
+                    current=["192.0.2.0/24", "198.51.100.0/24", "203.0.113.0/24"],
+                    desired=["192.0.2.0/24", "203.0.113.0/24"],
+                    added=[],
+                    removed=["198.51.100.0/24"],
+                )
+            ],
+        ),
+        FirewallPlan(
+            name="fw-2",
+            id=2,
+            needs_update=False,
+            rules=[
+                RuleChange(
+                    description=CF_IPV6,
+                    protocol=FirewallRule.PROTOCOL_TCP,
+                    port="443",
+                    current=["2001:db8::/32"],
+                    desired=["2001:db8::/32"],
+                    added=[],
+                    removed=[],
+                )
+            ],
+        ),
+    ]
+    mock_client.return_value.firewalls.set_rules.assert_not_called()
+    mock_client.return_value.actions.get_by_id.assert_not_called()
+
+
+def _planned(
+    name: str, current: list[str], *, needs_update: bool = True
+) -> FirewallPlan:
+    """Build a plan entry for a firewall with one CF_IPV4 rule.
+
+    Args:
+        name: Firewall name.
+        current: CIDRs the plan saw on the rule.
+        needs_update: Whether the plan wants the firewall written.
+
+    Returns:
+        FirewallPlan: The plan entry.
+    """
+    change = RuleChange(CF_IPV4, FirewallRule.PROTOCOL_TCP, "443", current, [], [], [])
+    return FirewallPlan(name, 1, needs_update, [change])
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+@patch("cf_ips_to_hcloud_fw.firewall.wait_for_actions")
+@patch("logging.error")
+def test_apply_project_plan_checks_each_firewall_first(
+    mock_logging: MagicMock, mock_wait_for_actions: MagicMock, mock_client: MagicMock
+) -> None:
+    """Only firewalls still as planned are written; the others are reported."""
+    cf_ips = CloudflareCIDRs(ipv4_cidrs=["192.0.2.0/24"], ipv6_cidrs=["2001:db8::/32"])
+    live = {
+        "fw-ok": Firewall(1, "fw-ok", rules=[_tcp_rule(CF_IPV4, ["198.51.100.0/24"])]),
+        "fw-stale": Firewall(
+            2, "fw-stale", rules=[_tcp_rule(CF_IPV4, ["203.0.113.0/24"])]
+        ),
+        "fw-done": Firewall(3, "fw-done", rules=[_tcp_rule(CF_IPV4, ["192.0.2.0/24"])]),
+        "fw-gone": None,
+    }
+
+    def get_by_name(name: str) -> Firewall | None:
+        if name == "fw-down":
+            raise APIException(code=500, message="down", details=None)
+        return live[name]
+
+    client = mock_client.return_value
+    client.firewalls.get_by_name.side_effect = get_by_name
+    action = MagicMock()
+    client.firewalls.set_rules.return_value = [action]
+    mock_wait_for_actions.return_value = []
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-ok"])
+    firewalls = [
+        _planned("fw-ok", ["198.51.100.0/24"]),
+        _planned("fw-stale", ["198.51.100.0/24"]),
+        _planned("fw-done", ["192.0.2.0/24"], needs_update=False),
+        _planned("fw-gone", ["198.51.100.0/24"]),
+        _planned("fw-down", ["198.51.100.0/24"]),
+    ]
+
+    outcome = apply_project_plan(
+        project=project, firewalls=firewalls, cf_cidrs=cf_ips, project_index=1
+    )
+
+    assert outcome == ProjectOutcome(
+        skipped=["project 1:'fw-gone'"],
+        failed=["project 1:'fw-stale'", "project 1:'fw-down'"],
+    )
+    # fw-done needed nothing, so it was not even looked up.
+    assert "fw-done" not in [c.args[0] for c in client.firewalls.get_by_name.mock_calls]
+    client.firewalls.set_rules.assert_called_once()
+    assert client.firewalls.set_rules.call_args.args[0] is live["fw-ok"]
+    pending = mock_wait_for_actions.call_args.args[0]
+    assert [p.label for p in pending] == ["project 1:'fw-ok'"]
+    mock_logging.assert_any_call(
+        "hcloud firewall 'fw-stale' in project 1 changed since the plan was made "
+        "- not updating it"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+def test_apply_project_plan_skips_firewalls_fixed_meanwhile(
+    mock_client: MagicMock,
+) -> None:
+    """A firewall that matches the plan but needs nothing any more is not written."""
+    cf_ips = CloudflareCIDRs(ipv4_cidrs=["192.0.2.0/24"], ipv6_cidrs=["2001:db8::/32"])
+    fw = Firewall(1, "fw-1", rules=[_tcp_rule(CF_IPV4, ["192.0.2.0/24"])])
+    mock_client.return_value.firewalls.get_by_name.return_value = fw
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    outcome = apply_project_plan(
+        project=project,
+        firewalls=[_planned("fw-1", ["192.0.2.0/24"])],
+        cf_cidrs=cf_ips,
+        project_index=1,
+    )
+
+    assert outcome == ProjectOutcome(skipped=[], failed=[])
+    mock_client.return_value.firewalls.set_rules.assert_not_called()
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+@patch("logging.warning")
+def test_apply_project_plan_stops_at_the_deadline(
+    mock_warning: MagicMock, mock_client: MagicMock
+) -> None:
+    """With the deadline near, planned firewalls are reported as untouched."""
+    RUN_DEADLINE.start(0)
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"])
+
+    outcome = apply_project_plan(
+        project=project,
+        firewalls=[_planned("fw-1", []), _planned("fw-2", [])],
+        cf_cidrs=CloudflareCIDRs(ipv4_cidrs=["192.0.2.0/24"], ipv6_cidrs=[]),
+        project_index=1,
+    )
+
+    assert outcome == ProjectOutcome(
+        [], [], untouched=("project 1:'fw-1'", "project 1:'fw-2'")
+    )
+    mock_client.return_value.firewalls.get_by_name.assert_not_called()
+    mock_warning.assert_called_once_with(
+        "Deadline near - not starting 2 more firewall(s) in project 1"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+@patch("cf_ips_to_hcloud_fw.firewall.fw_set_rules", return_value=None)
+def test_apply_project_plan_set_rules_fail_recorded(
+    mock_fw_set_rules: MagicMock, mock_client: MagicMock
+) -> None:
+    """A firewall whose push fails is recorded as failed."""
+    cf_ips = CloudflareCIDRs(ipv4_cidrs=["192.0.2.0/24"], ipv6_cidrs=["2001:db8::/32"])
+    fw = Firewall(1, "fw-1", rules=[_tcp_rule(CF_IPV4, [])])
+    mock_client.return_value.firewalls.get_by_name.return_value = fw
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    outcome = apply_project_plan(
+        project=project,
+        firewalls=[_planned("fw-1", [])],
+        cf_cidrs=cf_ips,
+        project_index=1,
+    )
+
+    assert outcome == ProjectOutcome(skipped=[], failed=["project 1:'fw-1'"])
+    mock_fw_set_rules.assert_called_once_with(
+        mock_client.return_value, fw, project_index=1
+    )
+
+
+def test_make_client_paces_requests() -> None:
+    """Clients send their requests through the rate-limit-aware session."""
+    with patch("requests.Session.close", autospec=True) as mock_close:
+        client = make_client(Project(token=SecretStr("token-1"), firewalls=["fw-1"]))
+    assert isinstance(client._client._session, PacedSession)
+    # The session the SDK built is closed, not orphaned.
+    [(replaced,)] = [c.args for c in mock_close.call_args_list]
+    assert replaced is not client._client._session
+    # The session retries; the SDK retrying as well would multiply attempts.
+    assert client._client._retry_max_retries == 0
+
+
+def test_make_client_shares_one_session() -> None:
+    """Clients of different tokens reuse one connection pool."""
+    clients = [
+        make_client(Project(token=SecretStr(f"token-{i}"), firewalls=["fw-1"]))
+        for i in range(1, 3)
+    ]
+    assert clients[0]._client._session is clients[1]._client._session
+    assert clients[0]._client._headers != clients[1]._client._headers
+
+
 @patch("cf_ips_to_hcloud_fw.firewall.Client")
 @patch("cf_ips_to_hcloud_fw.firewall.update_firewall")
 def test_update_project_found(
@@ -370,13 +957,17 @@ def test_update_project_found(
     mock_client.return_value.firewalls.get_by_name.return_value = fw
     project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
     outcome = update_project(project=project, cf_cidrs=cf_ips, project_index=1)
-    assert outcome == ([], [])
+    assert outcome == ProjectOutcome([], [])
     # A bounded timeout is passed so a hung API call cannot stall the run.
     _, kwargs = mock_client.call_args
     assert kwargs["timeout"] == (5.0, 30.0)
     mock_client.return_value.firewalls.get_by_name.assert_called_once_with("fw-1")
     mock_update_firewall.assert_called_once_with(
-        mock_client.return_value, fw, cf_ips, project_index=1
+        mock_client.return_value,
+        fw,
+        cf_ips,
+        project_index=1,
+        max_sources=MAX_RULE_SOURCES,
     )
 
 
@@ -394,7 +985,7 @@ def test_update_project_not_found(
         cf_cidrs=CloudflareCIDRs(ipv4_cidrs=["127.1/32"], ipv6_cidrs=["::1/64"]),
         project_index=1,
     )
-    assert outcome == (["project 1:'fw-1'"], [])
+    assert outcome == ProjectOutcome(["project 1:'fw-1'"], [])
     mock_client.return_value.firewalls.get_by_name.assert_called_once_with("fw-1")
     mock_update_firewall.assert_not_called()
     mock_logging.assert_called_once_with(
@@ -420,7 +1011,7 @@ def test_update_project_not_found_with_special_name(
 
     # Expect the repr() of the name to be used in the skipped entry and log
     expected = f"project 1:{name!r}"
-    assert outcome == ([expected], [])
+    assert outcome == ProjectOutcome([expected], [])
     mock_client.return_value.firewalls.get_by_name.assert_called_once_with(name)
     mock_update_firewall.assert_not_called()
     mock_logging.assert_called_once_with(
@@ -429,7 +1020,7 @@ def test_update_project_not_found_with_special_name(
 
 
 @patch("cf_ips_to_hcloud_fw.firewall.Client")
-@patch("cf_ips_to_hcloud_fw.firewall.update_firewall", return_value=True)
+@patch("cf_ips_to_hcloud_fw.firewall.update_firewall", return_value=[])
 @patch("logging.error")
 def test_update_project_fail_continues(
     mock_logging: MagicMock,
@@ -438,6 +1029,10 @@ def test_update_project_fail_continues(
 ) -> None:
     """A get_by_name failure is recorded but the next firewall is still synced."""
     fw2 = Firewall(2, "fw-2")
+    # The listing fails too, so each name falls back to its own lookup.
+    mock_client.return_value.firewalls.get_all.side_effect = RequestsConnectionError(
+        "listing down"
+    )
     # fw-1 errors against the API; fw-2 must still be inspected afterwards.
     mock_client.return_value.firewalls.get_by_name.side_effect = [
         APIException("Test exception", "Message", "Details"),
@@ -448,14 +1043,18 @@ def test_update_project_fail_continues(
 
     outcome = update_project(project=project, cf_cidrs=cf_ips, project_index=1)
 
-    assert outcome == ([], ["project 1:'fw-1'"])
+    assert outcome == ProjectOutcome([], ["project 1:'fw-1'"])
     # Both firewalls were attempted despite fw-1 failing.
     mock_client.return_value.firewalls.get_by_name.assert_has_calls([
         call("fw-1"),
         call("fw-2"),
     ])
     mock_update_firewall.assert_called_once_with(
-        mock_client.return_value, fw2, cf_ips, project_index=1
+        mock_client.return_value,
+        fw2,
+        cf_ips,
+        project_index=1,
+        max_sources=MAX_RULE_SOURCES,
     )
     mock_logging.assert_called_once_with(
         "hcloud/firewalls.get_by_name failed for 'fw-1' in project 1: "
@@ -464,7 +1063,7 @@ def test_update_project_fail_continues(
 
 
 @patch("cf_ips_to_hcloud_fw.firewall.Client")
-@patch("cf_ips_to_hcloud_fw.firewall.update_firewall", return_value=True)
+@patch("cf_ips_to_hcloud_fw.firewall.update_firewall", return_value=[])
 @patch("logging.error")
 def test_update_project_transport_fail_continues(
     mock_logging: MagicMock,
@@ -473,6 +1072,9 @@ def test_update_project_transport_fail_continues(
 ) -> None:
     """A transport error on get_by_name is recorded and the next firewall runs."""
     fw2 = Firewall(2, "fw-2")
+    mock_client.return_value.firewalls.get_all.side_effect = RequestsConnectionError(
+        "listing down"
+    )
     # fw-1 fails at the transport layer (no APIException); fw-2 must still sync.
     mock_client.return_value.firewalls.get_by_name.side_effect = [
         RequestsConnectionError("boom"),
@@ -483,13 +1085,17 @@ def test_update_project_transport_fail_continues(
 
     outcome = update_project(project=project, cf_cidrs=cf_ips, project_index=1)
 
-    assert outcome == ([], ["project 1:'fw-1'"])
+    assert outcome == ProjectOutcome([], ["project 1:'fw-1'"])
     mock_client.return_value.firewalls.get_by_name.assert_has_calls([
         call("fw-1"),
         call("fw-2"),
     ])
     mock_update_firewall.assert_called_once_with(
-        mock_client.return_value, fw2, cf_ips, project_index=1
+        mock_client.return_value,
+        fw2,
+        cf_ips,
+        project_index=1,
+        max_sources=MAX_RULE_SOURCES,
     )
     mock_logging.assert_called_once_with(
         "hcloud/firewalls.get_by_name failed for 'fw-1' in project 1: boom"
@@ -497,7 +1103,75 @@ def test_update_project_transport_fail_continues(
 
 
 @patch("cf_ips_to_hcloud_fw.firewall.Client")
-@patch("cf_ips_to_hcloud_fw.firewall.update_firewall", return_value=False)
+@patch("cf_ips_to_hcloud_fw.firewall.update_firewall", return_value=[])
+def test_update_project_resolves_names_from_one_listing(
+    mock_update_firewall: MagicMock, mock_client: MagicMock
+) -> None:
+    """Several names are resolved from a single listing, not one GET each."""
+    fw1, fw3 = Firewall(1, "fw-1"), Firewall(3, "fw-3")
+    mock_client.return_value.firewalls.get_all.return_value = [
+        fw1,
+        Firewall(2, "unrelated"),
+        fw3,
+    ]
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2", "fw-3"])
+    cf_ips = CloudflareCIDRs(ipv4_cidrs=["127.1/32"], ipv6_cidrs=["::1/64"])
+
+    outcome = update_project(project=project, cf_cidrs=cf_ips, project_index=1)
+
+    # A name missing from the listing keeps today's not-found semantics.
+    assert outcome == ProjectOutcome(["project 1:'fw-2'"], [])
+    mock_client.return_value.firewalls.get_all.assert_called_once_with()
+    mock_client.return_value.firewalls.get_by_name.assert_not_called()
+    mock_update_firewall.assert_has_calls([
+        call(
+            mock_client.return_value,
+            fw1,
+            cf_ips,
+            project_index=1,
+            max_sources=MAX_RULE_SOURCES,
+        ),
+        call(
+            mock_client.return_value,
+            fw3,
+            cf_ips,
+            project_index=1,
+            max_sources=MAX_RULE_SOURCES,
+        ),
+    ])
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+@patch("cf_ips_to_hcloud_fw.firewall.update_firewall", return_value=[])
+@patch("logging.warning")
+def test_update_project_listing_failure_falls_back_to_get_by_name(
+    mock_logging: MagicMock, mock_update_firewall: MagicMock, mock_client: MagicMock
+) -> None:
+    """A failed listing is a warning; every name is then looked up on its own."""
+    fw1, fw2 = Firewall(1, "fw-1"), Firewall(2, "fw-2")
+    mock_client.return_value.firewalls.get_all.side_effect = APIException(
+        "Test exception", "Message", "Details"
+    )
+    mock_client.return_value.firewalls.get_by_name.side_effect = [fw1, fw2]
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"])
+    cf_ips = CloudflareCIDRs(ipv4_cidrs=["127.1/32"], ipv6_cidrs=["::1/64"])
+
+    outcome = update_project(project=project, cf_cidrs=cf_ips, project_index=1)
+
+    assert outcome == ProjectOutcome([], [])
+    mock_client.return_value.firewalls.get_by_name.assert_has_calls([
+        call("fw-1"),
+        call("fw-2"),
+    ])
+    assert mock_update_firewall.call_count == len(project.firewalls)
+    mock_logging.assert_called_once_with(
+        "hcloud/firewalls.get_all failed in project 1, falling back to per-name "
+        "lookups: Message (Test exception)"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+@patch("cf_ips_to_hcloud_fw.firewall.update_firewall", return_value=None)
 def test_update_project_set_rules_fail_recorded(
     mock_update_firewall: MagicMock, mock_client: MagicMock
 ) -> None:
@@ -509,9 +1183,112 @@ def test_update_project_set_rules_fail_recorded(
 
     outcome = update_project(project=project, cf_cidrs=cf_ips, project_index=1)
 
-    assert outcome == ([], ["project 1:'fw-1'"])
+    assert outcome == ProjectOutcome([], ["project 1:'fw-1'"])
     mock_update_firewall.assert_called_once_with(
-        mock_client.return_value, fw, cf_ips, project_index=1
+        mock_client.return_value,
+        fw,
+        cf_ips,
+        project_index=1,
+        max_sources=MAX_RULE_SOURCES,
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+@patch("logging.warning")
+def test_update_project_out_of_time(
+    mock_warning: MagicMock, mock_client: MagicMock
+) -> None:
+    """With the deadline near a project isn't started at all."""
+    RUN_DEADLINE.start(0)
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"])
+
+    outcome = update_project(
+        project=project,
+        cf_cidrs=CloudflareCIDRs(ipv4_cidrs=["127.1/32"], ipv6_cidrs=["::1/64"]),
+        project_index=1,
+    )
+
+    assert outcome == ProjectOutcome(
+        [], [], untouched=("project 1:'fw-1'", "project 1:'fw-2'")
+    )
+    mock_client.assert_not_called()
+    mock_warning.assert_called_once_with("Deadline near - not starting project 1")
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.RUN_DEADLINE")
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+@patch("cf_ips_to_hcloud_fw.firewall.update_firewall", return_value=[])
+@patch("logging.warning")
+def test_update_project_deadline_reached_midway(
+    mock_warning: MagicMock,
+    mock_update_firewall: MagicMock,
+    mock_client: MagicMock,
+    mock_deadline: MagicMock,
+) -> None:
+    """Firewalls after the deadline came near are left alone and reported."""
+    # The project and fw-1 start in time; fw-2 and fw-3 don't.
+    mock_deadline.allows.side_effect = [True, True, False, False]
+    mock_client.return_value.firewalls.get_all.return_value = [
+        Firewall(i, f"fw-{i}") for i in range(1, 4)
+    ]
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2", "fw-3"])
+
+    outcome = update_project(
+        project=project,
+        cf_cidrs=CloudflareCIDRs(ipv4_cidrs=["127.1/32"], ipv6_cidrs=["::1/64"]),
+        project_index=1,
+    )
+
+    assert outcome == ProjectOutcome(
+        [], [], untouched=("project 1:'fw-2'", "project 1:'fw-3'")
+    )
+    mock_update_firewall.assert_called_once()
+    mock_warning.assert_called_once_with(
+        "Deadline near - not starting 2 more firewall(s) in project 1"
+    )
+
+
+def test_summarize_outcomes_lists_untouched_firewalls() -> None:
+    """Firewalls cut off by the deadline get their own part of the summary."""
+    outcomes = [
+        ProjectOutcome(["project 1:'fw-1'"], []),
+        ProjectOutcome([], [], untouched=("project 2:'fw-1'",)),
+    ]
+    assert summarize_outcomes(outcomes) == (
+        "Some firewalls were not updated (not found: project 1:'fw-1'; "
+        "not started before the deadline: project 2:'fw-1')"
+    )
+    assert summarize_outcomes([ProjectOutcome([], [])]) is None
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.Client")
+@patch("cf_ips_to_hcloud_fw.firewall.update_firewall")
+@patch("cf_ips_to_hcloud_fw.firewall.wait_for_actions")
+def test_update_project_awaits_all_actions_after_submitting(
+    mock_wait_for_actions: MagicMock,
+    mock_update_firewall: MagicMock,
+    mock_client: MagicMock,
+) -> None:
+    """Actions are awaited once for the whole project, failures in config order."""
+    fws = [Firewall(i, f"fw-{i}") for i in range(1, 4)]
+    mock_client.return_value.firewalls.get_all.return_value = fws
+    action1, action3 = MagicMock(), MagicMock()
+    # fw-1 and fw-3 changed, fw-2 failed to submit.
+    mock_update_firewall.side_effect = [[action1], None, [action3]]
+    mock_wait_for_actions.return_value = ["project 1:'fw-1'"]
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2", "fw-3"])
+    cf_ips = CloudflareCIDRs(ipv4_cidrs=["127.1/32"], ipv6_cidrs=["::1/64"])
+
+    outcome = update_project(project=project, cf_cidrs=cf_ips, project_index=1)
+
+    # fw-1's action failed after fw-2's submit did, yet it is listed first.
+    assert outcome == ProjectOutcome([], ["project 1:'fw-1'", "project 1:'fw-2'"])
+    mock_wait_for_actions.assert_called_once_with(
+        [
+            PendingRules("project 1:'fw-1'", fws[0], [action1]),
+            PendingRules("project 1:'fw-3'", fws[2], [action3]),
+        ],
+        project_index=1,
     )
 
 
@@ -540,7 +1317,7 @@ def test_transport_error_message_never_reaches_the_log(
 
     fw = Firewall(name="fw-1", rules=[])
     mock_client.firewalls.set_rules.side_effect = excinfo.value
-    assert fw_set_rules(mock_client, fw, 1) is False
+    assert fw_set_rules(mock_client, fw, 1) is None
 
     logged = mock_logging.call_args.args[0]
     assert secret not in logged
@@ -557,5 +1334,5 @@ def test_api_exception_detail_is_preserved(
     mock_client.firewalls.set_rules.side_effect = APIException(
         code="rate_limit_exceeded", message="Too many requests", details=None
     )
-    assert fw_set_rules(mock_client, fw, 1) is False
+    assert fw_set_rules(mock_client, fw, 1) is None
     assert "Too many requests" in mock_logging.call_args.args[0]
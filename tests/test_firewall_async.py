@@ -0,0 +1,714 @@
+"""Tests for the asyncio sync engine."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+from hcloud import APIException
+from hcloud.firewalls.domain import FirewallRule
+from pydantic import SecretStr
+
+from cf_ips_to_hcloud_fw.deadline import MIN_FIREWALL_TIME, RUN_DEADLINE
+from cf_ips_to_hcloud_fw.firewall import (
+    CF_ALL,
+    CF_IPV4,
+    MAX_RULE_SOURCES,
+    ProjectOutcome,
+)
+from cf_ips_to_hcloud_fw.firewall_async import (
+    KeptAliveEngine,
+    _describe_http_error,
+    _read_response,
+    _sync_all,
+    sync_projects_async,
+)
+from cf_ips_to_hcloud_fw.models import CloudflareCIDRs, Project
+from cf_ips_to_hcloud_fw.retry import RETRY_BUDGET
+
+CF_CIDRS = CloudflareCIDRs(
+    ipv4_cidrs=["198.27.128.0/21"], ipv6_cidrs=["2400:cb00::/32"]
+)
+
+
+def _rule(description: str, source_ips: list[str]) -> dict[str, Any]:
+    """Build an inbound TCP rule as the API returns it.
+
+    Args:
+        description: Rule description, possibly carrying a marker.
+        source_ips: Current source CIDRs.
+
+    Returns:
+        dict[str, Any]: The rule payload.
+    """
+    return {
+        "direction": FirewallRule.DIRECTION_IN,
+        "protocol": FirewallRule.PROTOCOL_TCP,
+        "port": "443",
+        "source_ips": source_ips,
+        "destination_ips": [],
+        "description": description,
+    }
+
+
+class FakeHetzner:
+    """In-memory stand-in for the firewalls and actions endpoints."""
+
+    def __init__(self, firewalls: dict[str, list[dict[str, Any]]]) -> None:
+        """Seed the fake with named firewalls.
+
+        Args:
+            firewalls: Rules per firewall name.
+        """
+        self.firewalls: dict[int, dict[str, Any]] = {
+            fw_id: {"id": fw_id, "name": name, "rules": rules}
+            for fw_id, (name, rules) in enumerate(firewalls.items(), start=1)
+        }
+        self.requests: list[httpx.Request] = []
+        self.action_status = ["success"]
+        self.fail: dict[tuple[str, str], httpx.Response] = {}
+        self.per_page_override: int | None = None
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        """Answer one request.
+
+        Args:
+            request: The intercepted request.
+
+        Returns:
+            httpx.Response: The canned response.
+        """
+        self.requests.append(request)
+        path = request.url.path.removeprefix("/v1")
+        key = (request.method, path)
+        if request.url.params.get("name") is not None:
+            key = (request.method, f"{path}?name")
+        if key in self.fail:
+            return self.fail[key]
+        if key == ("GET", "/firewalls?name"):
+            name = request.url.params["name"]
+            found = [fw for fw in self.firewalls.values() if fw["name"] == name]
+            return httpx.Response(200, json={"firewalls": found})
+        if key == ("GET", "/firewalls"):
+            return self._page(request)
+        if request.method == "POST" and path.endswith("/actions/set_rules"):
+            fw_id = int(path.split("/")[2])
+            self.firewalls[fw_id]["rules"] = json.loads(request.content)["rules"]
+            return httpx.Response(200, json={"actions": [self._action(fw_id)]})
+        if request.method == "GET" and path.startswith("/actions/"):
+            status = self.action_status.pop(0) if self.action_status else "success"
+            action = self._action(int(path.split("/")[2]), status)
+            return httpx.Response(200, json={"action": action})
+        return httpx.Response(
+            404, json={"error": {"code": "not_found", "message": "x"}}
+        )
+
+    def _page(self, request: httpx.Request) -> httpx.Response:
+        per_page = self.per_page_override or int(request.url.params["per_page"])
+        page = int(request.url.params["page"])
+        items = list(self.firewalls.values())
+        last_page = max(1, -(-len(items) // per_page))
+        chunk = items[(page - 1) * per_page : page * per_page]
+        meta = {"pagination": {"page": page, "last_page": last_page}}
+        return httpx.Response(200, json={"firewalls": chunk, "meta": meta})
+
+    @staticmethod
+    def _action(action_id: int, status: str = "running") -> dict[str, Any]:
+        error = (
+            {"code": "invalid_input", "message": "bad rule"}
+            if status == "error"
+            else None
+        )
+        return {
+            "id": action_id,
+            "command": "set_rules",
+            "status": status,
+            "error": error,
+        }
+
+    def count(self, method: str, path_part: str) -> int:
+        """Count recorded requests by method and path fragment.
+
+        Args:
+            method: HTTP method.
+            path_part: Substring of the request path.
+
+        Returns:
+            int: Number of matching requests.
+        """
+        return sum(
+            1
+            for r in self.requests
+            if r.method == method and path_part in str(r.url.path)
+        )
+
+
+def _run(
+    fake: FakeHetzner, projects: list[Project], *, max_in_flight: int = 4
+) -> list[ProjectOutcome]:
+    """Run the engine against the fake API.
+
+    Args:
+        fake: The fake API to talk to.
+        projects: Projects to sync.
+        max_in_flight: Per-token request limit.
+
+    Returns:
+        list[ProjectOutcome]: Outcomes in config order.
+    """
+    return asyncio.run(
+        _sync_all(
+            projects,
+            CF_CIDRS,
+            max_in_flight=max_in_flight,
+            transport=httpx.MockTransport(fake.handler),
+        )
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall_async.ACTION_POLL_INTERVAL", 0)
+def test_sync_updates_marked_rules() -> None:
+    """Marked rules get the same CIDRs the threaded engine would write."""
+    fake = FakeHetzner({
+        "fw-1": [_rule(CF_ALL, []), _rule("ssh", ["203.0.113.0/24"])],
+        "fw-2": [_rule(CF_IPV4, ["198.27.128.0/21"])],
+    })
+    fake.action_status = ["running", "success"]
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"])
+
+    assert _run(fake, [project]) == [ProjectOutcome(skipped=[], failed=[])]
+
+    assert fake.firewalls[1]["rules"][0]["source_ips"] == [
+        "198.27.128.0/21",
+        "2400:cb00::/32",
+    ]
+    # Unmarked rules are written back unchanged.
+    assert fake.firewalls[1]["rules"][1]["source_ips"] == ["203.0.113.0/24"]
+    # fw-2 was already up-to-date, so only fw-1 was written.
+    assert fake.count("POST", "/set_rules") == 1
+    assert fake.count("GET", "/actions/") == len(["running", "success"])
+    assert all(r.headers["Authorization"] == "Bearer token-1" for r in fake.requests)
+
+
+def test_sync_missing_firewall_is_skipped() -> None:
+    """Names missing from the listing are skipped, as in the threaded engine."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, ["198.27.128.0/21", "2400:cb00::/32"])]})
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-9"])
+
+    assert _run(fake, [project]) == [
+        ProjectOutcome(skipped=["project 1:'fw-9'"], failed=[])
+    ]
+    assert fake.count("GET", "/firewalls") == 1
+
+
+def test_sync_listing_fetches_every_page() -> None:
+    """Later listing pages are requested, and their firewalls resolved."""
+    fake = FakeHetzner({
+        f"fw-{i}": [_rule(CF_ALL, ["198.27.128.0/21", "2400:cb00::/32"])]
+        for i in range(1, 4)
+    })
+    fake.per_page_override = 1
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-3"])
+
+    assert _run(fake, [project]) == [ProjectOutcome(skipped=[], failed=[])]
+    assert fake.count("GET", "/firewalls") == len(fake.firewalls)
+
+
+@patch("logging.warning")
+@patch("logging.error")
+def test_sync_listing_failure_falls_back_to_name_lookups(
+    mock_error: MagicMock, mock_warning: MagicMock
+) -> None:
+    """A failed listing falls back to per-name lookups; their errors fail."""
+    fake = FakeHetzner({"fw-2": [_rule(CF_ALL, ["198.27.128.0/21", "2400:cb00::/32"])]})
+    fake.fail["GET", "/firewalls"] = httpx.Response(503)
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"])
+
+    def by_name(request: httpx.Request) -> httpx.Response:
+        if request.url.params.get("name") == "fw-1":
+            return httpx.Response(
+                429,
+                json={"error": {"code": "rate_limit_exceeded", "message": "slow"}},
+            )
+        return fake.handler(request)
+
+    outcome = asyncio.run(
+        _sync_all(
+            [project],
+            CF_CIDRS,
+            max_in_flight=2,
+            transport=httpx.MockTransport(by_name),
+        )
+    )
+
+    assert outcome == [ProjectOutcome(skipped=[], failed=["project 1:'fw-1'"])]
+    mock_warning.assert_called_once_with(
+        "hcloud/firewalls.get_all failed in project 1, falling back to per-name "
+        "lookups: Service Unavailable (503)"
+    )
+    mock_error.assert_called_once_with(
+        "hcloud/firewalls.get_by_name failed for 'fw-1' in project 1: "
+        "slow (rate_limit_exceeded)"
+    )
+
+
+@pytest.mark.parametrize(
+    ("endpoint", "body", "failed"),
+    [
+        pytest.param(("GET", "/firewalls"), {"meta": {}}, [], id="listing"),
+        pytest.param(("GET", "/firewalls"), [], [], id="listing-not-an-object"),
+        pytest.param(
+            ("POST", "/firewalls/1/actions/set_rules"),
+            {},
+            ["project 1:'fw-1'"],
+            id="set-rules",
+        ),
+        pytest.param(("GET", "/actions/1"), {}, ["project 1:'fw-1'"], id="action"),
+    ],
+)
+@patch("cf_ips_to_hcloud_fw.firewall_async.ACTION_POLL_INTERVAL", 0)
+@patch("logging.warning")
+@patch("logging.error")
+def test_sync_truncated_response_fails_only_its_firewall(
+    mock_error: MagicMock,
+    mock_warning: MagicMock,
+    endpoint: tuple[str, str],
+    body: object,
+    failed: list[str],
+) -> None:
+    """A 200 response missing its fields is a failure, not a crash of the run."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])], "fw-2": [_rule(CF_ALL, [])]})
+    fake.fail[endpoint] = httpx.Response(200, json=body)
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"])
+
+    assert _run(fake, [project]) == [ProjectOutcome(skipped=[], failed=failed)]
+    # A broken listing falls back to per-name lookups; any other response
+    # fails the firewall it belongs to.
+    assert mock_warning.call_count + mock_error.call_count == 1
+    assert fake.firewalls[2]["rules"][0]["source_ips"] == [
+        "198.27.128.0/21",
+        "2400:cb00::/32",
+    ]
+
+
+def test_describe_http_error_names_malformed_responses() -> None:
+    """A missing field is reported as a malformed response, not a bare key."""
+    assert _describe_http_error(KeyError("actions")) == (
+        "malformed response (KeyError: 'actions')"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall.RULES_CHANGED")
+def test_sync_counts_changed_rules_once_written(mock_rules_changed: MagicMock) -> None:
+    """Rules count as changed once set_rules accepted them, not before."""
+    fake = FakeHetzner({
+        "fw-1": [_rule(CF_ALL, []), _rule(CF_IPV4, ["198.27.128.0/21"])],
+    })
+    fake.fail["POST", "/firewalls/1/actions/set_rules"] = httpx.Response(
+        422, json={"error": {"code": "invalid_input", "message": "nope"}}
+    )
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    with patch("logging.error"):
+        _run(fake, [project])
+    mock_rules_changed.inc.assert_not_called()
+
+    del fake.fail["POST", "/firewalls/1/actions/set_rules"]
+    _run(fake, [project])
+    mock_rules_changed.inc.assert_called_once_with(amount=1)
+
+
+@patch("logging.error")
+def test_sync_set_rules_failure_is_recorded(mock_error: MagicMock) -> None:
+    """A rejected set_rules fails that firewall only."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    fake.fail["POST", "/firewalls/1/actions/set_rules"] = httpx.Response(
+        422, json={"error": {"code": "invalid_input", "message": "nope"}}
+    )
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    assert _run(fake, [project]) == [
+        ProjectOutcome(skipped=[], failed=["project 1:'fw-1'"])
+    ]
+    mock_error.assert_called_once_with(
+        "hcloud/firewall.set_rules failed for 'fw-1' in project 1: nope (invalid_input)"
+    )
+
+
+@pytest.mark.parametrize(
+    ("statuses", "message"),
+    [
+        pytest.param(
+            ["error"],
+            "The pending action failed: bad rule (invalid_input, 1)",
+            id="failed",
+        ),
+        pytest.param(
+            ["running", "running"],
+            "The pending action timed out (set_rules, 1)",
+            id="timeout",
+        ),
+    ],
+)
+@patch("cf_ips_to_hcloud_fw.firewall_async.ACTION_POLL_MAX_ROUNDS", 2)
+@patch("cf_ips_to_hcloud_fw.firewall_async.ACTION_POLL_INTERVAL", 0)
+@patch("logging.error")
+def test_sync_action_failure_is_recorded(
+    mock_error: MagicMock, statuses: list[str], message: str
+) -> None:
+    """Failed and timed-out actions are reported like the threaded engine does."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    fake.action_status = statuses
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    assert _run(fake, [project]) == [
+        ProjectOutcome(skipped=[], failed=["project 1:'fw-1'"])
+    ]
+    mock_error.assert_called_once_with(
+        f"hcloud/firewall.set_rules failed for 'fw-1' in project 1: {message}"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall_async.RUN_DEADLINE")
+@patch("cf_ips_to_hcloud_fw.firewall_async.ACTION_POLL_INTERVAL", 0)
+@patch("logging.error")
+def test_sync_action_wait_stops_at_the_deadline(
+    mock_error: MagicMock, mock_deadline: MagicMock
+) -> None:
+    """An action still running when the deadline is near is given up on."""
+    # Enough time to start the project and its firewall, not to keep polling.
+    mock_deadline.allows.side_effect = [True, True, False]
+    mock_deadline.clamp.return_value = (5.0, 30.0)
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    fake.action_status = ["running"]
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    assert _run(fake, [project]) == [
+        ProjectOutcome(skipped=[], failed=["project 1:'fw-1'"])
+    ]
+    assert fake.count("GET", "/actions/") == 0
+    mock_error.assert_called_once_with(
+        "hcloud/firewall.set_rules failed for 'fw-1' in project 1: "
+        "The pending action timed out (set_rules, 1)"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall_async.pacing_delay", MagicMock(return_value=30.0))
+@patch("logging.error")
+def test_sync_does_not_pace_past_the_deadline(mock_error: MagicMock) -> None:
+    """A request whose rate limit wait would outlast the deadline isn't sent."""
+    RUN_DEADLINE.start(MIN_FIREWALL_TIME + 1)
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    assert _run(fake, [project]) == [
+        ProjectOutcome(skipped=[], failed=["project 1:'fw-1'"])
+    ]
+    assert not fake.requests
+    mock_error.assert_called_once_with(
+        "hcloud/firewalls.get_by_name failed for 'fw-1' in project 1: "
+        "rate limit pacing would wait 30.0s, past the deadline"
+    )
+
+
+@patch("logging.warning")
+def test_sync_out_of_time_touches_nothing(mock_warning: MagicMock) -> None:
+    """With the deadline near no project is started and nothing is sent."""
+    RUN_DEADLINE.start(0)
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    assert _run(fake, [project]) == [
+        ProjectOutcome(skipped=[], failed=[], untouched=("project 1:'fw-1'",))
+    ]
+    assert not fake.requests
+    mock_warning.assert_called_once_with("Deadline near - not starting project 1")
+
+
+@patch("cf_ips_to_hcloud_fw.firewall_async.RUN_DEADLINE")
+@patch("logging.warning")
+def test_sync_deadline_reached_after_lookup(
+    mock_warning: MagicMock, mock_deadline: MagicMock
+) -> None:
+    """Firewalls found only after the deadline came near are not written."""
+    mock_deadline.allows.side_effect = [True, False]
+    mock_deadline.clamp.return_value = (5.0, 30.0)
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])], "fw-2": [_rule(CF_ALL, [])]})
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"])
+
+    assert _run(fake, [project]) == [
+        ProjectOutcome(
+            skipped=[],
+            failed=[],
+            untouched=("project 1:'fw-1'", "project 1:'fw-2'"),
+        )
+    ]
+    assert fake.count("POST", "/set_rules") == 0
+    mock_warning.assert_called_once_with(
+        "Deadline near - not starting 2 more firewall(s) in project 1"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.firewall_async.ACTION_POLL_MAX_ROUNDS", 3)
+@patch("cf_ips_to_hcloud_fw.firewall_async.ACTION_POLL_INTERVAL", 0)
+def test_sync_action_finishing_on_the_last_poll_succeeds() -> None:
+    """The status read by the last allowed poll decides, not a timeout."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    fake.action_status = ["running", "running", "success"]
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    assert _run(fake, [project]) == [ProjectOutcome(skipped=[], failed=[])]
+    assert fake.count("GET", "/actions/") == len(["running", "running", "success"])
+
+
+def test_sync_bounds_requests_per_token() -> None:
+    """Projects sharing a token share one in-flight limit."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])], "fw-2": [_rule(CF_ALL, [])]})
+    in_flight = 0
+    peak = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return fake.handler(request)
+
+    projects = [
+        Project(token=SecretStr("shared"), firewalls=["fw-1"]),
+        Project(token=SecretStr("shared"), firewalls=["fw-2"]),
+    ]
+    outcomes = asyncio.run(
+        _sync_all(
+            projects,
+            CF_CIDRS,
+            max_in_flight=1,
+            transport=httpx.MockTransport(handler),
+        )
+    )
+
+    assert outcomes == [ProjectOutcome([], []), ProjectOutcome([], [])]
+    assert peak == 1
+
+
+@patch("cf_ips_to_hcloud_fw.firewall_async.ACTION_POLL_INTERVAL", 0)
+def test_sync_paces_by_rate_limit_headers() -> None:
+    """Once the token's budget is spent, each further request waits its turn."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    exhausted = {
+        "RateLimit-Limit": "3600",
+        "RateLimit-Remaining": "0",
+        "RateLimit-Reset": "9999999999",
+    }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        response = fake.handler(request)
+        response.headers.update(exhausted)
+        return response
+
+    project = Project(token=SecretStr("token-paced-async"), firewalls=["fw-1"])
+    real_sleep = asyncio.sleep
+    delays: list[float] = []
+
+    async def sleep(delay: float) -> None:
+        delays.append(delay)
+        await real_sleep(0)
+
+    with patch("cf_ips_to_hcloud_fw.firewall_async.asyncio.sleep", sleep):
+        outcomes = asyncio.run(
+            _sync_all(
+                [project],
+                CF_CIDRS,
+                max_in_flight=4,
+                transport=httpx.MockTransport(handler),
+            )
+        )
+
+    assert outcomes == [ProjectOutcome([], [])]
+    # get_by_name is sent unpaced, as nothing is known yet; set_rules and the
+    # action poll after it are each paced.
+    assert len(fake.requests) == len(["get_by_name", "set_rules", "action"])
+    paced = [delay for delay in delays if delay > 0]
+    assert len(paced) == len(fake.requests) - 1
+
+
+@patch("cf_ips_to_hcloud_fw.firewall_async.observe_request")
+@patch("logging.error")
+def test_sync_counts_requests(mock_error: MagicMock, mock_observe: MagicMock) -> None:
+    """Every request is counted, including one that got no response."""
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        msg = "unreachable"
+        raise httpx.ConnectError(msg, request=request)
+
+    assert asyncio.run(
+        _sync_all(
+            [project],
+            CF_CIDRS,
+            max_in_flight=1,
+            transport=httpx.MockTransport(handler),
+        )
+    ) == [ProjectOutcome(skipped=[], failed=["project 1:'fw-1'"])]
+    mock_error.assert_called_once()
+    mock_observe.assert_called_once()
+    assert mock_observe.call_args.args[:3] == ("GET", "/firewalls", "error")
+
+
+@patch("cf_ips_to_hcloud_fw.firewall_async.ACTION_POLL_INTERVAL", 0)
+@patch("cf_ips_to_hcloud_fw.retry.random.uniform", MagicMock(return_value=0.0))
+def test_sync_retries_transient_failures() -> None:
+    """A locked firewall and a dropped connection are retried, not failed."""
+    RETRY_BUDGET.reset(2)
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    hiccups = [
+        httpx.Response(423, json={"error": {"code": "locked", "message": "busy"}}),
+        httpx.ConnectError("reset"),
+    ]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST" and hiccups:
+            hiccup = hiccups.pop(0)
+            if isinstance(hiccup, Exception):
+                raise hiccup
+            return hiccup
+        return fake.handler(request)
+
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+    assert asyncio.run(
+        _sync_all(
+            [project],
+            CF_CIDRS,
+            max_in_flight=1,
+            transport=httpx.MockTransport(handler),
+        )
+    ) == [ProjectOutcome(skipped=[], failed=[])]
+    assert not hiccups
+    assert fake.firewalls[1]["rules"][0]["source_ips"]
+
+
+def test_sync_unexpected_error_propagates() -> None:
+    """Programming errors are not swallowed as per-firewall failures."""
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        del request
+        msg = "bug"
+        raise RuntimeError(msg)
+
+    with pytest.raises(RuntimeError, match="bug"):
+        asyncio.run(
+            _sync_all(
+                [project],
+                CF_CIDRS,
+                max_in_flight=1,
+                transport=httpx.MockTransport(handler),
+            )
+        )
+
+
+@pytest.mark.parametrize(
+    ("response", "message"),
+    [
+        (httpx.Response(502, content=b"<html>"), "Bad Gateway (502)"),
+        (httpx.Response(500), "Internal Server Error (500)"),
+    ],
+)
+def test_read_response_errors_without_api_error(
+    response: httpx.Response, message: str
+) -> None:
+    """Non-JSON and body-less failures map to the status line, like the SDK."""
+    with pytest.raises(APIException) as e:
+        _read_response(response)
+    assert str(e.value) == message
+
+
+def test_describe_http_error_hides_header_values() -> None:
+    """h11's header refusal quotes the value back; only the type is logged."""
+    secret = "hcloud-SUPER_SECRET_TOKEN_VALUE"  # ruff: ignore[hardcoded-password-string]
+    e = httpx.LocalProtocolError(f"Illegal header value b'Bearer {secret}\\n'")
+    assert _describe_http_error(e) == "LocalProtocolError"
+    assert _describe_http_error(httpx.ConnectError("boom")) == "boom"
+
+
+@patch("cf_ips_to_hcloud_fw.firewall_async._sync_all")
+def test_sync_projects_async_runs_event_loop(mock_sync_all: MagicMock) -> None:
+    """The sync entry point drives the coroutine to completion."""
+
+    async def done(*_: object, **__: object) -> list[ProjectOutcome]:
+        await asyncio.sleep(0)
+        return [ProjectOutcome([], [])]
+
+    mock_sync_all.side_effect = done
+    projects = [Project(token=SecretStr("token-1"), firewalls=["fw-1"])]
+    assert sync_projects_async(projects, CF_CIDRS, max_in_flight=3) == [
+        ProjectOutcome([], [])
+    ]
+    mock_sync_all.assert_called_once_with(
+        projects, CF_CIDRS, max_in_flight=3, max_sources=MAX_RULE_SOURCES
+    )
+
+
+def test_kept_alive_engine_reuses_its_client() -> None:
+    """Watch mode's engine keeps one client and event loop across syncs."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+    engine = KeptAliveEngine(
+        max_in_flight=1, transport=httpx.MockTransport(fake.handler)
+    )
+
+    with patch("httpx.AsyncClient", wraps=httpx.AsyncClient) as mock_client:
+        assert engine.sync([project], CF_CIDRS) == [ProjectOutcome([], [])]
+        assert engine.sync([project], CF_CIDRS) == [ProjectOutcome([], [])]
+
+    mock_client.assert_called_once()
+    assert fake.count("POST", "/set_rules") == 1
+
+
+@pytest.mark.parametrize("syncs", [0, 1])
+def test_kept_alive_engine_close(syncs: int) -> None:
+    """Closing the engine closes its client, if one was built, and its loop."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+    engine = KeptAliveEngine(
+        max_in_flight=1, transport=httpx.MockTransport(fake.handler)
+    )
+    with patch("httpx.AsyncClient.aclose", autospec=True) as mock_aclose:
+        for _ in range(syncs):
+            engine.sync([project], CF_CIDRS)
+        engine.close()
+
+    assert mock_aclose.call_count == syncs
+    assert engine._loop.is_closed()
+
+
+def test_sync_splits_oversized_rules() -> None:
+    """Ranges beyond the limit go to numbered rules; a second run is a no-op."""
+    fake = FakeHetzner({"fw-1": [_rule(CF_ALL, [])]})
+    project = Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+
+    def run() -> list[ProjectOutcome]:
+        return asyncio.run(
+            _sync_all(
+                [project],
+                CF_CIDRS,
+                max_in_flight=1,
+                max_sources=1,
+                transport=httpx.MockTransport(fake.handler),
+            )
+        )
+
+    assert run() == [ProjectOutcome(skipped=[], failed=[])]
+    rules = fake.firewalls[1]["rules"]
+    assert [(r["description"], r["source_ips"], r["port"]) for r in rules] == [
+        (CF_ALL, ["198.27.128.0/21"], "443"),
+        ("__CLOUDFLARE_IPS_2__", ["2400:cb00::/32"], "443"),
+    ]
+
+    assert run() == [ProjectOutcome(skipped=[], failed=[])]
+    assert fake.count("POST", "/set_rules") == 1
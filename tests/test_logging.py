@@ -4,9 +4,13 @@ from __future__ import annotations
 
 import argparse
 import logging
+from typing import TYPE_CHECKING
 from unittest.mock import MagicMock, patch
 
-from cf_ips_to_hcloud_fw.custom_logging import setup_logging
+from cf_ips_to_hcloud_fw.custom_logging import ordered_project_logs, setup_logging
+
+if TYPE_CHECKING:
+    import pytest
 
 
 @patch("logging.basicConfig")
@@ -30,3 +34,33 @@ def test_setup_logging_info(mock_basic_config: MagicMock) -> None:
         level=logging.getLevelName(logging.INFO),
         format="%(asctime)s %(levelname)-8s %(message)s",
     )
+
+
+def test_ordered_project_logs_release_in_config_order(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    """A later project's records wait until every earlier project is done."""
+    caplog.set_level(logging.INFO)
+    with ordered_project_logs() as order:
+        order.run(2, logging.info, "project 2")
+        assert caplog.messages == []
+        logging.info("outside any project")
+        order.run(1, logging.info, "project 1")
+        order.run(3, logging.info, "project 3")
+    assert caplog.messages == [
+        "outside any project",
+        "project 1",
+        "project 2",
+        "project 3",
+    ]
+
+
+def test_ordered_project_logs_flush_on_exit(caplog: pytest.LogCaptureFixture) -> None:
+    """Records of projects still waiting for their turn aren't lost."""
+    caplog.set_level(logging.INFO)
+    with ordered_project_logs() as order:
+        order.run(3, logging.info, "project 3")
+        order.run(2, logging.info, "project 2")
+    assert caplog.messages == ["project 2", "project 3"]
+    # The filters are gone: project records pass straight through again.
+    assert not any(handler.filters for handler in logging.getLogger().handlers)
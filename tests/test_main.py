@@ -4,16 +4,48 @@ from __future__ import annotations
 
 import importlib
 import importlib.metadata
+import logging
 import re
-from unittest.mock import MagicMock, patch
+import signal
+import subprocess  # ruff:ignore[suspicious-subprocess-import]
+import sys
+import threading
+from typing import TYPE_CHECKING
+from unittest.mock import MagicMock, call, patch
 
 import pytest
 from pydantic import SecretStr
 
 import cf_ips_to_hcloud_fw
-from cf_ips_to_hcloud_fw.__main__ import create_parser, main
-from cf_ips_to_hcloud_fw.firewall import ProjectOutcome
-from cf_ips_to_hcloud_fw.models import Project
+from cf_ips_to_hcloud_fw.__main__ import (
+    DEFAULT_MAX_RULE_SOURCES,
+    DEFAULT_RECONCILE_INTERVAL,
+    create_parser,
+    main,
+    sync_projects,
+)
+from cf_ips_to_hcloud_fw.firewall import (
+    MAX_RULE_SOURCES,
+    FirewallPlan,
+    ProjectOutcome,
+    ProjectPlan,
+)
+from cf_ips_to_hcloud_fw.metrics import DEFAULT_METRICS_HOST
+from cf_ips_to_hcloud_fw.models import CloudflareCIDRs, Project
+from cf_ips_to_hcloud_fw.plan import write_plan
+from cf_ips_to_hcloud_fw.retry import DEFAULT_RETRY_BUDGET
+from cf_ips_to_hcloud_fw.state import DEFAULT_REVERIFY_AFTER
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+PROJECT_CONCURRENCY = 4
+MAX_IN_FLIGHT = 8
+MAX_SOURCES = 50
+WATCH_INTERVAL = 60
+METRICS_PORT = 9464
+ARGPARSE_USAGE_ERROR = 2
+DEADLINE = 300
 
 
 def test_create_parser() -> None:
@@ -35,6 +67,67 @@ def test_create_parser() -> None:
     args = parser.parse_args([])
     assert args.config is None
     assert args.debug is False
+    assert args.project_concurrency == 1
+    assert args.cache is None
+    assert args.cloudflare_backend == "http"
+    assert args.collapse_cidrs is False
+    assert args.state is None
+    assert args.reverify_after == DEFAULT_REVERIFY_AFTER
+    assert args.timings is False
+    assert args.metrics_textfile is None
+    assert args.metrics_port is None
+    assert args.metrics_host == DEFAULT_METRICS_HOST
+    args = parser.parse_args(["--project-concurrency", str(PROJECT_CONCURRENCY)])
+    assert args.project_concurrency == PROJECT_CONCURRENCY
+    assert args.engine == "threads"
+    args = parser.parse_args(["--engine", "async", "--max-in-flight", "8"])
+    assert args.engine == "async"
+    assert args.max_in_flight == MAX_IN_FLIGHT
+    assert args.max_rule_sources == DEFAULT_MAX_RULE_SOURCES
+    args = parser.parse_args(["--max-rule-sources", str(MAX_SOURCES)])
+    assert args.max_rule_sources == MAX_SOURCES
+    args = parser.parse_args(["--cache", "cf-cache.json"])
+    assert args.cache == "cf-cache.json"
+    assert args.plan is None
+    assert args.apply_plan is None
+    assert args.cidrs_from is None
+    assert args.retry_budget == DEFAULT_RETRY_BUDGET
+    assert args.deadline is None
+    args = parser.parse_args(["--deadline", str(DEADLINE)])
+    assert args.deadline == DEADLINE
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "two"])
+def test_parser_rejects_bad_project_concurrency(value: str) -> None:
+    """--project-concurrency must be a positive integer."""
+    parser = create_parser()
+    with pytest.raises(SystemExit) as e:
+        parser.parse_args(["--project-concurrency", value])
+    assert e.value.code == ARGPARSE_USAGE_ERROR
+
+
+@pytest.mark.parametrize("value", ["-1", "two"])
+def test_parser_rejects_bad_retry_budget(value: str) -> None:
+    """--retry-budget must be zero or more."""
+    parser = create_parser()
+    assert parser.parse_args(["--retry-budget", "0"]).retry_budget == 0
+    with pytest.raises(SystemExit) as e:
+        parser.parse_args(["--retry-budget", value])
+    assert e.value.code == ARGPARSE_USAGE_ERROR
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "soon"])
+def test_parser_rejects_bad_deadline(value: str) -> None:
+    """--deadline must be a positive number of seconds."""
+    parser = create_parser()
+    with pytest.raises(SystemExit) as e:
+        parser.parse_args(["--deadline", value])
+    assert e.value.code == ARGPARSE_USAGE_ERROR
+
+
+def test_max_rule_sources_default_matches_firewall() -> None:
+    """The CLI default repeats the firewall module's limit and must not drift."""
+    assert DEFAULT_MAX_RULE_SOURCES == MAX_RULE_SOURCES
 
 
 def test_parser_version(capfd: pytest.CaptureFixture[str]) -> None:
@@ -62,17 +155,32 @@ def test_parser_version_no_metadata(monkeypatch: pytest.MonkeyPatch) -> None:
         importlib.reload(cf_ips_to_hcloud_fw)
 
 
-@patch("cf_ips_to_hcloud_fw.__main__.create_parser", MagicMock())
+def test_cli_startup_skips_heavy_imports() -> None:
+    """Parsing arguments must not import the SDKs the sync itself needs."""
+    heavy = ("cloudflare", "hcloud", "httpx", "pydantic", "requests", "yaml")
+    code = (
+        "import sys\n"
+        "from cf_ips_to_hcloud_fw.__main__ import create_parser\n"
+        "create_parser()\n"
+        f"print(sorted(m for m in {heavy!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run(  # ruff:ignore[subprocess-without-shell-equals-true]
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw"])
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.load_projects",
+    "cf_ips_to_hcloud_fw.config.load_projects",
     return_value=[
         Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"]),
         Project(token=SecretStr("token-2"), firewalls=["fw-1", "fw-2"]),
     ],
 )
-@patch("cf_ips_to_hcloud_fw.__main__.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.update_project",
+    "cf_ips_to_hcloud_fw.firewall.update_project",
     return_value=ProjectOutcome(skipped=[], failed=[]),
 )
 def test_main(mock_update_project: MagicMock, mock_projects: MagicMock) -> None:
@@ -85,16 +193,16 @@ def test_main(mock_update_project: MagicMock, mock_projects: MagicMock) -> None:
         assert call_kwargs["project_index"] == i + 1
 
 
-@patch("cf_ips_to_hcloud_fw.__main__.create_parser", MagicMock())
+@patch("sys.argv", ["cf-ips-to-hcloud-fw"])
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.load_projects",
+    "cf_ips_to_hcloud_fw.config.load_projects",
     return_value=[
         Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"]),
     ],
 )
-@patch("cf_ips_to_hcloud_fw.__main__.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.update_project",
+    "cf_ips_to_hcloud_fw.firewall.update_project",
     return_value=ProjectOutcome(
         skipped=["project 1:fw-2", "project 1:fw-3"], failed=[]
     ),
@@ -113,17 +221,17 @@ def test_main_with_skipped_firewalls(
     )
 
 
-@patch("cf_ips_to_hcloud_fw.__main__.create_parser", MagicMock())
+@patch("sys.argv", ["cf-ips-to-hcloud-fw"])
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.load_projects",
+    "cf_ips_to_hcloud_fw.config.load_projects",
     return_value=[
         Project(token=SecretStr("token-1"), firewalls=["fw-2"]),
         Project(token=SecretStr("token-3"), firewalls=["fw-4"]),
     ],
 )
-@patch("cf_ips_to_hcloud_fw.__main__.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.update_project",
+    "cf_ips_to_hcloud_fw.firewall.update_project",
     side_effect=[
         ProjectOutcome(skipped=["project 1:fw-1"], failed=[]),
         ProjectOutcome(skipped=["project 2:fw-3", "project 2:fw-4"], failed=[]),
@@ -144,17 +252,17 @@ def test_main_with_skipped_firewalls_multiple_projects(
     )
 
 
-@patch("cf_ips_to_hcloud_fw.__main__.create_parser", MagicMock())
+@patch("sys.argv", ["cf-ips-to-hcloud-fw"])
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.load_projects",
+    "cf_ips_to_hcloud_fw.config.load_projects",
     return_value=[
         Project(token=SecretStr("token-1"), firewalls=["fw-1"]),
         Project(token=SecretStr("token-2"), firewalls=["fw-2"]),
     ],
 )
-@patch("cf_ips_to_hcloud_fw.__main__.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.update_project",
+    "cf_ips_to_hcloud_fw.firewall.update_project",
     side_effect=[
         ProjectOutcome(skipped=[], failed=["project 1:fw-1"]),
         ProjectOutcome(skipped=[], failed=[]),
@@ -175,14 +283,14 @@ def test_main_failed_project_does_not_abort_remaining(
     )
 
 
-@patch("cf_ips_to_hcloud_fw.__main__.create_parser", MagicMock())
+@patch("sys.argv", ["cf-ips-to-hcloud-fw"])
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.load_projects",
+    "cf_ips_to_hcloud_fw.config.load_projects",
     return_value=[Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"])],
 )
-@patch("cf_ips_to_hcloud_fw.__main__.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
 @patch(
-    "cf_ips_to_hcloud_fw.__main__.update_project",
+    "cf_ips_to_hcloud_fw.firewall.update_project",
     return_value=ProjectOutcome(skipped=["project 1:fw-2"], failed=["project 1:fw-1"]),
 )
 @patch("logging.error")
@@ -198,3 +306,739 @@ def test_main_reports_failed_and_skipped(
         "Some firewalls were not updated "
         "(failed: project 1:fw-1; not found: project 1:fw-2)"
     )
+
+
+@patch("cf_ips_to_hcloud_fw.ratelimit.shared_session", MagicMock())
+@patch("cf_ips_to_hcloud_fw.firewall.update_project")
+def test_sync_projects_concurrent_logs_in_config_order(
+    mock_update_project: MagicMock, caplog: pytest.LogCaptureFixture
+) -> None:
+    """Log lines read as in a serial run, whichever project finishes first."""
+    caplog.set_level(logging.INFO)
+    projects = [
+        Project(token=SecretStr(f"token-{i}"), firewalls=[f"fw-{i}"])
+        for i in range(1, 4)
+    ]
+    last_index = len(projects)
+    last_done = threading.Event()
+
+    def fake_update(*, project_index: int, **_: object) -> ProjectOutcome:
+        logging.info(f"start {project_index}")
+        if project_index == 1:
+            assert last_done.wait(timeout=5)
+        logging.info(f"end {project_index}")
+        if project_index == last_index:
+            last_done.set()
+        return ProjectOutcome(skipped=[], failed=[])
+
+    mock_update_project.side_effect = fake_update
+    sync_projects(projects, MagicMock(), concurrency=len(projects))
+
+    assert caplog.messages == [
+        f"{step} {i}" for i in range(1, last_index + 1) for step in ("start", "end")
+    ]
+
+
+@patch("cf_ips_to_hcloud_fw.ratelimit.shared_session")
+@patch("cf_ips_to_hcloud_fw.firewall.update_project")
+def test_sync_projects_concurrent_keeps_config_order(
+    mock_update_project: MagicMock, mock_session: MagicMock
+) -> None:
+    """Outcomes come back in config order even when projects finish out of order."""
+    projects = [
+        Project(token=SecretStr(f"token-{i}"), firewalls=[f"fw-{i}"])
+        for i in range(1, 4)
+    ]
+    last_index = len(projects)
+    # Project 1 blocks until project 3 has finished, so completion order is
+    # guaranteed to differ from config order.
+    last_done = threading.Event()
+
+    def fake_update(
+        *,
+        project: Project,
+        cf_cidrs: object,
+        project_index: int,
+        client: None,
+        max_sources: int,
+    ) -> ProjectOutcome:
+        del project, cf_cidrs, client, max_sources
+        if project_index == 1:
+            assert last_done.wait(timeout=5)
+        if project_index == last_index:
+            last_done.set()
+        return ProjectOutcome(skipped=[], failed=[f"project {project_index}:'fw'"])
+
+    mock_update_project.side_effect = fake_update
+    outcomes = sync_projects(projects, MagicMock(), concurrency=3)
+
+    assert [outcome.failed for outcome in outcomes] == [
+        ["project 1:'fw'"],
+        ["project 2:'fw'"],
+        ["project 3:'fw'"],
+    ]
+    assert mock_update_project.call_count == len(projects)
+    # One pooled connection per concurrently synced project.
+    mock_session.return_value.grow_pool.assert_called_once_with(len(projects))
+
+
+@patch(
+    "sys.argv",
+    ["cf-ips-to-hcloud-fw", "--project-concurrency", "2"],
+)
+@patch(
+    "cf_ips_to_hcloud_fw.config.load_projects",
+    return_value=[
+        Project(token=SecretStr("token-1"), firewalls=["fw-1"]),
+        Project(token=SecretStr("token-2"), firewalls=["fw-2"]),
+    ],
+)
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
+@patch(
+    "cf_ips_to_hcloud_fw.firewall.update_project",
+    side_effect=lambda *, project_index, **_: ProjectOutcome(
+        skipped=[], failed=[f"project {project_index}:'fw-{project_index}'"]
+    ),
+)
+@patch("logging.error")
+def test_main_project_concurrency_aggregates_in_order(
+    mock_logging: MagicMock, mock_update_project: MagicMock, mock_projects: MagicMock
+) -> None:
+    """The concurrent path reports failures in the same order as a serial run."""
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 1
+    assert mock_update_project.call_count == len(mock_projects.return_value)
+    mock_logging.assert_called_once_with(
+        "Some firewalls were not updated (failed: project 1:'fw-1', project 2:'fw-2')"
+    )
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--cache", "cf-cache.json"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs")
+def test_main_passes_cache_file(mock_cidrs: MagicMock) -> None:
+    """--cache is handed to the Cloudflare fetch."""
+    main()
+    mock_cidrs.assert_called_once_with("cf-cache.json", "http")
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--collapse-cidrs"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs")
+@patch("cf_ips_to_hcloud_fw.cloudflare.collapse_cidrs")
+@patch("cf_ips_to_hcloud_fw.__main__.sync_projects")
+def test_main_collapses_cidrs(
+    mock_sync: MagicMock, mock_collapse: MagicMock, mock_cidrs: MagicMock
+) -> None:
+    """--collapse-cidrs syncs the collapsed ranges instead of the fetched ones."""
+    mock_sync.return_value = []
+    main()
+    mock_collapse.assert_called_once_with(mock_cidrs.return_value)
+    assert mock_sync.call_args[0][1] is mock_collapse.return_value
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--cloudflare-backend", "sdk"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs")
+def test_main_passes_cloudflare_backend(mock_cidrs: MagicMock) -> None:
+    """--cloudflare-backend selects how the ranges are fetched."""
+    main()
+    mock_cidrs.assert_called_once_with(None, "sdk")
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--cidrs-from", "ips.json"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs")
+@patch("cf_ips_to_hcloud_fw.cloudflare.read_cloudflare_cidrs")
+@patch("cf_ips_to_hcloud_fw.__main__.sync_projects")
+def test_main_reads_cidrs_from_file(
+    mock_sync: MagicMock, mock_read: MagicMock, mock_cidrs: MagicMock
+) -> None:
+    """--cidrs-from replaces the Cloudflare request with the saved document."""
+    mock_sync.return_value = []
+    main()
+    mock_read.assert_called_once_with("ips.json")
+    mock_cidrs.assert_not_called()
+    assert mock_sync.call_args[0][1] is mock_read.return_value
+
+
+def test_cidrs_from_stdin_conflicts_with_watch() -> None:
+    """Standard input can only be read once, but watch mode reads every poll."""
+    with (
+        patch(
+            "sys.argv",
+            ["cf-ips-to-hcloud-fw", "--cidrs-from", "-", "--watch", "60"],
+        ),
+        pytest.raises(SystemExit) as e,
+    ):
+        main()
+    assert e.value.code == ARGPARSE_USAGE_ERROR
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--timings"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.__main__.enable_timings")
+@patch(
+    "cf_ips_to_hcloud_fw.__main__.timing_summary",
+    return_value=["Timing cf_ips_list: 1 call(s)", "Slowest firewalls: none"],
+)
+@patch("logging.info")
+def test_main_logs_timings(
+    mock_info: MagicMock, mock_summary: MagicMock, mock_enable: MagicMock
+) -> None:
+    """--timings records the run and logs the summary after the sync."""
+    main()
+    mock_enable.assert_called_once_with()
+    logged = [c.args[0] for c in mock_info.call_args_list]
+    assert logged[-len(mock_summary.return_value) :] == mock_summary.return_value
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.__main__.enable_timings")
+@patch("cf_ips_to_hcloud_fw.__main__.timing_summary")
+def test_main_without_timings(mock_summary: MagicMock, mock_enable: MagicMock) -> None:
+    """Without --timings nothing is recorded or summarized."""
+    main()
+    mock_enable.assert_not_called()
+    mock_summary.assert_not_called()
+
+
+@patch(
+    "cf_ips_to_hcloud_fw.config.load_projects",
+    return_value=[
+        Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"]),
+        Project(token=SecretStr("token-2"), firewalls=["fw-1"]),
+    ],
+)
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs")
+@patch("cf_ips_to_hcloud_fw.firewall.update_project")
+def test_main_state_skips_verified_firewalls(
+    mock_update_project: MagicMock,
+    mock_cidrs: MagicMock,
+    mock_projects: MagicMock,
+    tmp_path: Path,
+) -> None:
+    """--state leaves out firewalls a previous run left matching the ranges."""
+    mock_cidrs.return_value = CloudflareCIDRs(
+        ipv4_cidrs=["198.27.128.0/21"], ipv6_cidrs=["2400:cb00::/32"]
+    )
+    mock_update_project.side_effect = [
+        ProjectOutcome(skipped=[], failed=["project 1:'fw-2'"]),
+        ProjectOutcome(skipped=[], failed=[]),
+    ] * len(["first", "second", "new cap"])
+    argv = ["cf-ips-to-hcloud-fw", "--state", str(tmp_path / "state.json")]
+    with patch("sys.argv", argv), pytest.raises(SystemExit):
+        main()
+    synced = [c.kwargs["project"].firewalls for c in mock_update_project.call_args_list]
+    assert synced == [p.firewalls for p in mock_projects.return_value]
+
+    mock_update_project.reset_mock()
+    with patch("sys.argv", argv), pytest.raises(SystemExit):
+        main()
+    # Only the firewall that failed is retried; project indices are unchanged.
+    synced = [c.kwargs["project"].firewalls for c in mock_update_project.call_args_list]
+    assert synced == [["fw-2"], []]
+    indices = [c.kwargs["project_index"] for c in mock_update_project.call_args_list]
+    assert indices == [1, 2]
+
+    # A new rule cap splits the rules differently, so everything is checked.
+    mock_update_project.reset_mock()
+    new_cap = ["--max-rule-sources", str(DEFAULT_MAX_RULE_SOURCES - 1)]
+    with patch("sys.argv", argv + new_cap), pytest.raises(SystemExit):
+        main()
+    synced = [c.kwargs["project"].firewalls for c in mock_update_project.call_args_list]
+    assert synced == [p.firewalls for p in mock_projects.return_value]
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--engine", "async"])
+@patch(
+    "cf_ips_to_hcloud_fw.config.load_projects",
+    return_value=[Project(token=SecretStr("token-1"), firewalls=["fw-1"])],
+)
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs")
+@patch("cf_ips_to_hcloud_fw.firewall.update_project")
+@patch(
+    "cf_ips_to_hcloud_fw.firewall_async.sync_projects_async",
+    return_value=[ProjectOutcome(skipped=[], failed=[])],
+)
+def test_main_async_engine(
+    mock_sync_async: MagicMock,
+    mock_update_project: MagicMock,
+    mock_cidrs: MagicMock,
+    mock_projects: MagicMock,
+) -> None:
+    """--engine async hands every project to the asyncio engine."""
+    main()
+    mock_sync_async.assert_called_once_with(
+        mock_projects.return_value,
+        mock_cidrs.return_value,
+        max_in_flight=16,
+        max_sources=DEFAULT_MAX_RULE_SOURCES,
+    )
+    mock_update_project.assert_not_called()
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--watch", "60"])
+@patch(
+    "cf_ips_to_hcloud_fw.config.load_projects",
+    return_value=[
+        Project(token=SecretStr("token-1"), firewalls=["fw-1"]),
+        Project(token=SecretStr("token-2"), firewalls=["fw-2"]),
+    ],
+)
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs")
+@patch("cf_ips_to_hcloud_fw.firewall.make_client")
+@patch(
+    "cf_ips_to_hcloud_fw.firewall.update_project",
+    return_value=ProjectOutcome(skipped=[], failed=[]),
+)
+@patch("cf_ips_to_hcloud_fw.watch.watch")
+def test_main_watch_reuses_clients(
+    mock_watch: MagicMock,
+    mock_update_project: MagicMock,
+    mock_make_client: MagicMock,
+    mock_cidrs: MagicMock,
+    mock_projects: MagicMock,
+) -> None:
+    """--watch builds each project's client once and hands the loop a sync."""
+    clients = [MagicMock(), MagicMock()]
+    mock_make_client.side_effect = clients
+    with patch("cf_ips_to_hcloud_fw.__main__.signal.signal") as mock_signal:
+        main()
+
+    kwargs = mock_watch.call_args.kwargs
+    assert kwargs["fetch"]() is mock_cidrs.return_value
+    mock_cidrs.assert_called_once_with(None, "http")
+    assert kwargs["interval"] == WATCH_INTERVAL
+    assert kwargs["reconcile_interval"] == DEFAULT_RECONCILE_INTERVAL
+    # Two syncs, still only one client per project.
+    kwargs["sync"](MagicMock())
+    kwargs["sync"](MagicMock())
+    assert mock_make_client.call_count == len(mock_projects.return_value)
+    used = [c.kwargs["client"] for c in mock_update_project.call_args_list]
+    assert used == clients * 2
+
+    # SIGTERM and SIGINT end the loop gracefully.
+    handlers = {c.args[0]: c.args[1] for c in mock_signal.call_args_list}
+    assert set(handlers) == {signal.SIGTERM, signal.SIGINT}
+    handlers[signal.SIGTERM](signal.SIGTERM, None)
+    assert kwargs["stop"].is_set()
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--watch", "60", "--engine", "async"])
+@patch(
+    "cf_ips_to_hcloud_fw.config.load_projects",
+    return_value=[Project(token=SecretStr("token-1"), firewalls=["fw-1"])],
+)
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.__main__.signal.signal", MagicMock())
+@patch("cf_ips_to_hcloud_fw.firewall_async.KeptAliveEngine")
+@patch("cf_ips_to_hcloud_fw.watch.watch")
+def test_main_watch_async_engine(
+    mock_watch: MagicMock, mock_engine: MagicMock, mock_projects: MagicMock
+) -> None:
+    """Watch mode drives the async engine it keeps alive across syncs."""
+    mock_engine.return_value.sync.return_value = [ProjectOutcome([], [])]
+    main()
+    cf_cidrs = MagicMock()
+    sync = mock_watch.call_args.kwargs["sync"]
+    assert sync(cf_cidrs) == [ProjectOutcome([], [])]
+    sync(cf_cidrs)
+    mock_engine.assert_called_once_with(
+        max_in_flight=16, max_sources=DEFAULT_MAX_RULE_SOURCES
+    )
+    assert mock_engine.return_value.sync.call_args_list == [
+        call(mock_projects.return_value, cf_cidrs)
+    ] * len(["first", "second"])
+    # The loop has ended, so its client and event loop are closed.
+    mock_engine.return_value.close.assert_called_once_with()
+
+
+@patch(
+    "sys.argv",
+    ["cf-ips-to-hcloud-fw", "--watch", "60", "--engine", "async", "--timings"],
+)
+@patch(
+    "cf_ips_to_hcloud_fw.config.load_projects",
+    MagicMock(return_value=[Project(token=SecretStr("token-1"), firewalls=["fw-1"])]),
+)
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.__main__.signal.signal", MagicMock())
+@patch("cf_ips_to_hcloud_fw.__main__.enable_timings", MagicMock())
+@patch("cf_ips_to_hcloud_fw.firewall_async.KeptAliveEngine")
+@patch("cf_ips_to_hcloud_fw.__main__.timing_summary", return_value=[])
+@patch("cf_ips_to_hcloud_fw.watch.watch")
+def test_main_watch_logs_timings_per_sync(
+    mock_watch: MagicMock, mock_summary: MagicMock, mock_engine: MagicMock
+) -> None:
+    """In watch mode each sync is followed by its own timing summary."""
+    engine_sync = mock_engine.return_value.sync
+    engine_sync.return_value = [ProjectOutcome(skipped=[], failed=[])]
+    main()
+    mock_summary.assert_not_called()
+    sync = mock_watch.call_args.kwargs["sync"]
+    assert sync(MagicMock()) == engine_sync.return_value
+    sync(MagicMock())
+    assert mock_summary.call_count == engine_sync.call_count
+
+
+def test_metrics_port_requires_watch() -> None:
+    """Serving metrics only makes sense for a process that keeps running."""
+    with (
+        patch("sys.argv", ["cf-ips-to-hcloud-fw", "--metrics-port", "9464"]),
+        pytest.raises(SystemExit) as e,
+    ):
+        main()
+    assert e.value.code == ARGPARSE_USAGE_ERROR
+
+
+def test_deadline_conflicts_with_watch() -> None:
+    """A deadline bounds one run; watch mode never ends."""
+    with (
+        patch(
+            "sys.argv",
+            ["cf-ips-to-hcloud-fw", "--deadline", str(DEADLINE), "--watch", "60"],
+        ),
+        pytest.raises(SystemExit) as e,
+    ):
+        main()
+    assert e.value.code == ARGPARSE_USAGE_ERROR
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--deadline", "300"])
+@patch(
+    "cf_ips_to_hcloud_fw.config.load_projects",
+    MagicMock(return_value=[Project(token=SecretStr("token-1"), firewalls=["fw-1"])]),
+)
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
+@patch(
+    "cf_ips_to_hcloud_fw.firewall.update_project",
+    return_value=ProjectOutcome(skipped=[], failed=[]),
+)
+@patch("cf_ips_to_hcloud_fw.__main__.RUN_DEADLINE")
+def test_main_starts_the_deadline(
+    mock_deadline: MagicMock, mock_update_project: MagicMock
+) -> None:
+    """The clock starts before the ranges are fetched, so it bounds the whole run."""
+    main()
+    mock_deadline.start.assert_called_once_with(DEADLINE)
+    mock_update_project.assert_called_once()
+
+
+def test_plan_conflicts_with_watch() -> None:
+    """A plan is a one-shot report; watch mode would overwrite it forever."""
+    with (
+        patch(
+            "sys.argv",
+            ["cf-ips-to-hcloud-fw", "--plan", "plan.json", "--watch", "60"],
+        ),
+        pytest.raises(SystemExit) as e,
+    ):
+        main()
+    assert e.value.code == ARGPARSE_USAGE_ERROR
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--plan", "plan.json"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects")
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs")
+@patch("cf_ips_to_hcloud_fw.firewall.plan_project")
+@patch("cf_ips_to_hcloud_fw.plan.write_plan")
+@patch("cf_ips_to_hcloud_fw.__main__.sync_projects")
+def test_main_plan_writes_plan_without_syncing(
+    mock_sync: MagicMock,
+    mock_write_plan: MagicMock,
+    mock_plan_project: MagicMock,
+    mock_cidrs: MagicMock,
+    mock_projects: MagicMock,
+) -> None:
+    """--plan plans every project, writes the file and never syncs."""
+    projects = [
+        Project(token=SecretStr(f"token-{i}"), firewalls=[f"fw-{i}"])
+        for i in range(1, 3)
+    ]
+    mock_projects.return_value = projects
+    mock_plan_project.return_value.outcome = ProjectOutcome([], [])
+
+    main()
+
+    assert mock_plan_project.call_count == len(projects)
+    mock_plan_project.assert_called_with(
+        project=projects[1],
+        cf_cidrs=mock_cidrs.return_value,
+        project_index=2,
+        max_sources=DEFAULT_MAX_RULE_SOURCES,
+    )
+    mock_write_plan.assert_called_once_with(
+        "plan.json",
+        mock_cidrs.return_value,
+        [mock_plan_project.return_value] * len(projects),
+        max_sources=DEFAULT_MAX_RULE_SOURCES,
+    )
+    mock_sync.assert_not_called()
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--plan", "plan.json", "--timings"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects")
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.firewall.plan_project")
+@patch("cf_ips_to_hcloud_fw.plan.write_plan", MagicMock())
+@patch("cf_ips_to_hcloud_fw.__main__.timing_summary", return_value=["t"])
+def test_main_plan_reports_failed_lookups(
+    mock_summary: MagicMock, mock_plan_project: MagicMock, mock_projects: MagicMock
+) -> None:
+    """Lookups that failed while planning fail the run, after the plan is written."""
+    mock_projects.return_value = [
+        Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+    ]
+    mock_plan_project.return_value.outcome = ProjectOutcome([], ["project 1:'fw-1'"])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 1
+    mock_summary.assert_called_once_with()
+
+
+@pytest.mark.parametrize("other", [["--plan", "plan.json"], ["--watch", "60"]])
+def test_apply_plan_conflicts(other: list[str]) -> None:
+    """--apply-plan runs a saved plan once and can't also make or repeat one."""
+    with (
+        patch(
+            "sys.argv",
+            ["cf-ips-to-hcloud-fw", "--apply-plan", "plan.json", *other],
+        ),
+        pytest.raises(SystemExit) as e,
+    ):
+        main()
+    assert e.value.code == ARGPARSE_USAGE_ERROR
+
+
+def _write_test_plan(
+    path: Path, names: list[str], *, index: int = 1
+) -> CloudflareCIDRs:
+    """Write a plan that wants every named firewall updated.
+
+    Args:
+        path: Where to write the plan.
+        names: Firewalls of the planned project.
+        index: Config index of the planned project.
+
+    Returns:
+        CloudflareCIDRs: The ranges stored in the plan.
+    """
+    cidrs = CloudflareCIDRs(
+        ipv4_cidrs=["198.27.128.0/21"], ipv6_cidrs=["2400:cb00::/32"]
+    )
+    plan = ProjectPlan(
+        index=index,
+        outcome=ProjectOutcome([], []),
+        firewalls=[
+            FirewallPlan(name, 1, needs_update=True, rules=[]) for name in names
+        ],
+    )
+    with patch("logging.info"):
+        write_plan(str(path), cidrs, [plan], max_sources=MAX_SOURCES)
+    return cidrs
+
+
+@patch("cf_ips_to_hcloud_fw.config.load_projects")
+@patch("cf_ips_to_hcloud_fw.firewall.apply_project_plan")
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs")
+def test_main_apply_plan_pushes_the_saved_plan(
+    mock_cidrs: MagicMock,
+    mock_apply: MagicMock,
+    mock_projects: MagicMock,
+    tmp_path: Path,
+) -> None:
+    """--apply-plan uses the plan's ranges and limit and never fetches new ones."""
+    target = tmp_path / "plan.json"
+    cidrs = _write_test_plan(target, ["fw-2"], index=2)
+    projects = [
+        Project(token=SecretStr(f"token-{i}"), firewalls=[f"fw-{i}"])
+        for i in range(1, 3)
+    ]
+    mock_projects.return_value = projects
+    mock_apply.return_value = ProjectOutcome([], [])
+
+    with patch("sys.argv", ["cf-ips-to-hcloud-fw", "--apply-plan", str(target)]):
+        main()
+
+    mock_apply.assert_called_once_with(
+        project=projects[1],
+        firewalls=[FirewallPlan("fw-2", 1, needs_update=True, rules=[])],
+        cf_cidrs=cidrs,
+        project_index=2,
+        max_sources=MAX_SOURCES,
+    )
+    mock_cidrs.assert_not_called()
+
+
+@patch("cf_ips_to_hcloud_fw.config.load_projects")
+@patch("cf_ips_to_hcloud_fw.firewall.apply_project_plan")
+def test_main_apply_plan_reports_failures(
+    mock_apply: MagicMock, mock_projects: MagicMock, tmp_path: Path
+) -> None:
+    """Firewalls that changed since the plan fail the run."""
+    target = tmp_path / "plan.json"
+    _write_test_plan(target, ["fw-1"])
+    mock_projects.return_value = [
+        Project(token=SecretStr("token-1"), firewalls=["fw-1"])
+    ]
+    mock_apply.return_value = ProjectOutcome([], ["project 1:'fw-1'"])
+
+    with (
+        patch("sys.argv", ["cf-ips-to-hcloud-fw", "--apply-plan", str(target)]),
+        pytest.raises(SystemExit) as e,
+    ):
+        main()
+    assert e.value.code == 1
+
+
+@pytest.mark.parametrize(
+    ("planned", "message"),
+    [
+        ((["fw-1"], 2), "is for project 2, but the config lists 1"),
+        ((["fw-1", "fw-x"], 1), "has firewalls ['fw-x'] that project 1 doesn't list"),
+    ],
+)
+@patch(
+    "cf_ips_to_hcloud_fw.config.load_projects",
+    MagicMock(return_value=[Project(token=SecretStr("token-1"), firewalls=["fw-1"])]),
+)
+@patch("cf_ips_to_hcloud_fw.firewall.apply_project_plan")
+@patch("logging.error")
+def test_main_apply_plan_refuses_a_plan_for_another_config(
+    mock_logging: MagicMock,
+    mock_apply: MagicMock,
+    planned: tuple[list[str], int],
+    message: str,
+    tmp_path: Path,
+) -> None:
+    """A plan that doesn't fit the config is refused before anything is pushed."""
+    target = tmp_path / "plan.json"
+    names, index = planned
+    _write_test_plan(target, names, index=index)
+    with (
+        patch("sys.argv", ["cf-ips-to-hcloud-fw", "--apply-plan", str(target)]),
+        pytest.raises(SystemExit) as e,
+    ):
+        main()
+    assert e.value.code == 1
+    mock_logging.assert_called_once_with(f"Plan {str(target)!r} {message}")
+    mock_apply.assert_not_called()
+
+
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("logging.error")
+def test_main_apply_plan_unreadable(mock_logging: MagicMock, tmp_path: Path) -> None:
+    """A missing plan file ends the run with an error."""
+    target = tmp_path / "missing.json"
+    with (
+        patch("sys.argv", ["cf-ips-to-hcloud-fw", "--apply-plan", str(target)]),
+        pytest.raises(SystemExit) as e,
+    ):
+        main()
+    assert e.value.code == 1
+    assert mock_logging.call_args.args[0].startswith(
+        f"Couldn't read plan {str(target)!r}: "
+    )
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--metrics-textfile", "cf.prom"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("cf_ips_to_hcloud_fw.__main__.write_textfile")
+def test_main_writes_metrics_textfile_on_failure(mock_write: MagicMock) -> None:
+    """The textfile is written even when the run ends early."""
+    with (
+        patch(
+            "cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs",
+            side_effect=SystemExit(1),
+        ),
+        pytest.raises(SystemExit),
+    ):
+        main()
+    mock_write.assert_called_once_with("cf.prom")
+
+
+@patch("sys.argv", ["cf-ips-to-hcloud-fw", "--metrics-textfile", "cf.prom"])
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.__main__.LAST_SYNC")
+@patch("cf_ips_to_hcloud_fw.__main__.write_textfile")
+def test_main_writes_metrics_textfile(
+    mock_write: MagicMock, mock_last_sync: MagicMock
+) -> None:
+    """A one-shot run records the sync time and writes the textfile once."""
+    main()
+    mock_last_sync.set.assert_called_once()
+    mock_write.assert_called_once_with("cf.prom")
+
+
+@patch(
+    "sys.argv",
+    [
+        "cf-ips-to-hcloud-fw",
+        "--watch",
+        "60",
+        "--engine",
+        "async",
+        "--metrics-port",
+        str(METRICS_PORT),
+        "--metrics-textfile",
+        "cf.prom",
+    ],
+)
+@patch(
+    "cf_ips_to_hcloud_fw.config.load_projects",
+    MagicMock(return_value=[Project(token=SecretStr("token-1"), firewalls=["fw-1"])]),
+)
+@patch("cf_ips_to_hcloud_fw.cloudflare.get_cloudflare_cidrs", MagicMock())
+@patch("cf_ips_to_hcloud_fw.__main__.signal.signal", MagicMock())
+@patch(
+    "cf_ips_to_hcloud_fw.firewall_async.KeptAliveEngine",
+    MagicMock(**{"return_value.sync.return_value": [ProjectOutcome([], [])]}),
+)
+@patch("cf_ips_to_hcloud_fw.__main__.serve_metrics")
+@patch("cf_ips_to_hcloud_fw.__main__.write_textfile")
+@patch("cf_ips_to_hcloud_fw.watch.watch")
+def test_main_watch_exports_metrics(
+    mock_watch: MagicMock, mock_write: MagicMock, mock_serve: MagicMock
+) -> None:
+    """Watch mode serves metrics while it runs and refreshes the textfile."""
+    main()
+    mock_serve.assert_called_once_with(DEFAULT_METRICS_HOST, METRICS_PORT)
+    mock_serve.return_value.shutdown.assert_called_once_with()
+    mock_serve.return_value.server_close.assert_called_once_with()
+    # Once at exit ...
+    mock_write.assert_called_once_with("cf.prom")
+    # ... and after every sync.
+    mock_watch.call_args.kwargs["sync"](MagicMock())
+    assert mock_write.call_count == len(["exit", "sync"])
+
+
+@patch(
+    "sys.argv",
+    ["cf-ips-to-hcloud-fw", "--watch", "60", "--metrics-port", str(METRICS_PORT)],
+)
+@patch("cf_ips_to_hcloud_fw.config.load_projects", MagicMock(return_value=[]))
+@patch("cf_ips_to_hcloud_fw.__main__.signal.signal", MagicMock())
+@patch(
+    "cf_ips_to_hcloud_fw.__main__.serve_metrics",
+    side_effect=OSError("Address already in use"),
+)
+@patch("cf_ips_to_hcloud_fw.watch.watch")
+@patch("logging.error")
+def test_main_watch_metrics_port_in_use(
+    mock_error: MagicMock, mock_watch: MagicMock, mock_serve: MagicMock
+) -> None:
+    """A port that cannot be bound ends the run before watching starts."""
+    with pytest.raises(SystemExit):
+        main()
+    mock_serve.assert_called_once()
+    mock_watch.assert_not_called()
+    mock_error.assert_called_once_with(
+        f"Couldn't serve metrics on {DEFAULT_METRICS_HOST}:{METRICS_PORT}: "
+        "Address already in use"
+    )
@@ -0,0 +1,218 @@
+"""Tests for the Prometheus metrics and their exposition."""
+
+from __future__ import annotations
+
+import os
+import urllib.error
+import urllib.request
+from typing import TYPE_CHECKING
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from cf_ips_to_hcloud_fw.firewall import ProjectOutcome
+from cf_ips_to_hcloud_fw.metrics import (
+    API_REQUEST_DURATION,
+    API_REQUESTS,
+    CONTENT_TYPE,
+    FIREWALLS,
+    Counter,
+    Gauge,
+    Histogram,
+    _Metric,
+    count_project,
+    endpoint_label,
+    observe_request,
+    render,
+    serve_metrics,
+    write_textfile,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+WORLD_READABLE = 0o644
+HTTP_NOT_FOUND = 404
+STARTED = 10.0
+ELAPSED = 0.25
+
+
+@pytest.fixture
+def registry() -> Iterator[list[object]]:
+    """Give the test its own metric registry.
+
+    Yields:
+        list[object]: The registry metrics created in the test register into.
+    """
+    fresh: list[object] = []
+    with patch("cf_ips_to_hcloud_fw.metrics._REGISTRY", fresh):
+        yield fresh
+
+
+def test_counter(registry: list[object]) -> None:
+    """Counters export one sample per label set, with escaped values."""
+    del registry
+    requests = Counter("requests_total", "Requests.", ("endpoint", "status"))
+    requests.inc("/firewalls", "200")
+    requests.inc("/firewalls", "200", amount=2)
+    requests.inc('/odd"\\\n', "error")
+    assert requests.value("/firewalls", "200") == len(["first", "second", "third"])
+    assert render().splitlines() == [
+        "# HELP cf_ips_to_hcloud_fw_requests_total Requests.",
+        "# TYPE cf_ips_to_hcloud_fw_requests_total counter",
+        'cf_ips_to_hcloud_fw_requests_total{endpoint="/firewalls",status="200"} 3',
+        r'cf_ips_to_hcloud_fw_requests_total{endpoint="/odd\"\\\n",status="error"} 1',
+    ]
+
+
+def test_unlabelled_counter_starts_at_zero(registry: list[object]) -> None:
+    """An unlabelled counter is exported before its first increment."""
+    del registry
+    Counter("rules_total", "Rules.")
+    assert render().splitlines()[-1] == "cf_ips_to_hcloud_fw_rules_total 0"
+
+
+def test_wrong_label_count(registry: list[object]) -> None:
+    """Label values have to match the label names."""
+    del registry
+    counter = Counter("requests_total", "Requests.", ("endpoint",))
+    with pytest.raises(ValueError, match="takes labels"):
+        counter.inc()
+
+
+def test_metric_type_must_render_samples(registry: list[object]) -> None:
+    """A metric type that can't render its samples can't be created."""
+
+    class Incomplete(_Metric):
+        kind = "gauge"
+
+    with pytest.raises(TypeError, match="samples"):
+        Incomplete("incomplete", "Incomplete.", ())  # ty: ignore[call-non-callable]
+    assert registry == []
+
+
+def test_gauge(registry: list[object]) -> None:
+    """A gauge has no sample until it is set."""
+    del registry
+    gauge = Gauge("last_sync_timestamp_seconds", "Last sync.")
+    assert render().splitlines()[-1].startswith("# TYPE")
+    gauge.set(1.5)
+    assert render().splitlines()[-1] == (
+        "cf_ips_to_hcloud_fw_last_sync_timestamp_seconds 1.5"
+    )
+
+
+@patch("cf_ips_to_hcloud_fw.metrics.time.perf_counter")
+def test_histogram(mock_clock: MagicMock, registry: list[object]) -> None:
+    """Buckets are cumulative and inclusive; sum and count follow."""
+    del registry
+    histogram = Histogram("wait_seconds", "Wait.", ("kind",), buckets=(0.5, 1.0))
+    histogram.observe(0.5, "a")
+    histogram.observe(3.0, "a")
+    mock_clock.side_effect = [STARTED, STARTED + ELAPSED]
+    with histogram.time("a"):
+        pass
+    assert render().splitlines()[2:] == [
+        'cf_ips_to_hcloud_fw_wait_seconds_bucket{kind="a",le="0.5"} 2',
+        'cf_ips_to_hcloud_fw_wait_seconds_bucket{kind="a",le="1"} 2',
+        'cf_ips_to_hcloud_fw_wait_seconds_bucket{kind="a",le="+Inf"} 3',
+        f'cf_ips_to_hcloud_fw_wait_seconds_sum{{kind="a"}} {0.5 + 3.0 + ELAPSED!r}',
+        'cf_ips_to_hcloud_fw_wait_seconds_count{kind="a"} 3',
+    ]
+
+
+@pytest.mark.parametrize(
+    ("path", "expected"),
+    [
+        ("https://api.hetzner.cloud/v1/firewalls?name=a", "/firewalls"),
+        ("http://127.0.0.1:8080/v1/actions/123", "/actions/{id}"),
+        ("/firewalls/42/actions/set_rules", "/firewalls/{id}/actions/set_rules"),
+        ("/firewalls", "/firewalls"),
+    ],
+)
+def test_endpoint_label(path: str, expected: str) -> None:
+    """URLs and relative paths map onto the same bounded set of endpoints."""
+    assert endpoint_label(path) == expected
+
+
+def test_observe_request() -> None:
+    """A request is counted by endpoint, method and status, and timed."""
+    endpoint = "/certificates/{id}"
+    before = API_REQUESTS.value(endpoint, "GET", "503")
+    observe_request("GET", "/certificates/7", "503", ELAPSED)
+    assert API_REQUESTS.value(endpoint, "GET", "503") == before + 1
+    assert any(
+        line.startswith(f'{API_REQUEST_DURATION.name}_count{{endpoint="{endpoint}"}}')
+        for line in API_REQUEST_DURATION.samples()
+    )
+
+
+def test_count_project() -> None:
+    """Firewalls are counted by result; the rest of the configured ones synced."""
+    results = ("synced", "skipped", "failed", "untouched")
+    before = {r: FIREWALLS.value(r) for r in results}
+    count_project(
+        len(["fw-1", "fw-2", "fw-3", "fw-4", "fw-5"]),
+        ProjectOutcome(
+            skipped=["project 1:'fw-2'"],
+            failed=["project 1:'fw-3'"],
+            untouched=("project 1:'fw-5'",),
+        ),
+    )
+    assert FIREWALLS.value("synced") == before["synced"] + len(["fw-1", "fw-4"])
+    assert FIREWALLS.value("skipped") == before["skipped"] + 1
+    assert FIREWALLS.value("failed") == before["failed"] + 1
+    assert FIREWALLS.value("untouched") == before["untouched"] + 1
+
+
+def test_write_textfile(tmp_path: Path, registry: list[object]) -> None:
+    """The textfile is replaced atomically and readable by node_exporter."""
+    del registry
+    Counter("rules_total", "Rules.")
+    target = tmp_path / "cf-ips.prom"
+    target.write_text("stale")
+    write_textfile(str(target))
+    assert target.read_text() == render()
+    if os.name == "posix":
+        assert target.stat().st_mode & 0o777 == WORLD_READABLE
+    assert [p.name for p in tmp_path.iterdir()] == ["cf-ips.prom"]
+
+
+@patch("logging.warning")
+def test_write_textfile_failure(mock_warning: MagicMock, tmp_path: Path) -> None:
+    """A failed write is logged and leaves no temporary file behind."""
+    target = tmp_path / "cf-ips.prom"
+    with patch("pathlib.Path.replace", side_effect=OSError("read-only")):
+        write_textfile(str(target))
+    mock_warning.assert_called_once_with(
+        f"Couldn't write metrics file {str(target)!r}: read-only"
+    )
+    assert list(tmp_path.iterdir()) == []
+
+
+@patch("logging.warning")
+def test_write_textfile_missing_directory(
+    mock_warning: MagicMock, tmp_path: Path
+) -> None:
+    """A missing directory fails before any temporary file exists."""
+    target = tmp_path / "missing" / "cf-ips.prom"
+    write_textfile(str(target))
+    mock_warning.assert_called_once()
+
+
+@patch("logging.info", MagicMock())
+def test_serve_metrics() -> None:
+    """The exposition is served at /metrics and nowhere else."""
+    server = serve_metrics("127.0.0.1", 0)
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with urllib.request.urlopen(f"{base}/metrics") as response:  # ruff:ignore[suspicious-url-open-usage]
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            assert "# TYPE cf_ips_to_hcloud_fw_" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f"{base}/")  # ruff:ignore[suspicious-url-open-usage]
+        assert e.value.code == HTTP_NOT_FOUND
+    finally:
+        server.shutdown()
+        server.server_close()
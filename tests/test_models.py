@@ -2,12 +2,26 @@
 
 from __future__ import annotations
 
-from ipaddress import IPv4Network, ip_network
+from ipaddress import IPv4Network, IPv6Network, ip_network
 
 import pytest
 from pydantic import SecretStr, TypeAdapter, ValidationError
 
-from cf_ips_to_hcloud_fw.models import CloudflareIPNetworks, Project
+from cf_ips_to_hcloud_fw.models import (
+    _RESERVED_IPV4,
+    _RESERVED_IPV4_INTERVALS,
+    _RESERVED_IPV6,
+    _RESERVED_IPV6_INTERVALS,
+    CloudflareCIDRs,
+    CloudflareIPNetworks,
+    Project,
+    SourceList,
+    _find_unroutable,
+    _interval,
+    _reserved_intervals,
+    _sweep_overlaps,
+    cidr_key,
+)
 
 # Every CIDR Cloudflare publishes today, as a guard against the routability
 # check rejecting a real response. The live list bottoms out at /13 for IPv4
@@ -202,6 +216,193 @@ def test_no_accepted_ipv4_range_can_contain_private_space() -> None:
     assert checked > 0  # the sweep actually exercised accepted ranges
 
 
+def test_interval_overlap_matches_ipaddress() -> None:
+    """The sweep names exactly the blocks ``overlaps()`` would.
+
+    Every /8 and /12 of IPv4, every /12 of 2000::/3, and each reserved block
+    with the blocks around it is checked against a plain scan of the
+    reserved tables, so both the verdict and the blocks the error message
+    names stay as they were before the tables were indexed.
+    """
+    candidates: list[IPv4Network | IPv6Network] = [
+        IPv4Network((base, prefixlen))
+        for prefixlen in (8, 12)
+        for base in range(0, 2**32, 2 ** (32 - prefixlen))
+    ]
+    candidates += IPv6Network("2000::/3").subnets(new_prefix=12)
+    for block in _RESERVED_IPV4 + _RESERVED_IPV6:
+        around = block.supernet(prefixlen_diff=2)
+        candidates += [block, around, *around.subnets(prefixlen_diff=3)]
+    for table, intervals in (
+        (_RESERVED_IPV4, _RESERVED_IPV4_INTERVALS),
+        (_RESERVED_IPV6, _RESERVED_IPV6_INTERVALS),
+    ):
+        nets = [net for net in candidates if net.version == table[0].version]
+        # Reversed, so the sweep has to sort and report in input order.
+        nets.reverse()
+        swept = _sweep_overlaps(intervals, [_interval(net) for net in nets])
+        for net, overlapping in zip(nets, swept, strict=True):
+            expected = [str(block) for block in table if net.overlaps(block)]
+            assert overlapping == expected, str(net)
+
+
+def test_overlap_message_names_every_block() -> None:
+    """An aggregate over several reserved blocks names all of them."""
+    [(_, error)] = _find_unroutable([IPv4Network("192.0.0.0/8")])
+    assert str(error) == (
+        "192.0.0.0/8 is not globally routable: overlaps reserved space "
+        "(192.0.0.0/24, 192.0.2.0/24, 192.31.196.0/24, 192.52.193.0/24, "
+        "192.88.99.0/24, 192.168.0.0/16, 192.175.48.0/24)"
+    )
+
+
+def test_find_unroutable() -> None:
+    """A whole list of either IP version is checked, reporting every offender."""
+    networks = [ip_network(c) for c in PUBLISHED_IPV6_CIDRS + PUBLISHED_IPV4_CIDRS]
+    assert _find_unroutable(networks) == []
+    found = _find_unroutable([
+        *networks,
+        IPv4Network("192.168.0.0/16"),
+        IPv6Network("fc00::/7"),
+        IPv4Network("10.0.0.0/8"),
+    ])
+    # In input order, not address order.
+    assert [(i - len(networks), str(e).split()[0]) for i, e in found] == [
+        (0, "192.168.0.0/16"),
+        (1, "fc00::/7"),
+        (2, "10.0.0.0/8"),
+    ]
+
+
+def test_cloudflare_ip_networks_reports_every_bad_entry() -> None:
+    """Each bad entry gets its own error at its index, parse errors included."""
+    with pytest.raises(ValidationError) as e:
+        CloudflareIPNetworks(
+            ipv4_cidrs=["10.0.0.0/8", "198.27.128.0/21", "bad", "0.0.0.0/0"],
+            ipv6_cidrs=["2400:cb00::/32", "fe80::/10"],
+        )
+    assert [(err["loc"], err["input"], err["type"]) for err in e.value.errors()] == [
+        (("ipv4_cidrs", 0), "10.0.0.0/8", "value_error"),
+        (("ipv4_cidrs", 2), "bad", "ip_v4_network"),
+        (("ipv4_cidrs", 3), "0.0.0.0/0", "value_error"),
+        (("ipv6_cidrs", 1), "fe80::/10", "value_error"),
+    ]
+
+
+def test_cloudflare_ip_networks_rejects_a_non_list() -> None:
+    """Input that is not a list at all fails before any entry is checked."""
+    with pytest.raises(ValidationError) as e:
+        CloudflareIPNetworks.model_validate({
+            "ipv4_cidrs": "198.27.128.0/21",
+            "ipv6_cidrs": ["2400:cb00::/32"],
+        })
+    assert [err["type"] for err in e.value.errors()] == ["list_type"]
+
+
+def test_reserved_intervals_refuse_nested_blocks() -> None:
+    """Overlapping table entries would break the sweep, so they fail loudly."""
+    with pytest.raises(ValueError, match=r"10\.1\.0\.0/16 overlaps 10\.0\.0\.0/8"):
+        _reserved_intervals([IPv4Network("10.1.0.0/16"), IPv4Network("10.0.0.0/8")])
+
+
+def test_to_cidrs_carries_canonical_strings_and_networks() -> None:
+    """One parse yields sorted canonical strings and the networks behind them."""
+    networks = CloudflareIPNetworks(
+        ipv4_cidrs=["199.27.128.0/21", "198.27.128.0/21"],
+        ipv6_cidrs=["2606:4700:0::/32", "2400:CB00::/32"],
+    )
+    cidrs = networks.to_cidrs()
+    assert cidrs.ipv4_cidrs == ["198.27.128.0/21", "199.27.128.0/21"]
+    assert cidrs.ipv6_cidrs == ["2400:cb00::/32", "2606:4700::/32"]
+    assert cidrs.ipv4_networks[0] is networks.ipv4_cidrs[1]
+    assert [str(n) for n in cidrs.ipv6_networks] == cidrs.ipv6_cidrs
+    # The networks are neither serialized nor compared.
+    plain = CloudflareCIDRs(
+        ipv4_cidrs=cidrs.ipv4_cidrs.copy(), ipv6_cidrs=cidrs.ipv6_cidrs.copy()
+    )
+    assert plain == cidrs
+    assert cidrs.model_dump() == plain.model_dump()
+
+
+def test_cidrs_parse_networks_on_first_use() -> None:
+    """A model built from strings, e.g. from the cache, parses them lazily."""
+    cidrs = CloudflareCIDRs(
+        ipv4_cidrs=["198.27.128.0/21"], ipv6_cidrs=["2400:cb00::/32"]
+    )
+    assert cidrs.ipv4_networks == [IPv4Network("198.27.128.0/21")]
+    assert cidrs.ipv6_networks == [IPv6Network("2400:cb00::/32")]
+    assert cidrs.ipv4_networks is cidrs.ipv4_networks
+
+
+def test_collapsed_merges_adjacent_and_nested_ranges() -> None:
+    """Collapsing keeps the address space and drops redundant entries."""
+    cidrs = CloudflareCIDRs(
+        ipv4_cidrs=["104.16.0.0/13", "104.24.0.0/14", "104.28.0.0/14", "104.17.0.0/16"],
+        ipv6_cidrs=["2400:cb00::/33", "2400:cb00:8000::/33", "2606:4700::/32"],
+    )
+    collapsed = cidrs.collapsed()
+    assert collapsed.ipv4_cidrs == ["104.16.0.0/12"]
+    assert collapsed.ipv6_cidrs == ["2400:cb00::/32", "2606:4700::/32"]
+    assert [str(n) for n in collapsed.ipv6_networks] == collapsed.ipv6_cidrs
+    assert cidrs.collapsed().collapsed() == collapsed
+
+
+@pytest.mark.parametrize(
+    "spelling",
+    ["2400:cb00::/32", "2400:CB00::/32", "2400:cb00:0:0::/32", "2400:cb00::1/32"],
+)
+def test_cidr_key_ignores_spelling(spelling: str) -> None:
+    """Every spelling of a network, host bits included, gives the same key."""
+    assert cidr_key(spelling) == cidr_key("2400:cb00::/32")
+
+
+def test_cidr_key_sorts_numerically() -> None:
+    """Keys order by version, address and prefix length, not as strings."""
+    cidrs = ["2400:cb00::/32", "10.0.0.0/8", "9.0.0.0/8", "10.0.0.0/16"]
+    assert sorted(cidrs, key=cidr_key) == [
+        "9.0.0.0/8",
+        "10.0.0.0/8",
+        "10.0.0.0/16",
+        "2400:cb00::/32",
+    ]
+
+
+def test_cidr_key_keeps_unparsable_strings() -> None:
+    """A string that is not a network only equals itself."""
+    assert cidr_key("127.1/32") == (0, 0, 0, "127.1/32")
+    assert cidr_key("127.1/32") != cidr_key("127.0.0.1/32")
+
+
+def test_from_networks_sorts_by_address() -> None:
+    """Ranges are ordered numerically, so 9.x comes before 10.x."""
+    cidrs = CloudflareCIDRs.from_networks(
+        [IPv4Network("10.0.0.0/8"), IPv4Network("9.0.0.0/8")],
+        [IPv6Network("2a06:98c0::/29"), IPv6Network("2400:cb00::/32")],
+    )
+    assert cidrs.ipv4_cidrs == ["9.0.0.0/8", "10.0.0.0/8"]
+    assert cidrs.ipv6_cidrs == ["2400:cb00::/32", "2a06:98c0::/29"]
+
+
+def test_source_lists_are_built_once() -> None:
+    """Each marker's desired list and set are built once and then reused."""
+    cidrs = CloudflareCIDRs(
+        ipv4_cidrs=["198.27.128.0/21"], ipv6_cidrs=["2400:cb00::/32"]
+    )
+    both = ["198.27.128.0/21", "2400:cb00::/32"]
+    assert cidrs.source_lists == {
+        (True, False): SourceList(
+            ["198.27.128.0/21"], frozenset(map(cidr_key, ["198.27.128.0/21"])), "IPv4"
+        ),
+        (False, True): SourceList(
+            ["2400:cb00::/32"], frozenset(map(cidr_key, ["2400:cb00::/32"])), "IPv6"
+        ),
+        (True, True): SourceList(both, frozenset(map(cidr_key, both)), "IPv4+IPv6"),
+    }
+    assert cidrs.source_lists is cidrs.source_lists
+    # Not a field: the cache file and equality are unaffected.
+    assert "source_lists" not in cidrs.model_dump()
+
+
 def test_project_valid() -> None:
     """Project model accepts valid configuration."""
     project = Project(token=SecretStr("my-token"), firewalls=["fw-1", "fw-2"])
@@ -0,0 +1,126 @@
+"""Tests for the plan document written by --plan and read by --apply-plan."""
+
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pydantic import ValidationError
+
+from cf_ips_to_hcloud_fw.firewall import (
+    CF_IPV4,
+    FirewallPlan,
+    ProjectOutcome,
+    ProjectPlan,
+    RuleChange,
+)
+from cf_ips_to_hcloud_fw.models import CloudflareCIDRs
+from cf_ips_to_hcloud_fw.plan import (
+    PLAN_VERSION,
+    plan_document,
+    read_plan,
+    write_plan,
+)
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+CIDRS = CloudflareCIDRs(ipv4_cidrs=["198.27.128.0/21"], ipv6_cidrs=["2400:cb00::/32"])
+MAX_SOURCES = 100
+CHANGE = RuleChange(
+    description=CF_IPV4,
+    protocol="tcp",
+    port="443",
+    current=["192.0.2.0/24"],
+    desired=["198.27.128.0/21"],
+    added=["198.27.128.0/21"],
+    removed=["192.0.2.0/24"],
+)
+PLANS = [
+    ProjectPlan(
+        index=1,
+        outcome=ProjectOutcome(skipped=["project 1:'fw-9'"], failed=[]),
+        firewalls=[
+            FirewallPlan(name="fw-1", id=1, needs_update=True, rules=[CHANGE]),
+            FirewallPlan(name="fw-2", id=2, needs_update=False, rules=[]),
+        ],
+    )
+]
+
+
+def test_plan_document_lists_every_firewall_and_rule() -> None:
+    """The document carries the ranges, the limit and each rule's delta."""
+    document = plan_document(CIDRS, PLANS, max_sources=MAX_SOURCES)
+
+    assert document["version"] == PLAN_VERSION
+    assert document["cidrs"] == CIDRS.model_dump()
+    assert document["max_rule_sources"] == MAX_SOURCES
+    assert document["projects"] == [
+        {
+            "index": 1,
+            "skipped": ["project 1:'fw-9'"],
+            "failed": [],
+            "firewalls": [
+                {
+                    "name": "fw-1",
+                    "id": 1,
+                    "needs_update": True,
+                    "rules": [CHANGE._asdict()],
+                },
+                {"name": "fw-2", "id": 2, "needs_update": False, "rules": []},
+            ],
+        }
+    ]
+
+
+@patch("logging.info")
+def test_write_plan(mock_logging: MagicMock, tmp_path: Path) -> None:
+    """The plan is written as JSON and summarized in the log."""
+    target = tmp_path / "plan.json"
+
+    write_plan(str(target), CIDRS, PLANS, max_sources=MAX_SOURCES)
+
+    document = json.loads(target.read_text())
+    assert document["projects"][0]["firewalls"][0]["rules"][0]["added"] == [
+        "198.27.128.0/21"
+    ]
+    mock_logging.assert_called_once_with(
+        f"Wrote plan to {str(target)!r}: 1 of 2 firewalls would be updated"
+    )
+
+
+def test_read_plan_round_trips(tmp_path: Path) -> None:
+    """A written plan reads back with the same ranges and firewalls."""
+    target = tmp_path / "plan.json"
+    write_plan(str(target), CIDRS, PLANS, max_sources=MAX_SOURCES)
+
+    plan = read_plan(str(target))
+
+    assert plan.cidrs.to_cidrs() == CIDRS
+    assert plan.max_rule_sources == MAX_SOURCES
+    assert [p.index for p in plan.projects] == [1]
+    assert plan.projects[0].firewalls == PLANS[0].firewalls
+
+
+def test_read_plan_rejects_other_versions(tmp_path: Path) -> None:
+    """A plan from an incompatible version is refused."""
+    target = tmp_path / "plan.json"
+    document = plan_document(CIDRS, PLANS, max_sources=MAX_SOURCES)
+    document["version"] = PLAN_VERSION + 1
+    target.write_text(json.dumps(document))
+
+    with pytest.raises(ValueError, match="is not supported"):
+        read_plan(str(target))
+
+
+def test_read_plan_rejects_private_ranges(tmp_path: Path) -> None:
+    """Ranges in a plan pass the same routability check as fetched ones."""
+    target = tmp_path / "plan.json"
+    document = plan_document(CIDRS, PLANS, max_sources=MAX_SOURCES)
+    document["cidrs"]["ipv4_cidrs"] = ["10.0.0.0/8"]
+    target.write_text(json.dumps(document))
+
+    with pytest.raises(ValidationError):
+        read_plan(str(target))
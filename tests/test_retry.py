@@ -0,0 +1,150 @@
+"""Tests for the retry policy shared by both sync engines."""
+
+from __future__ import annotations
+
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from cf_ips_to_hcloud_fw.deadline import RUN_DEADLINE
+from cf_ips_to_hcloud_fw.retry import (
+    BACKOFF_BASE,
+    BACKOFF_CAP,
+    MAX_ATTEMPTS,
+    RETRY_BUDGET,
+    RetryBudget,
+    is_retryable,
+    next_retry,
+    retry_after,
+)
+
+NOW = 1_000_000_000.0
+RETRY_AFTER = 7.0
+BUDGET = 2
+
+
+def _error(code: str) -> bytes:
+    return json.dumps({"error": {"code": code, "message": "x"}}).encode()
+
+
+@pytest.mark.parametrize(
+    ("status_code", "content", "expected"),
+    [
+        pytest.param(200, b"{}", False, id="ok"),
+        pytest.param(429, b"", True, id="too-many-requests"),
+        pytest.param(503, b"<html>", True, id="unavailable-status"),
+        pytest.param(423, _error("locked"), True, id="locked"),
+        pytest.param(409, _error("conflict"), True, id="conflict"),
+        pytest.param(500, _error("server_error"), True, id="server-error"),
+        pytest.param(422, _error("invalid_input"), False, id="invalid-input"),
+        pytest.param(404, _error("not_found"), False, id="not-found"),
+        pytest.param(500, b"<html>", False, id="no-error-object"),
+        pytest.param(500, b"[]", False, id="not-an-object"),
+    ],
+)
+def test_is_retryable(status_code: int, content: bytes, *, expected: bool) -> None:
+    """Transient statuses and error codes are retried, everything else is not."""
+    assert is_retryable(status_code, content) is expected
+
+
+@pytest.mark.parametrize(
+    ("headers", "expected"),
+    [
+        pytest.param({}, None, id="missing"),
+        pytest.param({"Retry-After": "7"}, RETRY_AFTER, id="seconds"),
+        pytest.param({"Retry-After": "-3"}, 0.0, id="negative"),
+        pytest.param(
+            {"Retry-After": "Sun, 09 Sep 2001 01:46:47 GMT"}, RETRY_AFTER, id="date"
+        ),
+        pytest.param({"Retry-After": "soon"}, None, id="garbage"),
+    ],
+)
+@patch("cf_ips_to_hcloud_fw.retry.time.time", MagicMock(return_value=NOW))
+def test_retry_after(headers: dict[str, str], expected: float | None) -> None:
+    """Both forms of Retry-After are read; anything else is ignored."""
+    assert retry_after(headers) == expected
+
+
+@patch("cf_ips_to_hcloud_fw.retry.random.uniform", return_value=0.5)
+@patch("logging.info")
+def test_next_retry_backs_off_with_full_jitter(
+    mock_info: MagicMock, mock_uniform: MagicMock
+) -> None:
+    """Without Retry-After the wait is drawn from a doubling, capped window."""
+    RETRY_BUDGET.reset(MAX_ATTEMPTS)
+
+    delays = [next_retry("GET /x", attempt, "503") for attempt in range(1, 4)]
+
+    assert delays == [0.5] * len(delays)
+    windows = [c.args for c in mock_uniform.call_args_list]
+    assert windows == [(0, BACKOFF_BASE), (0, BACKOFF_BASE * 2), (0, BACKOFF_BASE * 4)]
+    mock_info.assert_any_call(
+        "Hetzner API GET /x failed (503), retrying in 0.5s (attempt 2 of 4)"
+    )
+
+
+def test_next_retry_window_is_capped() -> None:
+    """Late attempts never wait longer than the cap."""
+    RETRY_BUDGET.reset(1)
+    with (
+        patch("cf_ips_to_hcloud_fw.retry.MAX_ATTEMPTS", 100),
+        patch(
+            "cf_ips_to_hcloud_fw.retry.random.uniform", return_value=1.0
+        ) as mock_uniform,
+    ):
+        next_retry("GET /x", 20, "503")
+    mock_uniform.assert_called_once_with(0, BACKOFF_CAP)
+
+
+def test_next_retry_honors_retry_after() -> None:
+    """A short Retry-After is waited for instead of the backoff."""
+    RETRY_BUDGET.reset(1)
+    assert next_retry("GET /x", 1, "429", {"Retry-After": "7"}) == RETRY_AFTER
+
+
+def test_next_retry_gives_up() -> None:
+    """Out of attempts, or told to wait too long, the failure is reported."""
+    RETRY_BUDGET.reset(MAX_ATTEMPTS)
+    assert next_retry("GET /x", MAX_ATTEMPTS, "503") is None
+    too_long = {"Retry-After": str(int(BACKOFF_CAP) + 1)}
+    assert next_retry("GET /x", 1, "429", too_long) is None
+
+
+@patch("cf_ips_to_hcloud_fw.retry.API_RETRIES")
+@patch("logging.warning")
+def test_next_retry_draws_from_the_budget(
+    mock_warning: MagicMock, mock_retries: MagicMock
+) -> None:
+    """Once the budget is spent nothing is retried, with one warning."""
+    RETRY_BUDGET.reset(BUDGET)
+
+    delays = [next_retry("GET /x", 1, "503") for _ in range(BUDGET + 2)]
+
+    assert [d is not None for d in delays] == [True] * BUDGET + [False] * 2
+    assert mock_retries.inc.call_count == BUDGET
+    mock_warning.assert_called_once()
+
+
+@patch("logging.warning")
+def test_zero_budget_does_not_warn(mock_warning: MagicMock) -> None:
+    """With retries turned off, running out is expected and not logged."""
+    budget = RetryBudget(0)
+    assert budget.take() is False
+    budget.reset(1)
+    assert budget.take() is True
+    assert budget.take() is False
+    mock_warning.assert_called_once()
+
+
+@patch("cf_ips_to_hcloud_fw.retry.API_RETRIES")
+def test_next_retry_stops_at_the_deadline(mock_retries: MagicMock) -> None:
+    """A wait that would end past the deadline is not started."""
+    RETRY_BUDGET.reset(1)
+    RUN_DEADLINE.start(RETRY_AFTER - 1)
+
+    assert next_retry("GET /x", 1, "429", {"Retry-After": str(RETRY_AFTER)}) is None
+
+    mock_retries.inc.assert_not_called()
+    # The budget is left for requests that still have time.
+    assert RETRY_BUDGET.take() is True
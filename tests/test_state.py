@@ -0,0 +1,225 @@
+"""Tests for the owner-only JSON helpers and the applied-state store."""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import TYPE_CHECKING
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pydantic import SecretStr
+
+from cf_ips_to_hcloud_fw.firewall import MAX_RULE_SOURCES, ProjectOutcome
+from cf_ips_to_hcloud_fw.models import CloudflareCIDRs, Project
+from cf_ips_to_hcloud_fw.state import (
+    AppliedState,
+    cidrs_fingerprint,
+    read_private_json,
+    write_private_json,
+)
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+OWNER_ONLY = 0o600
+HOUR = 3600.0
+NOW = 1_000_000.0
+
+CIDRS = CloudflareCIDRs(ipv4_cidrs=["198.27.128.0/21"], ipv6_cidrs=["2400:cb00::/32"])
+PROJECTS = [
+    Project(token=SecretStr("token-1"), firewalls=["fw-1", "fw-2"]),
+    Project(token=SecretStr("token-2"), firewalls=["fw-1"]),
+]
+
+
+def test_write_private_json_is_owner_only_and_atomic(tmp_path: Path) -> None:
+    """The document replaces the target in one rename, readable by owner only."""
+    target = tmp_path / "doc.json"
+    target.write_text("old")
+    write_private_json(target, {"a": 1})
+    assert read_private_json(target) == {"a": 1}
+    if os.name == "posix":
+        assert target.stat().st_mode & 0o777 == OWNER_ONLY
+    assert [p.name for p in tmp_path.iterdir()] == ["doc.json"]
+
+
+def test_write_private_json_cleans_up_on_failure(tmp_path: Path) -> None:
+    """A failed write leaves neither a temporary file nor a changed target."""
+    target = tmp_path / "doc.json"
+    with (
+        patch("pathlib.Path.replace", side_effect=OSError("disk full")),
+        pytest.raises(OSError, match="disk full"),
+    ):
+        write_private_json(target, {"a": 1})
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions only")
+def test_read_private_json_refuses_writable_file(tmp_path: Path) -> None:
+    """A file group or others can write to is not trusted."""
+    target = tmp_path / "doc.json"
+    target.write_text("{}")
+    target.chmod(0o620)
+    with pytest.raises(PermissionError, match=r"insecure permissions \(620\)"):
+        read_private_json(target)
+
+
+def test_read_private_json_requires_object(tmp_path: Path) -> None:
+    """Only a JSON object is accepted."""
+    target = tmp_path / "doc.json"
+    target.write_text("[]")
+    target.chmod(OWNER_ONLY)
+    with pytest.raises(TypeError, match="expected a JSON object, got list"):
+        read_private_json(target)
+
+
+def test_cidrs_fingerprint_ignores_order() -> None:
+    """Only the membership of each list counts, not the order it arrived in."""
+    reordered = CloudflareCIDRs(
+        ipv4_cidrs=["199.27.128.0/21", "198.27.128.0/21"],
+        ipv6_cidrs=["2400:cb00::/32"],
+    )
+    sorted_ = CloudflareCIDRs(
+        ipv4_cidrs=["198.27.128.0/21", "199.27.128.0/21"],
+        ipv6_cidrs=["2400:cb00::/32"],
+    )
+    assert cidrs_fingerprint(reordered, MAX_RULE_SOURCES) == cidrs_fingerprint(
+        sorted_, MAX_RULE_SOURCES
+    )
+    assert cidrs_fingerprint(CIDRS, MAX_RULE_SOURCES) != cidrs_fingerprint(
+        sorted_, MAX_RULE_SOURCES
+    )
+
+
+def test_cidrs_fingerprint_covers_the_rule_cap() -> None:
+    """Another --max-rule-sources splits the rules differently."""
+    assert cidrs_fingerprint(CIDRS, MAX_RULE_SOURCES) != cidrs_fingerprint(
+        CIDRS, MAX_RULE_SOURCES - 1
+    )
+
+
+def _record_all(state: AppliedState, fingerprint: str) -> None:
+    outcomes = [ProjectOutcome(skipped=[], failed=[]) for _ in PROJECTS]
+    state.record(PROJECTS, outcomes, fingerprint)
+
+
+@patch("cf_ips_to_hcloud_fw.state.time.time", MagicMock(return_value=NOW))
+def test_applied_state_round_trip(tmp_path: Path) -> None:
+    """Recorded firewalls are skipped by the next run with the same ranges."""
+    state_file = str(tmp_path / "state.json")
+    fingerprint = cidrs_fingerprint(CIDRS, MAX_RULE_SOURCES)
+    state = AppliedState.load(state_file, reverify_after=HOUR)
+    assert state.pending(PROJECTS, fingerprint) == PROJECTS
+    _record_all(state, fingerprint)
+    state.save()
+
+    # The token never reaches the file, only a digest of it.
+    assert "token-1" not in (tmp_path / "state.json").read_text()
+
+    reloaded = AppliedState.load(state_file, reverify_after=HOUR)
+    pending = reloaded.pending(PROJECTS, fingerprint)
+    # Every project keeps its place, so project indices do not shift.
+    assert [p.firewalls for p in pending] == [[], []]
+    assert [p.token for p in pending] == [p.token for p in PROJECTS]
+
+
+@patch("cf_ips_to_hcloud_fw.state.time.time")
+def test_applied_state_reverifies_after_interval(
+    mock_time: MagicMock, tmp_path: Path
+) -> None:
+    """A firewall verified too long ago, or in the future, is checked again."""
+    fingerprint = cidrs_fingerprint(CIDRS, MAX_RULE_SOURCES)
+    state = AppliedState.load(str(tmp_path / "state.json"), reverify_after=HOUR)
+    mock_time.return_value = NOW
+    _record_all(state, fingerprint)
+
+    mock_time.return_value = NOW + HOUR - 1
+    assert state.pending(PROJECTS, fingerprint)[0].firewalls == []
+    mock_time.return_value = NOW + HOUR
+    assert state.pending(PROJECTS, fingerprint) == PROJECTS
+    mock_time.return_value = NOW - 1
+    assert state.pending(PROJECTS, fingerprint) == PROJECTS
+
+
+def test_applied_state_new_ranges_sync_everything(tmp_path: Path) -> None:
+    """A different fingerprint means every firewall is synced again."""
+    state = AppliedState.load(str(tmp_path / "state.json"), reverify_after=HOUR)
+    _record_all(state, "old")
+    assert state.pending(PROJECTS, "new") == PROJECTS
+
+
+def test_applied_state_skips_failed_and_missing(tmp_path: Path) -> None:
+    """Failed and not-found firewalls are never recorded as matching."""
+    state = AppliedState.load(str(tmp_path / "state.json"), reverify_after=HOUR)
+    _record_all(state, "fp")
+    outcomes = [
+        ProjectOutcome(skipped=["project 1:'fw-2'"], failed=["project 1:'fw-1'"]),
+        ProjectOutcome(skipped=[], failed=[]),
+    ]
+    state.record(PROJECTS, outcomes, "fp")
+    pending = state.pending(PROJECTS, "fp")
+    assert [p.firewalls for p in pending] == [["fw-1", "fw-2"], []]
+
+
+def test_applied_state_skips_untouched(tmp_path: Path) -> None:
+    """Firewalls the deadline cut off were never checked and aren't recorded."""
+    state = AppliedState.load(str(tmp_path / "state.json"), reverify_after=HOUR)
+    _record_all(state, "fp")
+    outcomes = [
+        ProjectOutcome(skipped=[], failed=[]),
+        ProjectOutcome(skipped=[], failed=[], untouched=("project 2:'fw-1'",)),
+    ]
+    state.record(PROJECTS, outcomes, "fp")
+    pending = state.pending(PROJECTS, "fp")
+    assert [p.firewalls for p in pending] == [[], ["fw-1"]]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        pytest.param("{not json", id="malformed"),
+        pytest.param("{}", id="missing-firewalls"),
+        pytest.param('{"firewalls": 1}', id="bad-shape"),
+    ],
+)
+@patch("logging.warning")
+def test_applied_state_ignores_broken_file(
+    mock_warning: MagicMock, tmp_path: Path, content: str
+) -> None:
+    """A broken state file is reported and treated as empty."""
+    state_file = tmp_path / "state.json"
+    state_file.write_text(content)
+    state_file.chmod(OWNER_ONLY)
+    state = AppliedState.load(str(state_file), reverify_after=HOUR)
+    assert state.pending(PROJECTS, "fp") == PROJECTS
+    mock_warning.assert_called_once()
+    assert "Ignoring state file" in mock_warning.call_args[0][0]
+
+
+def test_applied_state_ignores_malformed_entries(tmp_path: Path) -> None:
+    """Entries of the wrong shape count as not verified."""
+    state = AppliedState.load(str(tmp_path / "state.json"), reverify_after=HOUR)
+    _record_all(state, "fp")
+    state.save()
+    document = json.loads((tmp_path / "state.json").read_text())
+    first, second = list(document["firewalls"])[:2]
+    document["firewalls"][first] = "garbage"
+    document["firewalls"][second]["verified_at"] = "yesterday"
+    write_private_json(tmp_path / "state.json", document)
+
+    pending = AppliedState.load(
+        str(tmp_path / "state.json"), reverify_after=HOUR
+    ).pending(PROJECTS, "fp")
+    assert [p.firewalls for p in pending] == [["fw-1", "fw-2"], []]
+
+
+@patch("logging.warning")
+def test_applied_state_save_failure_is_a_warning(
+    mock_warning: MagicMock, tmp_path: Path
+) -> None:
+    """A state file that cannot be written does not fail the run."""
+    state_file = tmp_path / "missing" / "state.json"
+    AppliedState.load(str(state_file), reverify_after=HOUR).save()
+    mock_warning.assert_called_once()
+    assert "Couldn't write state file" in mock_warning.call_args[0][0]
@@ -0,0 +1,120 @@
+"""Tests for the phase timers and the run summary."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from cf_ips_to_hcloud_fw.timing import (
+    SLOWEST_FIREWALLS,
+    Timing,
+    Timings,
+    enable_timings,
+    record_timing,
+    timed,
+    timing_summary,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+CALLS = 20
+STARTED = 100.0
+ELAPSED = 0.25
+
+
+@pytest.fixture
+def timings() -> Iterator[Timings]:
+    """Swap in a fresh, enabled registry.
+
+    Yields:
+        Timings: The registry the module functions record into.
+    """
+    fresh = Timings()
+    fresh.enable()
+    with patch("cf_ips_to_hcloud_fw.timing._TIMINGS", fresh):
+        yield fresh
+
+
+def test_disabled_by_default() -> None:
+    """Nothing is kept until recording is enabled."""
+    registry = Timings()
+    registry.add("set_rules", 1.0)
+    assert registry.drain() == []
+    registry.enable()
+    registry.add("set_rules", 1.0)
+    assert registry.drain() == [Timing("set_rules", 1.0, None)]
+    assert registry.drain() == []
+
+
+def test_enable_timings() -> None:
+    """``enable_timings`` switches the shared registry on."""
+    registry = Timings()
+    with patch("cf_ips_to_hcloud_fw.timing._TIMINGS", registry):
+        enable_timings()
+    assert registry.enabled is True
+
+
+@patch("cf_ips_to_hcloud_fw.timing.time.perf_counter")
+def test_timed_records_on_success_and_error(
+    mock_clock: MagicMock, timings: Timings
+) -> None:
+    """A block is timed whether it returns or raises."""
+    mock_clock.side_effect = [STARTED, STARTED + ELAPSED] * 2
+    with timed("get_by_name", "project 1:'a'"):
+        pass
+    failing_call = MagicMock(side_effect=RuntimeError)
+    with pytest.raises(RuntimeError), timed("set_rules", "project 1:'a'"):
+        failing_call()
+    assert timings.drain() == [
+        Timing("get_by_name", ELAPSED, "project 1:'a'"),
+        Timing("set_rules", ELAPSED, "project 1:'a'"),
+    ]
+
+
+def test_timing_summary(timings: Timings) -> None:
+    """Phases keep first-run order; firewalls are ranked by total time."""
+    del timings
+    record_timing("cf_ips_list", 0.5)
+    for i in range(1, CALLS + 1):
+        record_timing("set_rules", i / 100, f"project 1:'fw-{i}'")
+    record_timing("wait_actions", 1.0, "project 1:'fw-1'")
+
+    lines = timing_summary()
+
+    assert lines == [
+        (
+            "Timing cf_ips_list: 1 call(s), 0.500s total, "
+            "p50 0.500s, p95 0.500s, max 0.500s"
+        ),
+        (
+            "Timing set_rules: 20 call(s), 2.100s total, "
+            "p50 0.100s, p95 0.190s, max 0.200s"
+        ),
+        (
+            "Timing wait_actions: 1 call(s), 1.000s total, "
+            "p50 1.000s, p95 1.000s, max 1.000s"
+        ),
+        (
+            "Slowest firewalls: project 1:'fw-1' 1.010s, "
+            "project 1:'fw-20' 0.200s, project 1:'fw-19' 0.190s, "
+            "project 1:'fw-18' 0.180s, project 1:'fw-17' 0.170s"
+        ),
+    ]
+    assert lines[-1].count("project") == SLOWEST_FIREWALLS
+    # The summary resets the registry.
+    assert timing_summary() == []
+
+
+def test_timing_summary_without_firewalls(timings: Timings) -> None:
+    """Without per-firewall calls there is no slowest-firewalls line."""
+    del timings
+    record_timing("load_projects", 0.001)
+    assert timing_summary() == [
+        (
+            "Timing load_projects: 1 call(s), 0.001s total, "
+            "p50 0.001s, p95 0.001s, max 0.001s"
+        )
+    ]
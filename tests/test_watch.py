@@ -0,0 +1,105 @@
+"""Tests for the long-running watch mode."""
+
+from __future__ import annotations
+
+import threading
+from unittest.mock import MagicMock, patch
+
+from cf_ips_to_hcloud_fw.firewall import ProjectOutcome
+from cf_ips_to_hcloud_fw.models import CloudflareCIDRs
+from cf_ips_to_hcloud_fw.watch import watch
+
+CIDRS_A = CloudflareCIDRs(ipv4_cidrs=["198.27.128.0/21"], ipv6_cidrs=["2400:cb00::/32"])
+CIDRS_B = CloudflareCIDRs(ipv4_cidrs=["199.27.128.0/21"], ipv6_cidrs=["2400:cb00::/32"])
+OK = [ProjectOutcome(skipped=[], failed=[])]
+
+
+def _run(
+    polls: list[CloudflareCIDRs | SystemExit],
+    sync: MagicMock,
+    *,
+    reconcile_interval: float = 3600,
+    clock: list[float] | None = None,
+) -> None:
+    """Run the watch loop for exactly ``len(polls)`` polls.
+
+    Args:
+        polls: What each fetch returns, or raises for a SystemExit.
+        sync: Mocked sync callable.
+        reconcile_interval: Seconds between full reconciles.
+        clock: Monotonic timestamps, two per poll (start and end).
+    """
+    stop = threading.Event()
+    remaining = list(polls)
+
+    def fetch() -> CloudflareCIDRs:
+        result = remaining.pop(0)
+        if not remaining:
+            stop.set()
+        if isinstance(result, SystemExit):
+            raise result
+        return result
+
+    times = iter(clock or [0.0] * (2 * len(polls)))
+    with patch("cf_ips_to_hcloud_fw.watch.time.monotonic", lambda: next(times)):
+        watch(
+            fetch=fetch,
+            sync=sync,
+            # No real sleeping: the clock is mocked, so any positive interval
+            # would block the test for that many seconds between polls.
+            interval=0,
+            reconcile_interval=reconcile_interval,
+            stop=stop,
+        )
+
+
+def test_watch_syncs_only_when_ranges_change() -> None:
+    """Unchanged ranges cost a Cloudflare poll but no Hetzner work."""
+    sync = MagicMock(return_value=OK)
+    _run([CIDRS_A, CIDRS_A, CIDRS_B, CIDRS_B], sync)
+    assert [c.args[0] for c in sync.call_args_list] == [CIDRS_A, CIDRS_B]
+
+
+def test_watch_reconciles_on_schedule() -> None:
+    """A full sync still runs once the reconcile interval has passed."""
+    sync = MagicMock(return_value=OK)
+    # Polls start at t=0, 60, 120; the reconcile is due from t=100.
+    _run(
+        [CIDRS_A, CIDRS_A, CIDRS_A],
+        sync,
+        reconcile_interval=100,
+        clock=[0.0, 0.0, 60.0, 60.0, 120.0, 120.0],
+    )
+    assert sync.call_count == len([0.0, 120.0])
+
+
+@patch("logging.error")
+def test_watch_retries_failed_sync(mock_logging: MagicMock) -> None:
+    """Failures are logged, and the next poll syncs again."""
+    failed = [ProjectOutcome(skipped=[], failed=["project 1:'fw-1'"])]
+    sync = MagicMock(side_effect=[failed, OK, OK])
+    _run([CIDRS_A, CIDRS_A, CIDRS_A], sync)
+    assert sync.call_count == len([failed, OK])
+    mock_logging.assert_called_once_with(
+        "Some firewalls were not updated (failed: project 1:'fw-1')"
+    )
+
+
+@patch("logging.error", MagicMock())
+def test_watch_not_found_is_not_retried() -> None:
+    """A missing firewall is reported but does not force a sync every poll."""
+    skipped = [ProjectOutcome(skipped=["project 1:'fw-1'"], failed=[])]
+    sync = MagicMock(return_value=skipped)
+    _run([CIDRS_A, CIDRS_A], sync)
+    sync.assert_called_once_with(CIDRS_A)
+
+
+@patch("logging.warning")
+def test_watch_survives_cloudflare_failure(mock_logging: MagicMock) -> None:
+    """A failed poll keeps the daemon alive and the rules untouched."""
+    sync = MagicMock(return_value=OK)
+    _run([SystemExit(1), CIDRS_A], sync)
+    sync.assert_called_once_with(CIDRS_A)
+    mock_logging.assert_called_once_with(
+        "Cloudflare poll failed; keeping current firewall rules"
+    )